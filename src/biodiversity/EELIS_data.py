@@ -1,31 +1,23 @@
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 import pandas as pd
 import os
 import requests
 
+from . import instrumentation, profiling
+from .browser import init_webdriver
+from .frames import iter_rows, merge_records
+from .get_extinct_species import join_incremental, species_diff_path, split_incremental, stamp_output
+from .taxa import ST3_COLUMNS, taxon_ruhm_values
+
+STAGE = "EELIS_data"
+
 
 def read_csv(file_path):
     """Read the CSV file and return a DataFrame."""
     return pd.read_csv(file_path)
 
 
-def init_webdriver(headless=True):
-    """Initialize the Selenium WebDriver using webdriver_manager."""
-    options = webdriver.ChromeOptions()
-    if headless:
-        options.add_argument("--headless")
-    driver = webdriver.Chrome(
-        service=Service(ChromeDriverManager().install()), options=options
-    )
-    wait = WebDriverWait(driver, 10)
-    return driver, wait
-
-
 def gather_table_data(driver, wait):
     """Extract all data from the table on the webpage and return as a dictionary."""
     table_data = {}
@@ -50,7 +42,7 @@ def gather_table_data(driver, wait):
     return table_data
 
 
-def check_and_download_strategy(driver, strategy_folder="strategy_materials"):
+def check_and_download_strategy(driver, strategy_folder="strategy_materials", stage=STAGE):
     """Check for links in the 'Liigi tegevuskava' section and download if they contain 'getdoc'."""
     strategy_present = False
     strategy_files = []
@@ -67,6 +59,7 @@ def check_and_download_strategy(driver, strategy_folder="strategy_materials"):
                 link.text.strip().replace("\n", " ") or "strategy_document"
             )
             response = requests.get(href)
+            instrumentation.record_http_response(stage, response)
 
             if response.status_code == 200:
                 with open(os.path.join(strategy_folder, file_name), "wb") as file:
@@ -79,77 +72,80 @@ def check_and_download_strategy(driver, strategy_folder="strategy_materials"):
     return strategy_present, strategy_files
 
 
-def process_csv_and_extract_data(
-    csv_file_path, updated_csv_file_path, headless=True, strategy_folder="strategy_materials"
-):
-    """Main function to read CSV, extract data from EELIS links, and save updated CSV."""
-    df = read_csv(csv_file_path)
-    driver, wait = init_webdriver(headless=headless)
+def add_strategy_columns(df):
+    """Add the strategy columns filled in by scrape_species_page if missing."""
+    if "strategy_present" not in df.columns:
+        df["strategy_present"] = False
+    if "strategy_file" not in df.columns:
+        df["strategy_file"] = None
+
 
-    all_columns = set(df.columns)
+def scrape_species_page(driver, wait, eelis_link, strategy_folder="strategy_materials", stage=STAGE):
+    """
+    Load a species' EELIS page and return its table data and strategy files as a record.
+    Requests are counted under ``stage``; counting the row is up to the caller.
+    """
+    driver.get(eelis_link)
+    instrumentation.increment(stage, "http_requests")
 
-    strategy_present_column = "strategy_present"
-    strategy_file_column = "strategy_file"
+    table_data = gather_table_data(driver, wait)
+
+    strategy_present, strategy_files = check_and_download_strategy(
+        driver, strategy_folder=strategy_folder, stage=stage
+    )
+    record = {"strategy_present": strategy_present}
+    if strategy_present:
+        record["strategy_file"] = "; ".join(strategy_files)
+
+    for key, value in table_data.items():
+        record[key.replace("\n", " ").strip()] = value.replace("\n", " ").strip()
+    return record
 
-    if strategy_present_column not in all_columns:
-        df[strategy_present_column] = False
 
-    if strategy_file_column not in all_columns:
-        df[strategy_file_column] = None
+def select_taxon_columns(df, taxon=None):
+    """Keep the rows of the run's taxon group(s) and the columns used downstream."""
+    # Columns no scraped page had (e.g. no species found at all) stay empty
+    df = df.reindex(columns=list(dict.fromkeys([*df.columns, *ST3_COLUMNS])))
+    return df[df["Rühm"].isin(taxon_ruhm_values(taxon))][list(ST3_COLUMNS)]
 
-    for idx, row in df.iterrows():
+
+def process_csv_and_extract_data(
+    csv_file_path, updated_csv_file_path, headless=True, strategy_folder="strategy_materials"
+):
+    """
+    Main function to read CSV, extract data from EELIS links, and save updated CSV.
+    Species unchanged since the previous output are not scraped again (see get_extinct_species.split_incremental).
+    """
+    species = read_csv(csv_file_path)
+    diff_path = species_diff_path(csv_file_path)
+    df, kept = split_incremental(species, updated_csv_file_path, diff_path)
+    df = df.copy()
+    add_strategy_columns(df)
+    if kept is not None:
+        instrumentation.increment(STAGE, "rows_skipped", len(kept))
+    driver, wait = init_webdriver(headless=headless) if len(df) else (None, None)
+
+    records = {}
+    for idx, row in iter_rows(df):
+        profiling.next_row()
         eelis_link = row["EELIS link"]
         if eelis_link == "NotFound":
+            instrumentation.increment(STAGE, "rows_skipped")
             continue
 
-        driver.get(eelis_link)
+        records[idx] = scrape_species_page(driver, wait, eelis_link, strategy_folder=strategy_folder)
+        instrumentation.increment(STAGE, "rows_processed")
 
-        table_data = gather_table_data(driver, wait)
-
-        strategy_present, strategy_files = check_and_download_strategy(
-            driver, strategy_folder=strategy_folder
-        )
-        df.at[idx, strategy_present_column] = strategy_present
-        if strategy_present:
-            df.at[idx, strategy_file_column] = "; ".join(strategy_files)
-
-        for key, value in table_data.items():
-            key = key.replace("\n", " ").strip()
-            value = value.replace("\n", " ").strip()
-            if key not in all_columns:
-                df[key] = None
-                all_columns.add(key)
-            df.at[idx, key] = value
-
-    driver.quit()
-
-    columns_to_keep = [
-        "Estonian Name",
-        "Latin Name",
-        "Category",
-        "EELIS link",
-        "strategy_present",
-        "strategy_file",
-        "Tüüp",
-        "Nimi ladina k",
-        "Nimi eesti k",
-        "Nimi inglise k",
-        "Rühm",
-        "Kaitsekategooria",
-        "Kirjeldus",
-        "Direktiivi lisad",
-        "Liigi ohustatuse hinnang",
-        "Ohutegurite kirjeldus",
-        "Liigi tegevuskava",
-        "Kaitsealused alad, kus on kaitse eesmärgiks",
-    ]
-
-    df = df[df["Rühm"] == "Linnud"][columns_to_keep]
+    if driver is not None:
+        driver.quit()
 
+    df = join_incremental(species, select_taxon_columns(merge_records(df, records)), kept)
     df.to_csv(updated_csv_file_path, index=False)
+    stamp_output(updated_csv_file_path, diff_path)
     print(f"Updated CSV saved to {updated_csv_file_path}")
 
 
+@profiling.profile_option(STAGE)
 def main(
     input_csv_path: str = "st2_EELIS_kaitsekategooria_selgroogsed_loomad.csv",
     output_csv_path: str = "st3_EELIS_additional_data.csv",
@@ -0,0 +1,205 @@
+"""
+Build the st2/st3 tables from a locally downloaded EELIS species registry export.
+
+Instead of searching and scraping EELIS one species at a time, the whole
+export (CSV or XML) is parsed once, indexed by normalised Latin name and
+joined to the st1 species list. Column names of the export are mapped to the
+names the scraper produces (``Nimi ladina k``, ``Kaitsekategooria``, ...).
+"""
+
+import os
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+import pandas as pd
+import requests
+
+from . import instrumentation, profiling
+from .EELIS_data import select_taxon_columns
+from .frames import iter_rows, merge_records
+
+STAGE = "EELIS_export"
+
+# st3 column -> accepted export column names (lower-case, underscores as spaces)
+EXPORT_COLUMN_ALIASES = {
+    "EELIS link": ("eelis link", "link", "url", "infoleht"),
+    "Tüüp": ("tüüp", "tyyp", "type"),
+    "Nimi ladina k": ("nimi ladina k", "ladinakeelne nimi", "latin name", "scientific name"),
+    "Nimi eesti k": ("nimi eesti k", "eestikeelne nimi", "estonian name"),
+    "Nimi inglise k": ("nimi inglise k", "ingliskeelne nimi", "english name"),
+    "Rühm": ("rühm", "ryhm", "group"),
+    "Kaitsekategooria": ("kaitsekategooria", "kaitse kategooria", "protection category"),
+    "Kirjeldus": ("kirjeldus", "description"),
+    "Direktiivi lisad": ("direktiivi lisad",),
+    "Liigi ohustatuse hinnang": ("liigi ohustatuse hinnang", "ohustatuse hinnang", "ohustatus"),
+    "Ohutegurite kirjeldus": ("ohutegurite kirjeldus", "ohutegurid"),
+    "Liigi tegevuskava": ("liigi tegevuskava", "tegevuskava"),
+    "Kaitsealused alad, kus on kaitse eesmärgiks": (
+        "kaitsealused alad, kus on kaitse eesmärgiks",
+        "kaitsealused alad",
+    ),
+}
+
+URL_PATTERN = re.compile(r"https?://\S+")
+# Attribute set on XML records that were read and cleared
+READ_RECORD_MARKER = "{EELIS_export}read"
+
+
+def normalise_column(name):
+    return re.sub(r"\s+", " ", str(name).replace("_", " ")).strip().lower()
+
+
+def latin_key(name):
+    """Join key for a Latin name: genus and species epithet, lower-cased, without authors."""
+    if not isinstance(name, str):
+        return None
+    words = re.sub(r"[^\w\s-]", " ", name).lower().split()
+    return " ".join(words[:2]) or None
+
+
+def read_xml_export(path):
+    """
+    Read an XML export into a DataFrame. Every element whose children are all
+    leaf elements is a record; child tags (or their ``name`` attribute) are the columns.
+    Records are cleared once read to keep memory flat and marked as such, so
+    their parent is not mistaken for a record of empty leaves.
+    """
+    records = []
+    for _, element in ET.iterparse(path, events=("end",)):
+        children = list(element)
+        if len(children) < 2 or any(len(child) or child.get(READ_RECORD_MARKER) for child in children):
+            continue
+        records.append({
+            child.get("name", child.tag): (child.text or "").strip()
+            for child in children
+        })
+        element.clear()
+        element.set(READ_RECORD_MARKER, "1")
+    return pd.DataFrame(records)
+
+
+def read_export(path):
+    """Read a CSV or XML registry export and rename its columns to the st3 names."""
+    if Path(path).suffix.lower() == ".xml":
+        export = read_xml_export(path)
+    else:
+        export = pd.read_csv(path, sep=None, engine="python", dtype=str)
+
+    renames = {}
+    for column in export.columns:
+        normalised = normalise_column(column)
+        for target, aliases in EXPORT_COLUMN_ALIASES.items():
+            if normalised in aliases or normalised == target.lower():
+                renames[column] = target
+                break
+    return export.rename(columns=renames)
+
+
+def build_latin_index(export):
+    """Hash index from Latin name key to the export record (first one wins)."""
+    index = {}
+    for record in export.to_dict("records"):
+        key = latin_key(record.get("Nimi ladina k"))
+        if key and key not in index:
+            index[key] = record
+    return index
+
+
+def download_strategy_documents(value, strategy_folder="strategy_materials"):
+    """Download the action plan documents linked in a ``Liigi tegevuskava`` value."""
+    strategy_files = []
+    if not isinstance(value, str):
+        return strategy_files
+    os.makedirs(strategy_folder, exist_ok=True)
+
+    for href in URL_PATTERN.findall(value):
+        file_name = Path(unquote(urlparse(href).path)).name or "strategy_document"
+        if not file_name.lower().endswith(".pdf"):
+            file_name += ".pdf"
+        try:
+            response = requests.get(href, timeout=60)
+            instrumentation.record_http_response(STAGE, response)
+        except requests.RequestException as e:
+            print(f"Error downloading strategy: {e}")
+            continue
+        if response.status_code == 200:
+            with open(os.path.join(strategy_folder, file_name), "wb") as file:
+                file.write(response.content)
+            strategy_files.append(file_name)
+    return strategy_files
+
+
+def import_registry_export(
+    csv_file_path,
+    export_path,
+    links_csv_file_path,
+    data_csv_file_path,
+    strategy_folder="strategy_materials",
+    download_strategies=True,
+):
+    """Join the st1 species to the export on Latin name and write the st2 and st3 files."""
+    df = pd.read_csv(csv_file_path)
+    export = read_export(export_path)
+    index = build_latin_index(export)
+    print(f"Indexed {len(index)} species from {export_path}")
+
+    records = []
+    for _, row in iter_rows(df):
+        record = index.get(latin_key(row["Latin Name"]))
+        if record is None:
+            instrumentation.increment(STAGE, "rows_not_found")
+            records.append({"EELIS link": "NotFound"})
+            continue
+        instrumentation.increment(STAGE, "rows_processed")
+        record = dict(record)
+        # Found species keep the export's page link, or none if it has no link column
+        record["EELIS link"] = record.get("EELIS link") or ""
+        records.append(record)
+
+    export_columns = pd.DataFrame(records, index=df.index)
+    df["EELIS link"] = export_columns["EELIS link"]
+    df.to_csv(links_csv_file_path, index=False)
+    print(f"Updated CSV saved to {links_csv_file_path}")
+
+    data = df.join(export_columns.drop(columns=[c for c in export_columns.columns if c in df.columns]))
+    data["strategy_present"] = False
+    data["strategy_file"] = None
+    if download_strategies and "Liigi tegevuskava" in data.columns:
+        strategies = {}
+        for idx, value in data["Liigi tegevuskava"].items():
+            strategy_files = download_strategy_documents(value, strategy_folder)
+            if strategy_files:
+                strategies[idx] = {"strategy_present": True, "strategy_file": "; ".join(strategy_files)}
+        data = merge_records(data, strategies)
+
+    for column in EXPORT_COLUMN_ALIASES:
+        if column not in data.columns:
+            data[column] = None
+    data = select_taxon_columns(data)
+    data.to_csv(data_csv_file_path, index=False)
+    print(f"Updated CSV saved to {data_csv_file_path}")
+
+
+@profiling.profile_option(STAGE)
+def main(
+    export_path: str = "eelis_species_export.csv",
+    input_csv_path: str = "st1_kaitsekategooria_selgroogsed_loomad.csv",
+    links_csv_path: str = "st2_EELIS_kaitsekategooria_selgroogsed_loomad.csv",
+    output_csv_path: str = "st3_EELIS_additional_data.csv",
+    strategy_folder: str = "strategy_materials",
+    download_strategies: bool = True,
+) -> None:
+    import_registry_export(
+        input_csv_path,
+        export_path,
+        links_csv_path,
+        output_csv_path,
+        strategy_folder=strategy_folder,
+        download_strategies=download_strategies,
+    )
+
+
+if __name__ == "__main__":
+    main()
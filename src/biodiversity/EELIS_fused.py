@@ -0,0 +1,89 @@
+import pandas as pd
+
+from . import instrumentation, profiling
+from .EELIS_data import add_strategy_columns, scrape_species_page, select_taxon_columns
+from .browser import init_webdriver
+from .frames import iter_rows, merge_records
+from .get_extinct_species import join_incremental, species_diff_path, split_incremental, stamp_output
+from .parse_EELIS_links import search_and_get_link
+
+STAGE = "EELIS_fused"
+
+
+def process_species_in_one_session(
+    csv_file_path,
+    links_csv_file_path,
+    data_csv_file_path,
+    url,
+    headless=True,
+    strategy_folder="strategy_materials",
+):
+    """
+    Resolve each species' EELIS link and scrape its page right away in one browser session.
+    Writes the same two files as parse_EELIS_links and EELIS_data. Species
+    unchanged since the previous outputs are reused from them.
+    """
+    species = pd.read_csv(csv_file_path)
+    diff_path = species_diff_path(csv_file_path)
+    df, kept_links = split_incremental(species, links_csv_file_path, diff_path)
+    _, kept_data = split_incremental(species, data_csv_file_path, diff_path)
+    if (kept_links is None) != (kept_data is None):
+        df, kept_links, kept_data = species, None, None
+    df = df.copy()
+    if kept_links is not None:
+        instrumentation.increment(STAGE, "rows_skipped", len(kept_links))
+    driver, wait = init_webdriver(headless=headless) if len(df) else (None, None)
+
+    links = {}
+    records = {}
+    try:
+        for idx, row in iter_rows(df):
+            profiling.next_row()
+            eelis_link = search_and_get_link(driver, wait, url, row["Estonian Name"], row["Latin Name"], stage=STAGE)
+            links[idx] = eelis_link
+            if eelis_link == "NotFound":
+                instrumentation.increment(STAGE, "rows_skipped")
+                continue
+
+            records[idx] = scrape_species_page(
+                driver, wait, eelis_link, strategy_folder=strategy_folder, stage=STAGE
+            )
+            instrumentation.increment(STAGE, "rows_processed")
+    finally:
+        if driver is not None:
+            driver.quit()
+
+    df["EELIS link"] = pd.Series(links, dtype=object)
+    scraped = df.copy()
+    add_strategy_columns(scraped)
+    scraped = select_taxon_columns(merge_records(scraped, records))
+
+    join_incremental(species, df, kept_links).to_csv(links_csv_file_path, index=False)
+    stamp_output(links_csv_file_path, diff_path)
+    print(f"Updated CSV saved to {links_csv_file_path}")
+    join_incremental(species, scraped, kept_data).to_csv(data_csv_file_path, index=False)
+    stamp_output(data_csv_file_path, diff_path)
+    print(f"Updated CSV saved to {data_csv_file_path}")
+
+
+@profiling.profile_option(STAGE)
+def main(
+    input_csv_path: str = "st1_kaitsekategooria_selgroogsed_loomad.csv",
+    links_csv_path: str = "st2_EELIS_kaitsekategooria_selgroogsed_loomad.csv",
+    output_csv_path: str = "st3_EELIS_additional_data.csv",
+    url: str = "https://infoleht.keskkonnainfo.ee/artikkel/1389049207",
+    headless: bool = True,
+    strategy_folder: str = "strategy_materials",
+) -> None:
+    process_species_in_one_session(
+        input_csv_path,
+        links_csv_path,
+        output_csv_path,
+        url,
+        headless=headless,
+        strategy_folder=strategy_folder,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from .get_extinct_species import main as get_extinct_species
 from .parse_EELIS_links import main as parse_EELIS_links
 from .EELIS_data import main as EELIS_data
+from .EELIS_fused import main as EELIS_fused
+from .EELIS_export import main as EELIS_export
 from .get_species_google_strategies import main as get_species_google_strategies
 from .prepare_strategy_files import main as prepare_strategy_files
 from .extract_and_process_reports import main as extract_and_process_reports
@@ -8,12 +10,15 @@ from .extract_birds_info_from_text import main as extract_birds_info_from_text
 from .extract_relevant_sections import main as extract_relevant_sections
 from .extract_sections_texts import main as extract_sections_texts
 from .extract_analysis_data import main as extract_analysis_data
+from .species_stream import main as species_stream
 
 
 __all__ = [
     "get_extinct_species",
     "parse_EELIS_links",
     "EELIS_data",
+    "EELIS_fused",
+    "EELIS_export",
     "get_species_google_strategies",
     "prepare_strategy_files",
     "extract_and_process_reports",
@@ -21,4 +26,5 @@ __all__ = [
     "extract_relevant_sections",
     "extract_sections_texts",
     "extract_analysis_data",
+    "species_stream",
 ]
\ No newline at end of file
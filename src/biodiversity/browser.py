@@ -0,0 +1,49 @@
+"""
+Shared Selenium setup for the EELIS stages.
+
+``ChromeDriverManager().install()`` checks the network for the matching
+driver on every call, so the resolved driver path is cached in a small file
+and reused while it exists. If Chrome cannot be started with the cached
+driver (e.g. after a browser update), the driver is resolved again.
+"""
+
+import os
+from pathlib import Path
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.support.ui import WebDriverWait
+from webdriver_manager.chrome import ChromeDriverManager
+
+DRIVER_PATH_CACHE = ".chromedriver_path"
+
+
+def driver_path(cache_file=DRIVER_PATH_CACHE, refresh=False):
+    """Return the chromedriver path, resolving it with webdriver_manager only when needed."""
+    override = os.getenv("CHROMEDRIVER_PATH")
+    if override:
+        return override
+
+    cache = Path(cache_file)
+    if not refresh and cache.is_file():
+        cached_path = cache.read_text(encoding="utf-8").strip()
+        if cached_path and os.access(cached_path, os.X_OK):
+            return cached_path
+
+    path = ChromeDriverManager().install()
+    cache.write_text(path, encoding="utf-8")
+    return path
+
+
+def init_webdriver(headless=True):
+    """Initialize the Selenium WebDriver with the cached driver path."""
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless")
+    try:
+        driver = webdriver.Chrome(service=Service(driver_path()), options=options)
+    except WebDriverException:
+        driver = webdriver.Chrome(service=Service(driver_path(refresh=True)), options=options)
+    wait = WebDriverWait(driver, 10)
+    return driver, wait
@@ -0,0 +1,259 @@
+"""
+Token budgets for the LLM stages.
+
+Budgets are counted from the ``usage`` field of chat completion responses and
+can be set for the whole run and per stage, either with ``configure`` or the
+environment variables:
+
+* ``LLM_RUN_TOKEN_BUDGET`` - total tokens for the run, e.g. ``2000000``
+* ``LLM_STAGE_TOKEN_BUDGETS`` - per stage, e.g.
+  ``extract_relevant_sections=500000,extract_birds_info_from_text=300000``
+* ``LLM_CHEAP_MODEL`` - model used once a budget is running low
+
+As a budget nears exhaustion the calls degrade in a fixed order:
+
+1. ``cheap_model`` - requests are sent to the cheaper model;
+2. ``prefilter`` - callers shrink their context with ``prefilter_text``;
+3. ``exhausted`` - ``BudgetExhausted`` is raised and the stage defers the
+   remaining rows to the next run (see ``save_deferred``/``load_deferred``).
+"""
+
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from . import instrumentation
+
+DEFAULT_CHEAP_MODEL = "gpt-4.1-nano"
+CHEAP_MODEL_FRACTION = 0.7  # share of a budget after which the cheap model is used
+PREFILTER_FRACTION = 0.85  # share of a budget after which context is pre-filtered
+CHARS_PER_TOKEN = 4
+DEFERRED_DIR = "deferred"
+
+LEVELS = ("normal", "cheap_model", "prefilter", "exhausted")
+
+
+class BudgetExhausted(Exception):
+    """Raised when an LLM call would exceed the run or stage token budget."""
+
+    def __init__(self, stage, remaining):
+        super().__init__(f"Token budget exhausted for stage '{stage}' ({remaining} tokens left)")
+        self.stage = stage
+        self.remaining = remaining
+
+
+def _parse_stage_budgets(value):
+    budgets = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        stage, tokens = item.split("=", 1)
+        budgets[stage.strip()] = int(tokens)
+    return budgets
+
+
+_lock = threading.Lock()
+_settings = {}
+_spent = {}
+# Estimates of the calls in flight, held from ensure_available until charge/release
+_reserved = {}
+
+
+def configure(run_tokens=None, stage_tokens=None, cheap_model=None):
+    """
+    Set the budgets for the current run. Unset values fall back to the environment.
+
+    :param run_tokens: Token budget for the whole run (None for unlimited).
+    :param stage_tokens: Dictionary of stage name -> token budget.
+    :param cheap_model: Model name used in the ``cheap_model`` level and below.
+    """
+    env_run = os.getenv("LLM_RUN_TOKEN_BUDGET")
+    with _lock:
+        _settings["run_tokens"] = run_tokens if run_tokens is not None else (int(env_run) if env_run else None)
+        _settings["stage_tokens"] = (
+            stage_tokens if stage_tokens is not None
+            else _parse_stage_budgets(os.getenv("LLM_STAGE_TOKEN_BUDGETS"))
+        )
+        _settings["cheap_model"] = cheap_model or os.getenv("LLM_CHEAP_MODEL", DEFAULT_CHEAP_MODEL)
+
+
+def reset():
+    """Forget the spent tokens and re-read the configuration."""
+    with _lock:
+        _spent.clear()
+        _reserved.clear()
+    configure()
+
+
+def _ensure_configured():
+    if not _settings:
+        configure()
+
+
+def spent(stage=None):
+    """Tokens charged so far for ``stage`` or, if omitted, for the whole run."""
+    with _lock:
+        if stage is None:
+            return sum(_spent.values())
+        return _spent.get(stage, 0)
+
+
+def remaining_tokens(stage):
+    """Smallest remaining allowance of the run and stage budgets (None if unlimited)."""
+    _ensure_configured()
+    remaining = []
+    if _settings["run_tokens"] is not None:
+        remaining.append(_settings["run_tokens"] - spent())
+    stage_budget = _settings["stage_tokens"].get(stage)
+    if stage_budget is not None:
+        remaining.append(stage_budget - spent(stage))
+    return min(remaining) if remaining else None
+
+
+def used_fraction(stage):
+    """Largest used share of the run and stage budgets (0.0 when unlimited)."""
+    _ensure_configured()
+    fractions = [0.0]
+    if _settings["run_tokens"]:
+        fractions.append(spent() / _settings["run_tokens"])
+    stage_budget = _settings["stage_tokens"].get(stage)
+    if stage_budget:
+        fractions.append(spent(stage) / stage_budget)
+    return max(fractions)
+
+
+def level(stage):
+    """Return the current degradation level of ``stage`` (one of ``LEVELS``)."""
+    fraction = used_fraction(stage)
+    if fraction >= 1.0:
+        return "exhausted"
+    if fraction >= PREFILTER_FRACTION:
+        return "prefilter"
+    if fraction >= CHEAP_MODEL_FRACTION:
+        return "cheap_model"
+    return "normal"
+
+
+def estimate_tokens(text):
+    return len(text or "") // CHARS_PER_TOKEN + 1
+
+
+def _unreserved_tokens(stage):
+    """Like ``remaining_tokens``, less the calls in flight; the caller holds ``_lock``."""
+    remaining = []
+    if _settings["run_tokens"] is not None:
+        remaining.append(_settings["run_tokens"] - sum(_spent.values()) - sum(_reserved.values()))
+    stage_budget = _settings["stage_tokens"].get(stage)
+    if stage_budget is not None:
+        remaining.append(stage_budget - _spent.get(stage, 0) - _reserved.get(stage, 0))
+    return min(remaining) if remaining else None
+
+
+def ensure_available(stage, estimated_tokens):
+    """
+    Raise ``BudgetExhausted`` if a call of ``estimated_tokens`` does not fit any
+    more, otherwise reserve the estimate until the call is charged or released.
+    The check and the reservation are one step, so concurrent calls cannot
+    together overspend the budget.
+    """
+    _ensure_configured()
+    exhausted = level(stage) == "exhausted"
+    with _lock:
+        remaining = _unreserved_tokens(stage)
+        fits = remaining is None or (not exhausted and estimated_tokens <= remaining)
+        if fits:
+            _reserved[stage] = _reserved.get(stage, 0) + estimated_tokens
+    if not fits:
+        instrumentation.increment(stage, "llm_budget_exhausted")
+        raise BudgetExhausted(stage, remaining)
+
+
+def release(stage, estimated_tokens):
+    """Drop the reservation of a call that failed before it could be charged."""
+    with _lock:
+        _reserved[stage] = max(0, _reserved.get(stage, 0) - estimated_tokens)
+
+
+def select_model(stage, model):
+    """Return the model to use for ``stage`` given its budget level."""
+    _ensure_configured()
+    if level(stage) in ("cheap_model", "prefilter"):
+        instrumentation.increment(stage, "llm_budget_degraded")
+        return _settings["cheap_model"]
+    return model
+
+
+def charge(stage, usage, estimated_tokens=0):
+    """
+    Charge the tokens of a response ``usage`` (or the estimate if usage is
+    missing) in place of the call's reservation.
+    """
+    if usage is None:
+        tokens = estimated_tokens
+    elif isinstance(usage, dict):
+        tokens = usage.get("total_tokens") or 0
+    else:
+        tokens = getattr(usage, "total_tokens", 0) or 0
+    with _lock:
+        _reserved[stage] = max(0, _reserved.get(stage, 0) - estimated_tokens)
+        _spent[stage] = _spent.get(stage, 0) + tokens
+
+
+def prefilter_text(stage, text, keywords=(), window=5):
+    """
+    Shrink ``text`` locally when ``stage`` is in the ``prefilter`` level.
+
+    Keeps the lines around keyword hits (or, without keywords, the lines that
+    contain letters) and truncates the result to half of the remaining budget.
+    Outside the ``prefilter`` level the text is returned unchanged.
+    """
+    if not text or level(stage) != "prefilter":
+        return text
+
+    lines = text.splitlines()
+    lowered_keywords = [k.lower() for k in keywords if k]
+    if lowered_keywords:
+        keep = set()
+        for i, line in enumerate(lines):
+            lowered = line.lower()
+            if any(k in lowered for k in lowered_keywords):
+                keep.update(range(max(0, i - window), min(len(lines), i + window + 1)))
+        kept_lines = [lines[i] for i in sorted(keep)]
+    else:
+        kept_lines = [line for line in lines if sum(c.isalpha() for c in line) > 3]
+
+    filtered = "\n".join(kept_lines)
+    remaining = remaining_tokens(stage)
+    if remaining is not None:
+        filtered = filtered[: max(0, remaining // 2) * CHARS_PER_TOKEN]
+    instrumentation.increment(stage, "llm_context_prefiltered")
+    return filtered
+
+
+### Deferred rows ###
+
+def deferred_path(stage, directory=DEFERRED_DIR):
+    return Path(directory) / f"{stage}.csv"
+
+
+def save_deferred(stage, rows, directory=DEFERRED_DIR):
+    """Store the rows a stage could not afford so the next run can pick them up."""
+    path = deferred_path(stage, directory)
+    if rows is None or len(rows) == 0:
+        if path.exists():
+            path.unlink()
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(rows).to_csv(path, index=False)
+    instrumentation.increment(stage, "rows_deferred", len(rows))
+    print(f"{len(rows)} rows deferred to the next run: {path}")
+
+
+def load_deferred(stage, directory=DEFERRED_DIR):
+    """Return the rows deferred by the previous run of ``stage`` or None."""
+    path = deferred_path(stage, directory)
+    if not path.is_file():
+        return None
+    return pd.read_csv(path)
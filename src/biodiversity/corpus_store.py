@@ -0,0 +1,156 @@
+"""
+Memory-mapped access to the ``_cleaned.txt`` corpus.
+
+A ``CorpusDocument`` maps a UTF-8 text file read-only and answers searches
+directly on the mapped bytes, so a plan is never loaded into a Python string
+as a whole. Results are ``TextSpan`` objects - (start, end) byte offsets into
+the document - that are only decoded when a consumer asks for the text.
+"""
+
+import mmap
+import re
+
+# Line boundaries as understood by str.splitlines(), encoded as UTF-8
+LINE_BREAK_PATTERN = re.compile(rb"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9]")
+
+
+def normalise_section_text(text):
+    """Lower-case a section text, normalise its line breaks to newlines and strip it."""
+    return "\n".join(text.splitlines()).lower().strip()
+
+
+def caseless_pattern(needle):
+    """
+    Compile a bytes regex matching the UTF-8 encoding of ``needle`` case-insensitively,
+    including non-ASCII letters such as õ/Õ, ä/Ä, ö/Ö and ü/Ü.
+    """
+    parts = []
+    for char in needle:
+        variants = {char, char.lower(), char.upper()}
+        variants = sorted(v.encode("utf-8") for v in variants if len(v) == 1)
+        if len(variants) == 1:
+            parts.append(re.escape(variants[0]))
+        else:
+            parts.append(b"(?:" + b"|".join(re.escape(v) for v in variants) + b")")
+    return re.compile(b"".join(parts))
+
+
+class TextSpan:
+    """A (start, end) byte range of a ``CorpusDocument``, decoded on demand."""
+
+    def __init__(self, document, start, end):
+        self.document = document
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"TextSpan({self.document.path!r}, {self.start}, {self.end})"
+
+    def view(self):
+        """Zero-copy memoryview of the span's bytes."""
+        return self.document.view()[self.start:self.end]
+
+    def text(self):
+        """Decode the span into a string."""
+        return bytes(self.view()).decode("utf-8", errors="replace")
+
+
+class CorpusDocument:
+    """Read-only memory map of a UTF-8 text document."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._file = open(self.path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self._map = b""
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._map)
+
+    def view(self):
+        return memoryview(self._map)
+
+    def span(self, start=0, end=None):
+        return TextSpan(self, start, len(self) if end is None else end)
+
+    def find(self, needle, start=0, end=None):
+        """Byte offset of the first exact occurrence of ``needle`` (str) or -1."""
+        end = len(self) if end is None else end
+        return self._map.find(needle.encode("utf-8"), start, end)
+
+    def find_caseless(self, needle, start=0, end=None):
+        """Byte offset of the first case-insensitive occurrence of ``needle`` or -1."""
+        end = len(self) if end is None else end
+        if start >= end:
+            return -1
+        match = caseless_pattern(needle).search(self._map, start, end)
+        return match.start() if match else -1
+
+    def find_words_caseless(self, text, start=0, end=None):
+        """
+        Like ``find_caseless`` for the words of ``text``, allowing any run of
+        whitespace (including line breaks) between them.
+        """
+        end = len(self) if end is None else end
+        words = text.split()
+        if not words or start >= end:
+            return -1
+        pattern = re.compile(rb"\s+".join(caseless_pattern(word).pattern for word in words))
+        match = pattern.search(self._map, start, end)
+        return match.start() if match else -1
+
+    def count_lines(self, end):
+        """Number of lines ``str.splitlines`` would return for the text before ``end``."""
+        breaks = 0
+        last_break_end = 0
+        for match in LINE_BREAK_PATTERN.finditer(self._map, 0, end):
+            breaks += 1
+            last_break_end = match.end()
+        return breaks + (1 if last_break_end < end else 0)
+
+    def line_offset(self, line_number):
+        """Byte offset where the 0-based ``line_number`` (as in ``splitlines``) starts."""
+        if line_number <= 0:
+            return 0
+        for count, match in enumerate(LINE_BREAK_PATTERN.finditer(self._map), start=1):
+            if count == line_number:
+                return match.end()
+        return len(self)
+
+    def page_end(self, start, pages=1):
+        """Offset just after the ``pages``-th form feed following ``start`` (or the end)."""
+        position = start
+        for _ in range(pages):
+            page_break = self._map.find(b"\f", position)
+            if page_break == -1:
+                return len(self)
+            position = page_break + 1
+        return position
+
+    def page_offsets(self):
+        """Start offsets of the form-feed separated pages, plus the document end."""
+        offsets = [0]
+        position = self._map.find(b"\f")
+        while position != -1:
+            offsets.append(position + 1)
+            position = self._map.find(b"\f", position + 1)
+        if offsets[-1] != len(self):
+            offsets.append(len(self))
+        return offsets
@@ -1,9 +1,21 @@
+import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-import shlex
 
+from . import instrumentation, profiling
+from .pdf_text import cleaned_txt_is_current, file_sha256, sidecar_path, stamp_cleaned_txt, write_layout_text
+
+STAGE = "extract_analysis_data"
+
+# "pymupdf" converts in-process, "pdftotext" runs the poppler CLI per file.
+PDF_BACKENDS = ("pymupdf", "pdftotext")
+
+
+def convert_pdf_to_txt(pdf_file_path, output_dir=None, backend="pymupdf") -> bool:
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f"Unknown PDF backend '{backend}', expected one of {PDF_BACKENDS}")
 
-def convert_pdf_to_txt(pdf_file_path, output_dir=None) -> bool:
     try:
         pdf_path = Path(pdf_file_path)
         output_directory = Path(output_dir) if output_dir else pdf_path.parent
@@ -17,8 +29,17 @@ def convert_pdf_to_txt(pdf_file_path, output_dir=None) -> bool:
 
         output_directory.mkdir(parents=True, exist_ok=True)
 
-        cmd = f"pdftotext -layout {shlex.quote(str(pdf_path))} {shlex.quote(str(txt_file_path))}"
-        subprocess.run(cmd, shell=True, check=True)
+        if backend == "pdftotext":
+            subprocess.run(["pdftotext", "-layout", str(pdf_path), str(txt_file_path)], check=True)
+        else:
+            # Reuse the text an earlier stage already cached for this file content
+            cached_path = sidecar_path(file_sha256(pdf_path))
+            if cached_path.is_file():
+                shutil.copyfile(cached_path, txt_file_path)
+            else:
+                write_layout_text(pdf_path, txt_file_path)
+        if output_directory == pdf_path.parent:
+            stamp_cleaned_txt(pdf_path)
 
         print(f"PDF file has been converted to text file: {txt_file_path}")
         return True
@@ -26,20 +47,46 @@ def convert_pdf_to_txt(pdf_file_path, output_dir=None) -> bool:
     except subprocess.CalledProcessError as e:
         print(f"An error occurred while converting PDF to text: {e}")
         return False
+    except Exception as e:
+        print(f"Could not convert {pdf_file_path} to text: {e}")
+        return False
 
 
-def process_pdfs(pdf_folder):
+def process_pdfs(pdf_folder, backend="pymupdf", max_workers=None):
+    """
+    Convert every PDF in the folder that has no ``_cleaned.txt`` of its current content yet.
+    Files are converted in parallel across ``max_workers`` processes (default: CPU count).
+    """
     pdf_folder_path = Path(pdf_folder)
 
+    pending = []
     for pdf_path in pdf_folder_path.glob("*.pdf"):
-        updated_txt_path = pdf_folder_path / (pdf_path.stem + "_cleaned.txt")
-
-        if not updated_txt_path.exists():
-            convert_pdf_to_txt(pdf_path)
-
-
-def main(pdf_folder: str = "strategy_materials") -> None:
-    process_pdfs(pdf_folder)
+        if not cleaned_txt_is_current(pdf_path):
+            pending.append(pdf_path)
+        else:
+            instrumentation.increment(STAGE, "rows_skipped")
+
+    if max_workers == 1 or len(pending) <= 1:
+        results = [convert_pdf_to_txt(pdf_path, backend=backend) for pdf_path in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(convert_pdf_to_txt, pdf_path, None, backend)
+                for pdf_path in pending
+            ]
+            results = [future.result() for future in as_completed(futures)]
+
+    instrumentation.increment(STAGE, "rows_processed", sum(results))
+    instrumentation.increment(STAGE, "rows_failed", len(results) - sum(results))
+
+
+@profiling.profile_option(STAGE)
+def main(
+    pdf_folder: str = "strategy_materials",
+    backend: str = "pymupdf",
+    max_workers: int = None,
+) -> None:
+    process_pdfs(pdf_folder, backend=backend, max_workers=max_workers)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,17 @@
 import os
+import socket
 import fitz  # PyMuPDF
-import pytesseract
-from pdf2image import convert_from_path
 from openai import OpenAI
 
+from . import budget, instrumentation, profiling
+from .llm import chat_completion
+from .ocr import DEFAULT_CACHE_DIR, OCR_DPI, OCRPageCache, iter_page_images, ocr_engine
+from .pdf_text import file_sha256, stamp_cleaned_txt
+from .work_queue import WorkQueue, run_worker
+
+STAGE = "extract_and_process_reports"
+OCR_TASK = "ocr"
+
 openai_api_key = os.getenv("OPENAI_API_KEY")
 client = OpenAI(api_key=openai_api_key)
 
@@ -20,14 +28,24 @@ def is_scanned_pdf(pdf_path):
     return True
 
 
-def extract_text_from_scanned_pdf(pdf_path):
+def extract_text_from_scanned_pdf(pdf_path, dpi=OCR_DPI, engine=None, cache=None):
     """
     Use OCR to extract text from a scanned PDF.
+    Pages are rendered in memory and recognised by the process-wide OCR engine;
+    pages already in ``cache`` are not recognised again.
     """
-    images = convert_from_path(pdf_path)
+    engine = engine or ocr_engine()
     text = ""
-    for image in images:
-        text += pytesseract.image_to_string(image, lang="est")
+    for image in iter_page_images(pdf_path, dpi=dpi):
+        page_text = cache.get(engine, image) if cache is not None else None
+        if page_text is not None:
+            instrumentation.increment(STAGE, "ocr_cache_hits")
+        else:
+            page_text = engine.recognise(image)
+            instrumentation.increment(STAGE, "pdf_pages_ocr")
+            if cache is not None:
+                cache.put(engine, image, page_text)
+        text += page_text
     return text
 
 
@@ -35,13 +53,16 @@ def clean_text_with_gpt(text):
     """
     Clean and logically update text using GPT.
     """
+    text = budget.prefilter_text(STAGE, text)
     prompt = (
         "This text was detected with OCR and it might contain errors. "
         "Please clean it and update it to be logical:\n\n"
         f"{text}"
     )
 
-    stream = client.chat.completions.create(
+    cleaned_text = chat_completion(
+        client,
+        STAGE,
         model="gpt-4o-mini",
         messages=[
             {
@@ -53,34 +74,126 @@ def clean_text_with_gpt(text):
         stream=True,
     )
 
-    cleaned_text = ""
-    for chunk in stream:
-        if chunk.choices[0].delta.content is not None:
-            cleaned_text += chunk.choices[0].delta.content
-
     return cleaned_text.strip()
 
 
-def process_directory(directory):
+def ocr_and_clean(pdf_path, dpi=OCR_DPI, engine=None, cache=None):
+    """
+    OCR a scanned PDF, clean the text with GPT and write it next to the PDF as
+    ``<name>_cleaned.txt``. The file is replaced atomically, so workers on
+    several hosts may write the same document. Returns the output path.
+    """
+    raw_text = extract_text_from_scanned_pdf(pdf_path, dpi=dpi, engine=engine, cache=cache)
+    cleaned_text = clean_text_with_gpt(raw_text)
+    output_path = os.path.splitext(pdf_path)[0] + "_cleaned.txt"
+    tmp_path = f"{output_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(cleaned_text)
+    os.replace(tmp_path, output_path)
+    stamp_cleaned_txt(pdf_path)
+    return output_path
+
+
+def process_directory(directory, dpi=OCR_DPI, engine_name=None, cache_dir=DEFAULT_CACHE_DIR):
     """
     Process directory to find and clean scanned PDFs.
+    PDFs that no longer fit the token budget are deferred to the next run,
+    which processes them first (their pages come from the OCR cache then)
+    and then the remaining PDFs of the directory.
     """
+    pdf_paths = [
+        os.path.join(root, file)
+        for root, _, files in os.walk(directory)
+        for file in files
+        if file.endswith(".pdf")
+    ]
+    deferred = budget.load_deferred(STAGE)
+    if deferred is not None:
+        deferred_paths = set(deferred["pdf_path"])
+        pdf_paths.sort(key=lambda path: path not in deferred_paths)
+    deferred_rows = []
+    engine = ocr_engine(engine_name)
+    cache = OCRPageCache(cache_dir) if cache_dir else None
+
+    for pdf_path in pdf_paths:
+        profiling.next_row()
+        if deferred_rows:
+            deferred_rows.append({"pdf_path": pdf_path})
+            continue
+        if is_scanned_pdf(pdf_path):
+            instrumentation.increment(STAGE, "rows_processed")
+            print(f"Processing scanned PDF: {pdf_path}")
+            try:
+                ocr_and_clean(pdf_path, dpi=dpi, engine=engine, cache=cache)
+            except budget.BudgetExhausted as e:
+                print(f"{e}. Deferring {pdf_path} and the remaining PDFs.")
+                deferred_rows.append({"pdf_path": pdf_path})
+        else:
+            instrumentation.increment(STAGE, "rows_skipped")
+
+    budget.save_deferred(STAGE, deferred_rows)
+
+
+### Work queue mode ###
+
+def enqueue_scanned_pdfs(queue, directory):
+    """
+    Queue one OCR task per scanned PDF, keyed by its path relative to
+    ``directory``. The payload holds the PDF's content hash, so a replaced
+    PDF is recognised again.
+    """
+    items = []
     for root, _, files in os.walk(directory):
         for file in files:
             if not file.endswith(".pdf"):
                 continue
             pdf_path = os.path.join(root, file)
             if is_scanned_pdf(pdf_path):
-                print(f"Processing scanned PDF: {pdf_path}")
-                raw_text = extract_text_from_scanned_pdf(pdf_path)
-                cleaned_text = clean_text_with_gpt(raw_text)
-                output_path = os.path.splitext(pdf_path)[0] + "_cleaned.txt"
-                with open(output_path, "w", encoding="utf-8") as f:
-                    f.write(cleaned_text)
+                relative_path = os.path.relpath(pdf_path, directory)
+                items.append((relative_path, {"pdf_path": relative_path, "sha256": file_sha256(pdf_path)}))
+            else:
+                instrumentation.increment(STAGE, "rows_skipped")
+    added = queue.enqueue(OCR_TASK, items)
+    print(f"Queued {added} new, changed or failed of {len(items)} scanned PDFs in {queue.path}")
 
 
-def main(directory: str = "strategy_materials") -> None:
-    process_directory(directory)
+def ocr_worker(
+    queue_path, directory="strategy_materials", dpi=OCR_DPI, engine_name=None, cache_dir=DEFAULT_CACHE_DIR
+):
+    """
+    Work off the OCR tasks of a queue. Runs on any host that sees the queue
+    file and ``directory``, which may be mounted at a different path there.
+    """
+    queue = WorkQueue(queue_path)
+    engine = ocr_engine(engine_name)
+    cache = OCRPageCache(cache_dir) if cache_dir else None
+
+    def handle(payload):
+        pdf_path = os.path.join(directory, payload["pdf_path"])
+        profiling.next_row()
+        instrumentation.increment(STAGE, "rows_processed")
+        print(f"Processing scanned PDF: {pdf_path}")
+        output_path = ocr_and_clean(pdf_path, dpi=dpi, engine=engine, cache=cache)
+        return {"output_path": os.path.relpath(output_path, directory)}
+
+    completed = run_worker(queue, OCR_TASK, handle, STAGE)
+    print(f"OCR worker done: {completed} PDFs processed here, queue {queue.counts(OCR_TASK)}")
+
+
+@profiling.profile_option(STAGE)
+def main(
+    directory: str = "strategy_materials",
+    dpi: int = OCR_DPI,
+    ocr_engine_name: str = None,
+    ocr_cache_dir: str = DEFAULT_CACHE_DIR,
+    work_queue_path: str = None,
+) -> None:
+    if work_queue_path:
+        # Shared with run_worker.py workers; PDFs left when the budget runs out stay queued
+        enqueue_scanned_pdfs(WorkQueue(work_queue_path), directory)
+        ocr_worker(work_queue_path, directory, dpi=dpi, engine_name=ocr_engine_name, cache_dir=ocr_cache_dir)
+    else:
+        process_directory(directory, dpi=dpi, engine_name=ocr_engine_name, cache_dir=ocr_cache_dir)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,36 @@
+import hashlib
 import json
-import re
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 from openai import OpenAI
 
+from . import budget, instrumentation, profiling
+from .llm import structured_completion
+from .llm_schemas import SECTION_SUMMARY_SCHEMA, SUMMARY_KEYS, SUMMARY_SCHEMA
+from .frames import iter_rows, merge_records
+from .taxa import taxon_group
+from .text_store import close_documents, materialise_row
+from .work_queue import WorkQueue, run_worker
+
+STAGE = "extract_birds_info_from_text"
+
+# Columns that may hold span references (see text_store) instead of texts
+TEXT_COLUMNS = [
+    "Kokkuvõte_text",
+    "Elupaik_text",
+    "Populatsiooni muutused Eestis_text",
+    "Seisund ELis_text",
+    "Elupaiga seisund_text",
+    "Ohud_text",
+]
+
+# Topic texts estimated above this many tokens are summarised chunk by chunk
+# in parallel (map) and the partial summaries merged in one more call (reduce).
+MAP_REDUCE_TOKEN_THRESHOLD = int(os.getenv("LLM_MAP_REDUCE_TOKENS", "6000"))
+MAP_REDUCE_WORKERS = int(os.getenv("LLM_MAP_REDUCE_WORKERS", "4"))
+
 # Initialize OpenAI client
 openai_api_key = os.getenv('OPENAIKEY')
 client = OpenAI(api_key=openai_api_key)
@@ -13,95 +40,133 @@ def read_text_from_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
         return file.read()
 
-def transform_json_response(response_json):
-    # Ensure values are all strings and lists are joined into a single string
-    for key, value in response_json.items():
-        if isinstance(value, list):
-            # Join list items with commas
-            response_json[key] = ', '.join(value)
-        elif not isinstance(value, str):
-            # Convert any non-string values (unexpected) to a string
-            response_json[key] = str(value)
-    return response_json
-
-# New function: format using GPT per section
-def format_using_gpt_per_section(parameter, text):
-    try:
-        prompt = f"""
-        Otsi järgnevas tekstis lindude jaoks infot teemal: {parameter}.
-        Tagastage võimalikult üksikasjalikud andmed iga parameetri kohta ühtset teksti, kuid mitte rohkem kui 10 lauset. Tagasta kokkuvõte antud teemal või NA kui andmeid ei leidu. Ärge lisage ise mingit teksti.
-
-        {text}
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Oled abivalmis assistent, kes aitab ekstraktitud teavet vormindada."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+def split_text_at_breaks(text, max_tokens):
+    """
+    Split text into chunks of about ``max_tokens`` budget-estimated tokens,
+    cutting at line or word breaks (unlike the word-count splitter of
+    extract_relevant_sections, line structure is kept).
+    """
+    max_chars = max_tokens * budget.CHARS_PER_TOKEN
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + max_chars
+        if end < len(text):
+            cut = text.rfind("\n", start, end)
+            if cut <= start:
+                cut = text.rfind(" ", start, end)
+            if cut > start:
+                end = cut
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end
+    return chunks
+
+def summarise_section(parameter, text):
+    prompt = f"""
+    Otsi järgnevas tekstis {taxon_group()['plural_genitive']} jaoks infot teemal: {parameter}.
+    Tagastage võimalikult üksikasjalikud andmed iga parameetri kohta ühtset teksti, kuid mitte rohkem kui 10 lauset. Tagasta kokkuvõte antud teemal väljal "summary" või NA kui andmeid ei leidu. Ärge lisage ise mingit teksti.
+
+    {text}
+    """
+
+    section_response = structured_completion(
+        client,
+        STAGE,
+        "section_summary",
+        SECTION_SUMMARY_SCHEMA,
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "Oled abivalmis assistent, kes aitab ekstraktitud teavet vormindada."},
+            {"role": "user", "content": prompt}
+        ]
+    )
+
+    return section_response["summary"].strip() or "NA"
+
+def merge_section_summaries(parameter, summaries):
+    joined_summaries = "\n\n".join(f"Osa {i}:\n{summary}" for i, summary in enumerate(summaries, start=1))
+    prompt = f"""
+    Järgnevad on sama dokumendi eri osade kokkuvõtted teemal: {parameter}.
+    Ühenda need üheks kokkuvõtteks, kuid mitte rohkem kui 10 lauset. Jäta kordused välja. Tagasta kokkuvõte väljal "summary". Ärge lisage ise mingit teksti.
+
+    {joined_summaries}
+    """
+
+    merged_response = structured_completion(
+        client,
+        STAGE,
+        "section_summary",
+        SECTION_SUMMARY_SCHEMA,
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "Oled abivalmis assistent, kes aitab ekstraktitud teavet vormindada."},
+            {"role": "user", "content": prompt}
+        ]
+    )
+
+    return merged_response["summary"].strip() or "NA"
+
+def map_reduce_section(parameter, text):
+    """Summarise the chunks of a long topic text concurrently and merge the partial summaries."""
+    chunks = split_text_at_breaks(text, MAP_REDUCE_TOKEN_THRESHOLD)
+    instrumentation.increment(STAGE, "llm_map_reduce_chunks", len(chunks))
+
+    errors = []
+
+    def summarise_chunk(chunk):
+        # A failed chunk is left out; the other partial summaries are still merged
+        try:
+            return summarise_section(parameter, chunk)
+        except budget.BudgetExhausted:
+            raise
+        except Exception as e:
+            print(f"Error summarising a chunk of '{parameter}': {e}")
+            errors.append(e)
+            return "NA"
 
-        section_response = response.choices[0].message.content
-        return section_response.strip()
+    with ThreadPoolExecutor(max_workers=MAP_REDUCE_WORKERS) as executor:
+        partial_summaries = list(executor.map(summarise_chunk, chunks))
 
-    except Exception as e:
-        print(f"Error in format_using_gpt_per_section for parameter '{parameter}': {e}")
+    partial_summaries = [summary for summary in partial_summaries if summary != "NA"]
+    if not partial_summaries:
+        if errors and len(errors) == len(chunks):
+            raise errors[0]
         return "NA"
+    if len(partial_summaries) == 1:
+        return partial_summaries[0]
+    return merge_section_summaries(parameter, partial_summaries)
 
-def format_using_gpt(text):
-    try:
-        prompt = (
-            f"Otsi järgnevas tekstis kirjed ja vorminda info JSON-struktuurina loendava nimekirjaga (Tagastage võimalikult üksikasjalikud andmed iga parameetri kohta ühtset teksti, kuid mitte rohkem kui 10 lauset):\n\n{text}\n\n"
-            "Struktuur on järgmine (kui teave puudub tekstis, tagasta 'NA'):\n"
-            "{\n"
-            '  "Kirjeldus (seisund, elupaik, populatsiooni muutused)": "NA",\n'
-            '  "Ohutegurite kirjeldus (ohud, elupaiga seisund)": "NA",\n'
-            "}\n"
-        )
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Oled abivalmis assistent, kes aitab ekstraktitud teavet vormindada."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-
-        json_response = response.choices[0].message.content
+# New function: format using GPT per section
+def format_using_gpt_per_section(parameter, text):
+    text = budget.prefilter_text(STAGE, text)
+    if budget.estimate_tokens(text) > MAP_REDUCE_TOKEN_THRESHOLD:
+        return map_reduce_section(parameter, text)
+    return summarise_section(parameter, text)
 
-        # Attempt to parse the response content directly as JSON
-        try:
-            response_json = json.loads(json_response)
-            formatted_response = transform_json_response(response_json)
-            return formatted_response
-        except json.JSONDecodeError:
-            # Try to extract JSON from markdown-like code block
-            match = re.search(r'```json\n([\s\S]*?)\n```', json_response)
-            if match:
-                json_text = match.group(1)
-                try:
-                    response_json = json.loads(json_text)
-                    return response_json
-                except json.JSONDecodeError:
-                    print("Error parsing JSON from extracted block: ", json_text)
-                    return {
-                        "Kirjeldus (seisund, elupaik, populatsiooni muutused)": "NA",
-                        "Ohutegurite kirjeldus (ohud, elupaiga seisund)": "NA"
-                    }
-            else:
-                print("Error: No JSON found in response. Got: ", json_response)
-                return {
-                    "Kirjeldus (seisund, elupaik, populatsiooni muutused)": "NA",
-                    "Ohutegurite kirjeldus (ohud, elupaiga seisund)": "NA"
-                }
-
-    except Exception as e:
-        print(f"Error in format_using_gpt: {e}")
-        return {
-            "Kirjeldus (seisund, elupaik, populatsiooni muutused)": "NA",
-            "Ohutegurite kirjeldus (ohud, elupaiga seisund)": "NA"
-        }
+def format_using_gpt(text):
+    text = budget.prefilter_text(STAGE, text)
+    prompt = (
+        f"Otsi järgnevas tekstis kirjed ja vorminda info JSON-struktuurina (Tagastage võimalikult üksikasjalikud andmed iga parameetri kohta ühtset teksti, kuid mitte rohkem kui 10 lauset):\n\n{text}\n\n"
+        "Struktuur on järgmine (kui teave puudub tekstis, tagasta 'NA'):\n"
+        "{\n"
+        '  "Kirjeldus (seisund, elupaik, populatsiooni muutused)": "NA",\n'
+        '  "Ohutegurite kirjeldus (ohud, elupaiga seisund)": "NA"\n'
+        "}\n"
+    )
+
+    return structured_completion(
+        client,
+        STAGE,
+        "summary",
+        SUMMARY_SCHEMA,
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "Oled abivalmis assistent, kes aitab ekstraktitud teavet vormindada."},
+            {"role": "user", "content": prompt}
+        ]
+    )
 
 def parse_json_to_dataframe_columns(json_data):
     print(json_data)
@@ -127,103 +192,330 @@ def parse_json_to_dataframe_columns(json_data):
             "Ohutegurite kirjeldus (ohud, elupaiga seisund)": ["NA"]
         }
 
+PREVIEW_COLUMNS = [
+    "Estonian Name",
+    "Latin Name",
+    "Category",
+    "EELIS link",
+    "strategy_present",
+    "Nimi inglise k",
+    "Rühm",
+    "Kaitsekategooria",
+    "Kirjeldus (seisund, elupaik, populatsiooni muutused)",
+    "Ohutegurite kirjeldus (ohud, elupaiga seisund)",
+]
+
+# Rows read from st7 at a time in streaming mode
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "50"))
+
+
+def summarise_row(row):
+    """
+    Summarise one species row with the LLM.
+    Returns {summary column: value} or None. LLM and parsing errors are passed
+    on like BudgetExhausted, so callers that keep results across runs can
+    retry the species instead of storing an empty summary.
+    """
+    estonian_name = row["Estonian Name"]
+    print(estonian_name)
+    row = materialise_row(row, TEXT_COLUMNS)
+    instrumentation.increment(STAGE, "rows_processed")
+
+    analyze_by_sisukord = bool(row["Analyze_by_sisukord"])
+
+    if not analyze_by_sisukord:
+        try:
+            formatted_text = format_using_gpt(row["Kokkuvõte_text"])
+            if not formatted_text:
+                return None
+            response = parse_json_to_dataframe_columns(formatted_text)
+        except budget.BudgetExhausted:
+            raise
+        except Exception as e:
+            print(f"Error in format_using_gpt for {estonian_name}: {e}")
+            raise
+
+    else:
+        try:
+            kirjeldus_texts = " ".join([
+                row.get("Elupaik_text", ""),
+                row.get("Populatsiooni muutused Eestis_text", ""),
+                row.get("Seisund ELis_text", ""),
+            ])
+
+            ohud_texts = " ".join([
+                row.get("Elupaiga seisund_text", ""),
+                row.get("Ohud_text", ""),
+            ])
+
+            sections_dict = {
+                "Kirjeldus (seisund, elupaik, populatsiooni muutused)": format_using_gpt_per_section(
+                    "Kirjeldus (seisund, elupaik, populatsiooni muutused)",
+                    kirjeldus_texts,
+                ),
+                "Ohutegurite kirjeldus (ohud, elupaiga seisund)": format_using_gpt_per_section(
+                    "Ohutegurite kirjeldus (ohud, elupaiga seisund)",
+                    ohud_texts,
+                ),
+            }
+
+            response = parse_json_to_dataframe_columns(sections_dict)
+
+        except budget.BudgetExhausted:
+            raise
+        except Exception as e:
+            print(f"Error in format_using_gpt_per_section for {estonian_name}: {e}")
+            raise
+
+    return {column: value[0] for column, value in response.items()}
+
+
 def process_directory(input_csv_path: str, output_csv_path: str, preview_csv_path: str) -> None:
     df = pd.read_csv(input_csv_path).fillna("")
 
-    formatted_responses = []
-    response_dfs = []
+    # Rows deferred by a previous run that ran out of token budget are
+    # processed on top of the existing output; all other rows are kept as is.
+    rows_to_process = df.index
+    deferred = budget.load_deferred(STAGE)
+    if deferred is not None and os.path.isfile(output_csv_path):
+        df = pd.read_csv(output_csv_path).fillna("")
+        rows_to_process = df.index[df["Estonian Name"].isin(deferred["Estonian Name"])]
 
-    for index, row in df.iterrows():
-        estonian_name = row["Estonian Name"]
-        print(estonian_name)
+    records = {}
+    deferred_rows = []
 
-        analyze_by_sisukord = bool(row["Analyze_by_sisukord"])
+    for index, row in iter_rows(df, rows_to_process):
+        profiling.next_row()
+        if deferred_rows:
+            deferred_rows.append(row)
+            continue
 
-        if not analyze_by_sisukord:
-            try:
-                formatted_text = format_using_gpt(row["Kokkuvõte_text"])
-                if formatted_text:
-                    formatted_responses.append(formatted_text)
-                    response_dfs.append(parse_json_to_dataframe_columns(formatted_text))
-            except (KeyError, json.JSONDecodeError, Exception) as e:
-                print(f"Error in format_using_gpt for {estonian_name}: {e}")
-                formatted_responses.append({
-                    "Kirjeldus (seisund, elupaik, populatsiooni muutused)": "NA",
-                    "Ohutegurite kirjeldus (ohud, elupaiga seisund)": "NA",
-                })
-                response_dfs.append({
-                    "Kirjeldus (seisund, elupaik, populatsiooni muutused)": ["NA"],
-                    "Ohutegurite kirjeldus (ohud, elupaiga seisund)": ["NA"],
-                })
-
-        else:
-            try:
-                kirjeldus_texts = " ".join([
-                    row.get("Elupaik_text", ""),
-                    row.get("Populatsiooni muutused Eestis_text", ""),
-                    row.get("Seisund ELis_text", ""),
-                ])
-
-                ohud_texts = " ".join([
-                    row.get("Elupaiga seisund_text", ""),
-                    row.get("Ohud_text", ""),
-                ])
-
-                sections_dict = {
-                    "Kirjeldus (seisund, elupaik, populatsiooni muutused)": format_using_gpt_per_section(
-                        "Kirjeldus (seisund, elupaik, populatsiooni muutused)",
-                        kirjeldus_texts,
-                    ),
-                    "Ohutegurite kirjeldus (ohud, elupaiga seisund)": format_using_gpt_per_section(
-                        "Ohutegurite kirjeldus (ohud, elupaiga seisund)",
-                        ohud_texts,
-                    ),
-                }
-
-                formatted_responses.append(sections_dict)
-                response_dfs.append(parse_json_to_dataframe_columns(sections_dict))
-
-            except (KeyError, json.JSONDecodeError, Exception) as e:
-                print(f"Error in format_using_gpt_per_section for {estonian_name}: {e}")
-                formatted_responses.append({
-                    "Kirjeldus (seisund, elupaik, populatsiooni muutused)": "NA",
-                    "Ohutegurite kirjeldus (ohud, elupaiga seisund)": "NA",
-                })
-                response_dfs.append({
-                    "Kirjeldus (seisund, elupaik, populatsiooni muutused)": ["NA"],
-                    "Ohutegurite kirjeldus (ohud, elupaiga seisund)": ["NA"],
-                })
-
-    for i, response_df in enumerate(response_dfs):
-        for column, value in response_df.items():
-            df.at[i, column] = value[0]
+        try:
+            record = summarise_row(row)
+        except budget.BudgetExhausted as e:
+            print(f"{e}. Deferring remaining rows starting from {row['Estonian Name']}.")
+            deferred_rows.append(row)
+            continue
+        except Exception:
+            instrumentation.increment(STAGE, "rows_failed")
+            record = {key: "NA" for key in SUMMARY_KEYS}
+        if record:
+            records[index] = record
+
+    close_documents()
+
+    df = merge_records(df, records)
 
     df.to_csv(output_csv_path, index=False)
+    budget.save_deferred(STAGE, deferred_rows)
 
-    columns_to_keep = [
-        "Estonian Name",
-        "Latin Name",
-        "Category",
-        "EELIS link",
-        "strategy_present",
-        "Nimi inglise k",
-        "Rühm",
-        "Kaitsekategooria",
-        "Kirjeldus (seisund, elupaik, populatsiooni muutused)",
-        "Ohutegurite kirjeldus (ohud, elupaiga seisund)",
-    ]
-
-    df_selected = df[columns_to_keep]
+    df_selected = df[PREVIEW_COLUMNS]
     df_selected.to_csv(preview_csv_path, index=False)
 
 
+### Streaming mode ###
+
+def species_id(row):
+    """Key of a species row in the results journal: its Latin name (or the Estonian one)."""
+    return str(row.get("Latin Name") or row["Estonian Name"]).strip()
+
+
+def journal_path(output_csv_path):
+    return f"{output_csv_path}.jsonl"
+
+
+def input_sha(row):
+    """Hash of a row's content, stored with its journal entry."""
+    content = json.dumps(row, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def is_current(entry, sha):
+    """Whether a journal entry was made from the row content with hash ``sha``."""
+    return entry is not None and entry.get("input_sha") == sha
+
+
+def load_journal(path):
+    """
+    Return {species ID: entry} from a results journal; an entry is the
+    summary and the ``input_sha`` of the row it was made from. A line cut
+    short by a crash is ignored; its species is summarised again.
+    """
+    results = {}
+    if not os.path.isfile(path):
+        return results
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[entry.pop("species_id")] = entry
+    return results
+
+
+def open_journal(path):
+    """Open the journal for appending, ending a line cut short by a crash first."""
+    complete = True
+    if os.path.isfile(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            complete = f.read(1) == b"\n"
+    journal = open(path, "a", encoding="utf-8")
+    if not complete:
+        journal.write("\n")
+    return journal
+
+
+def append_journal(journal, key, record):
+    """Append one species' summary and make it durable before the next LLM call."""
+    journal.write(json.dumps({"species_id": key, **record}, ensure_ascii=False) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def write_streamed_outputs(input_csv_path, output_csv_path, preview_csv_path, results, chunk_size):
+    """
+    Join st7 chunk by chunk with the journalled summaries into st8 and the
+    preview. Summaries of an earlier version of a row are left out.
+    """
+    for path in (output_csv_path, preview_csv_path):
+        if os.path.exists(path):
+            os.remove(path)
+    for chunk in pd.read_csv(input_csv_path, chunksize=chunk_size):
+        chunk = chunk.fillna("")
+        entries = [
+            (results.get(species_id(row)), input_sha(row)) for _, row in iter_rows(chunk)
+        ]
+        summaries = pd.DataFrame(
+            [entry if is_current(entry, sha) else {} for entry, sha in entries],
+            index=chunk.index,
+            columns=list(SUMMARY_KEYS),
+        )
+        chunk = chunk.drop(columns=[key for key in SUMMARY_KEYS if key in chunk.columns]).join(summaries)
+        header = not os.path.exists(output_csv_path)
+        chunk.to_csv(output_csv_path, mode="a", header=header, index=False)
+        chunk.reindex(columns=PREVIEW_COLUMNS).to_csv(preview_csv_path, mode="a", header=header, index=False)
+
+
+def process_csv_streaming(
+    input_csv_path: str, output_csv_path: str, preview_csv_path: str, chunk_size: int = STREAM_CHUNK_ROWS
+) -> None:
+    """
+    Crash-safe counterpart of process_directory.
+    st7 is read ``chunk_size`` rows at a time and each species' summary is
+    appended to ``<output>.jsonl`` (keyed by species ID, with a hash of the
+    row) as soon as it is done, so memory stays flat and a restarted run skips
+    the species already in the journal - unless their st7 row has changed
+    since. Species the LLM failed on are not journalled and are retried by
+    the next run. When the token budget runs out the run stops; the next run
+    continues with the species that are still missing. st8 and the preview
+    are written from st7 and the journal at the end of every run.
+    """
+    path = journal_path(output_csv_path)
+    results = load_journal(path)
+    if results:
+        print(f"Resuming: {len(results)} species already summarised in {path}")
+
+    budget_exhausted = False
+    with open_journal(path) as journal:
+        for chunk in pd.read_csv(input_csv_path, chunksize=chunk_size):
+            for _, row in iter_rows(chunk.fillna("")):
+                profiling.next_row()
+                key, sha = species_id(row), input_sha(row)
+                if is_current(results.get(key), sha):
+                    instrumentation.increment(STAGE, "rows_skipped")
+                    continue
+                try:
+                    record = summarise_row(row)
+                except budget.BudgetExhausted as e:
+                    print(f"{e}. Stopping at {row['Estonian Name']}; the next run resumes from there.")
+                    budget_exhausted = True
+                    break
+                except Exception:
+                    instrumentation.increment(STAGE, "rows_failed")
+                    continue
+                if record:
+                    record = {"input_sha": sha, **record}
+                    append_journal(journal, key, record)
+                    results[key] = record
+            close_documents()
+            if budget_exhausted:
+                break
+
+    write_streamed_outputs(input_csv_path, output_csv_path, preview_csv_path, results, chunk_size)
+
+
+### Work queue mode ###
+
+SUMMARISE_TASK = "summarise"
+
+
+def enqueue_species(queue, input_csv_path, chunk_size=STREAM_CHUNK_ROWS):
+    """
+    Queue one summarisation task per st7 row, keyed by species ID. The row is
+    the payload, so a species whose row changed is summarised again.
+    """
+    added = 0
+    for chunk in pd.read_csv(input_csv_path, chunksize=chunk_size):
+        added += queue.enqueue(SUMMARISE_TASK, [(species_id(row), row) for _, row in iter_rows(chunk.fillna(""))])
+    print(f"Queued {added} new, changed or failed species in {queue.path}")
+
+
+def summarise_worker(queue_path):
+    """
+    Work off the summarisation tasks of a queue. Span references in the rows
+    are resolved against the text store, so run it from the run's directory.
+    """
+    queue = WorkQueue(queue_path)
+
+    def handle(row):
+        profiling.next_row()
+        # A species without a summary is done as well; errors go back to the queue for a retry
+        return {"input_sha": input_sha(row), **(summarise_row(row) or {})}
+
+    try:
+        completed = run_worker(queue, SUMMARISE_TASK, handle, STAGE)
+    finally:
+        close_documents()
+    print(f"Summarisation worker done: {completed} species summarised here, queue {queue.counts(SUMMARISE_TASK)}")
+
+
+def process_csv_queued(
+    input_csv_path: str,
+    output_csv_path: str,
+    preview_csv_path: str,
+    queue_path: str,
+    chunk_size: int = STREAM_CHUNK_ROWS,
+) -> None:
+    """
+    Counterpart of process_csv_streaming for several workers: the species are
+    queued in ``queue_path`` and summarised by this process together with any
+    ``run_worker.py summarise`` workers. st8 and the preview are written from
+    st7 and the queue's results once no species is left.
+    """
+    enqueue_species(WorkQueue(queue_path), input_csv_path, chunk_size)
+    summarise_worker(queue_path)
+    results = WorkQueue(queue_path).results(SUMMARISE_TASK)
+    write_streamed_outputs(input_csv_path, output_csv_path, preview_csv_path, results, chunk_size)
+
+
+@profiling.profile_option(STAGE)
 def main(
     input_csv_path: str = "st7_texts_prepared_for_analysis.csv",
     output_csv_path: str = "st8_birds_data_extracted.csv",
     preview_csv_path: str = "updated_birds_descriptions.csv",
+    streaming: bool = False,
+    chunk_size: int = STREAM_CHUNK_ROWS,
+    work_queue_path: str = None,
 ) -> None:
-    process_directory(input_csv_path, output_csv_path, preview_csv_path)
+    if work_queue_path:
+        process_csv_queued(input_csv_path, output_csv_path, preview_csv_path, work_queue_path, chunk_size=chunk_size)
+    elif streaming:
+        process_csv_streaming(input_csv_path, output_csv_path, preview_csv_path, chunk_size=chunk_size)
+    else:
+        process_directory(input_csv_path, output_csv_path, preview_csv_path)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,9 +1,16 @@
 import os
-import re
-import json
 import pandas as pd
 from openai import OpenAI
-from .extract_sections_texts import extract_full_table_of_contents
+from . import budget, instrumentation, profiling
+from .extract_sections_texts import document_table_of_contents
+from .frames import iter_rows
+from .taxa import taxon_group
+from .llm import StructuredOutputError, chat_completion, structured_completion
+from .llm_schemas import DOCUMENT_SECTION_MAPPING_SCHEMA, SECTION_MAPPING_SCHEMA
+from .species_index import anchor_lines, update_folder_index
+from .text_store import make_reference, register_document, save_store
+
+STAGE = "extract_relevant_sections"
 
 # Initialize OpenAI client
 openai_api_key = os.getenv('OPENAIKEY')
@@ -14,14 +21,21 @@ def read_text_from_file(file_path):
         return file.read()
 
 
-def extract_bird_related_text(text, bird_name):
+def extract_bird_related_text(text, bird_name, anchors=None):
+    """
+    Collect the lines around mentions of the bird. ``anchors`` are the line
+    numbers of the mentions from the species index; without them the text is scanned.
+    """
     lines = text.split('\n')
     result = []
     capture_lines = 30  # Define the number of lines to capture before and after
     n = len(lines)
 
-    for i in range(n):
-        if bird_name in lines[i]:
+    if anchors is None:
+        anchors = [i for i in range(n) if bird_name in lines[i]]
+
+    for i in anchors:
+        if i < n:
             start = max(0, i - capture_lines)  # Ensure we don't go out of bounds at the start
             end = min(n, i + capture_lines + 1)  # Ensure we don't go out of bounds at the end
             result.extend(lines[start:end])
@@ -52,27 +66,31 @@ def split_text_into_chunks(text, max_tokens):
     return chunks
 
 
-def extract_bird_sections(text, bird_name):
+def extract_bird_sections(text, bird_name, anchors=None):
     # Extract relevant sections related to the bird
-    text = extract_bird_related_text(text, bird_name[:-2])
+    text = extract_bird_related_text(text, bird_name[:-2], anchors=anchors)
+    text = budget.prefilter_text(STAGE, text, keywords=[bird_name[:-2]])
 
     # Split the text into chunks suitable for the language model
     chunks_for_llm = split_text_into_chunks(text, 128000)
 
     # Initialize a variable to hold the concatenated responses
     combined_response = ""
+    taxon = taxon_group()
 
     for chunk in chunks_for_llm:
         # Create the prompt for each chunk
         prompt = f"""
-        Otsi järgnevas tekstis lõigud, mis on seotud linnuga '{bird_name}', ja kombineeri need.
+        Otsi järgnevas tekstis lõigud, mis on seotud {taxon['comitative']} '{bird_name}', ja kombineeri need.
         Tagasta tulemused ühe tekstina.
 
         {chunk}
         """
 
         # Call the OpenAI API with the constructed prompt
-        response = client.chat.completions.create(
+        extracted_text = chat_completion(
+            client,
+            STAGE,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Oled abivalmis assistent, kes aitab teksti analüüsida."},
@@ -81,55 +99,37 @@ def extract_bird_sections(text, bird_name):
         )
 
         # Append the response for each chunk to the combined response
-        extracted_text = response.choices[0].message.content
         combined_response += extracted_text + "\n"
 
     return combined_response.strip()
 
 
 def format_using_gpt(toc, bird_name, multiple_bird_centered):
+    taxon = taxon_group()
     if multiple_bird_centered:
         prompt = (
             f"Kasutades järgnevat sisukorda:\n\n{toc}\n\n"
             "Palun lahenda selle põhjal ja tagasta JSON formaadis, "
-            f"mis osad on seotud linnuga {bird_name} ja järgmiste teemadega:\n"
+            f"mis osad on seotud {taxon['comitative']} {bird_name} ja järgmiste teemadega:\n"
             "'Elupaik', 'Elupaiga seisund', 'Ohud', "
             "'Populatsiooni muutused Eestis', 'Uuringud', 'Seisund ELis', 'Kokkuvõte'."
-            "\n\nArvesta, et kui on seotud mitme linnuliigiga käsitletud osad, "
+            f"\n\nArvesta, et kui on seotud mitme {taxon['species_comitative']} käsitletud osad, "
             "siis need lisatakse vastavatesse kategooriatesse.\n"
-            "Näiteks lindu 'Hallhani' analüüsides lisatakse ka '3. Ohutegurid'.\n\n"
-            "Struktuur peaks olla järgmine:\n"
-            "```json\n"
+            f"Näiteks {taxon['partitive']} 'Hallhani' analüüsides lisatakse ka '3. Ohutegurid'.\n\n"
+            "Näide:\n"
             "{\n"
-            f"   \"{bird_name}\": [\n"
-            "      {\n"
-            "         \"Elupaik\": [\"2.2.1.1 Elupaiganõudlus\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Elupaiga seisund\": [\"2.2.1.1 Elupaiganõudlus\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Ohud\": [\"3. Ohutegurid\", \"2.2.4 Kaitsestaatus ja senise kaitse tõhususe analüüs\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Populatsiooni muutused Eestis\": [\"2.2.3.2 Levik ja arvukus Eestis\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Uuringud\": [\n"
-            "            \"2.2.2 Ülevaade uuringutest ja inventuuridest\",\n"
-            "            \"2.2.3.1 Levik ja arvukus Euroopas\",\n"
-            "            \"2.2.3.2 Levik ja arvukus Eestis\"\n"
-            "         ]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Seisund ELis\": [\"2.2.3.1 Levik ja arvukus Euroopas\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Kokkuvõte\": [\"Kokkuvõte\"]\n"
-            "      }\n"
-            "   ]\n"
+            "   \"Elupaik\": [\"2.2.1.1 Elupaiganõudlus\"],\n"
+            "   \"Elupaiga seisund\": [\"2.2.1.1 Elupaiganõudlus\"],\n"
+            "   \"Ohud\": [\"3. Ohutegurid\", \"2.2.4 Kaitsestaatus ja senise kaitse tõhususe analüüs\"],\n"
+            "   \"Populatsiooni muutused Eestis\": [\"2.2.3.2 Levik ja arvukus Eestis\"],\n"
+            "   \"Uuringud\": [\n"
+            "      \"2.2.2 Ülevaade uuringutest ja inventuuridest\",\n"
+            "      \"2.2.3.1 Levik ja arvukus Euroopas\",\n"
+            "      \"2.2.3.2 Levik ja arvukus Eestis\"\n"
+            "   ],\n"
+            "   \"Seisund ELis\": [\"2.2.3.1 Levik ja arvukus Euroopas\"],\n"
+            "   \"Kokkuvõte\": [\"Kokkuvõte\"]\n"
             "}\n"
-            "```\n"
         )
     else:
         prompt = (
@@ -138,139 +138,269 @@ def format_using_gpt(toc, bird_name, multiple_bird_centered):
             f"mis osad on seotud järgmiste teemadega:\n"
             "'Elupaik', 'Elupaiga seisund', 'Ohud', "
             "'Populatsiooni muutused Eestis', 'Uuringud', 'Seisund ELis', 'Kokkuvõte'.\n\n"
-            "Struktuur peaks olla nagu nii:\n"
-            "```json\n"
+            "Näide:\n"
             "{\n"
-            f"   \"Lind\": [\n"
-            "      {\n"
-            "         \"Elupaik\": [\"8.2.1.1 Elupaiganõudlus\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Elupaiga seisund\": [\"8.2.1.1 Elupaiganõudlus\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Ohud\": [\"8.2.3 Kaitsestaatus ja senise kaitse tõhususe analüüs\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Populatsiooni muutused Eestis\": [\"8.2.2.2 Levik ja arvukus Eestis\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Uuringud\": [\n"
-            "            \"8.2.2.1 Levik ja arvukus maailmas ja Euroopas\",\n"
-            "            \"8.2.2.2 Levik ja arvukus Eestis\",\n"
-            "            \"8.2.3 Kaitsestaatus ja senise kaitse tõhususe analüüs\"\n"
-            "         ]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Seisund ELis\": [\"8.2.2.1 Levik ja arvukus maailmas ja Euroopas\"]\n"
-            "      },\n"
-            "      {\n"
-            "         \"Kokkuvõte\": [\"Kokkuvõte\"]\n"
-            "      }\n"
-            "   ]\n"
+            "   \"Elupaik\": [\"8.2.1.1 Elupaiganõudlus\"],\n"
+            "   \"Elupaiga seisund\": [\"8.2.1.1 Elupaiganõudlus\"],\n"
+            "   \"Ohud\": [\"8.2.3 Kaitsestaatus ja senise kaitse tõhususe analüüs\"],\n"
+            "   \"Populatsiooni muutused Eestis\": [\"8.2.2.2 Levik ja arvukus Eestis\"],\n"
+            "   \"Uuringud\": [\n"
+            "      \"8.2.2.1 Levik ja arvukus maailmas ja Euroopas\",\n"
+            "      \"8.2.2.2 Levik ja arvukus Eestis\",\n"
+            "      \"8.2.3 Kaitsestaatus ja senise kaitse tõhususe analüüs\"\n"
+            "   ],\n"
+            "   \"Seisund ELis\": [\"8.2.2.1 Levik ja arvukus maailmas ja Euroopas\"],\n"
+            "   \"Kokkuvõte\": [\"Kokkuvõte\"]\n"
             "}\n"
-            "```\n"
         )
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Oled abivalmis assistent, kes aitab teksti analüüsida ja struktuurida."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-
-    json_response = response.choices[0].message.content
-    processed_json_response = preprocess_json_response(json_response)
-    return transform_json_response(processed_json_response)
-
-def preprocess_json_response(json_response):
     try:
-        response_json = json.loads(json_response)
-        return transform_json_response(response_json)
-    except json.JSONDecodeError:
-        match = re.search(r'```json\n([\s\S]*?)\n```', json_response)
-        if match:
-            json_text = match.group(1)
-            try:
-                response_json = json.loads(json_text)
-                return response_json
-            except json.JSONDecodeError:
-                print("Error parsing JSON from extracted block:", json_text)
-                return None
-        else:
-            print("Error: No JSON found in response. Got:", json_response)
-            return None
-
-def transform_json_response(response_json):
-    if not isinstance(response_json, dict):
-        print("Expected response_json to be a dictionary")
+        mapping = structured_completion(
+            client,
+            STAGE,
+            "section_mapping",
+            SECTION_MAPPING_SCHEMA,
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "Oled abivalmis assistent, kes aitab teksti analüüsida ja struktuurida."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+    except StructuredOutputError as e:
+        print(f"No section mapping for {bird_name}: {e}")
         return None
 
-    bird_name = list(response_json.keys())[0]
-    sections = response_json[bird_name]
-    transformed_data = {}
+    return transform_json_response(mapping)
+
+def format_using_gpt_for_document(toc, bird_names):
+    """
+    Map the sections of a plan shared by several birds in one call.
+    Returns {bird_name: {topic: "section, section"}} for the birds found in the response.
+    """
+    taxon = taxon_group()
+    bird_list = ", ".join(f"'{bird_name}'" for bird_name in bird_names)
+    prompt = (
+        f"Kasutades järgnevat sisukorda:\n\n{toc}\n\n"
+        "Palun lahenda selle põhjal ja tagasta JSON formaadis, "
+        f"mis osad on seotud iga järgmise {taxon['comitative']}: {bird_list}; ja järgmiste teemadega:\n"
+        "'Elupaik', 'Elupaiga seisund', 'Ohud', "
+        "'Populatsiooni muutused Eestis', 'Uuringud', 'Seisund ELis', 'Kokkuvõte'."
+        f"\n\nArvesta, et kui on seotud mitme {taxon['species_comitative']} käsitletud osad, "
+        f"siis need lisatakse iga {taxon['genitive']} vastavatesse kategooriatesse.\n"
+        f"Lisa loendisse 'birds' üks kirje iga {taxon['genitive']} kohta, "
+        f"{taxon['genitive']} nimi väljale 'bird' täpselt nii nagu ülal.\n\n"
+        "Näide:\n"
+        "{\n"
+        "   \"birds\": [\n"
+        "      {\n"
+        "         \"bird\": \"Hallhani\",\n"
+        "         \"sections\": {\n"
+        "            \"Elupaik\": [\"2.2.1.1 Elupaiganõudlus\"],\n"
+        "            \"Elupaiga seisund\": [\"2.2.1.1 Elupaiganõudlus\"],\n"
+        "            \"Ohud\": [\"3. Ohutegurid\"],\n"
+        "            \"Populatsiooni muutused Eestis\": [\"2.2.3.2 Levik ja arvukus Eestis\"],\n"
+        "            \"Uuringud\": [\"2.2.2 Ülevaade uuringutest ja inventuuridest\"],\n"
+        "            \"Seisund ELis\": [\"2.2.3.1 Levik ja arvukus Euroopas\"],\n"
+        "            \"Kokkuvõte\": [\"Kokkuvõte\"]\n"
+        "         }\n"
+        "      }\n"
+        "   ]\n"
+        "}\n"
+    )
 
-    for section in sections:
-        for key, values in section.items():
-            transformed_data[key] = ", ".join(values)
+    try:
+        response = structured_completion(
+            client,
+            STAGE,
+            "document_section_mapping",
+            DOCUMENT_SECTION_MAPPING_SCHEMA,
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "Oled abivalmis assistent, kes aitab teksti analüüsida ja struktuurida."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+    except StructuredOutputError as e:
+        print(f"No document-level section mapping: {e}")
+        return {}
+
+    mappings = {}
+    for entry in response["birds"]:
+        if entry["bird"] in bird_names:
+            mapping = transform_json_response(entry["sections"])
+            if mapping:
+                mappings[entry["bird"]] = mapping
+    return mappings
+
+def transform_json_response(mapping):
+    """Join the section titles of each topic; topics without sections are left out."""
+    return {topic: ", ".join(titles) for topic, titles in mapping.items() if titles}
+
+def bird_focus(toc, bird_name, strategy_file):
+    """
+    Decide whether a plan is about one bird (named in the file name) or covers
+    several birds including this one (named in the table of contents).
+    Returns (one_bird_centered, multiple_bird_centered).
+    """
+    bird_id = bird_name[:-2]
+    one_bird_centered = False
+    multiple_bird_centered = False
+
+    if bird_id.lower() in toc.lower():
+        multiple_bird_centered = True
+    if bird_id.lower() in strategy_file.lower():
+        one_bird_centered = True
+        multiple_bird_centered = False
+    return one_bird_centered, multiple_bird_centered
+
+def map_shared_documents(rows, strategy_folder='strategy_materials'):
+    """
+    Map the ToC of every plan that covers several of the given birds with one
+    call per plan instead of one per bird.
+    Returns {strategy_file: {bird_name: section mapping}}.
+    """
+    birds_by_file = {}
+    for _, row in rows:
+        birds_by_file.setdefault(row['strategy_file'], []).append(row['Estonian Name'])
+
+    document_mappings = {}
+    for strategy_file, bird_names in birds_by_file.items():
+        if len(bird_names) < 2:
+            continue
+        text_file_path = os.path.join(strategy_folder, strategy_file.replace('.pdf', '_cleaned.txt'))
+        if not os.path.isfile(text_file_path):
+            continue
+        toc = document_table_of_contents(text_file_path, read_text_from_file(text_file_path), stage=STAGE)
+        if not toc:
+            continue
+        shared_birds = [
+            bird_name for bird_name in bird_names
+            if bird_focus(toc, bird_name, strategy_file)[1]
+        ]
+        if len(shared_birds) < 2:
+            continue
+        try:
+            document_mappings[strategy_file] = format_using_gpt_for_document(toc, shared_birds)
+        except budget.BudgetExhausted as e:
+            # Rows fall back to per-bird calls, which defer under the same budget
+            print(f"{e}. Skipping document-level mapping of {strategy_file}.")
+            break
+    return document_mappings
+
+def process_row(row, index=None, span_references=False, document_mappings=None, strategy_folder='strategy_materials'):
+    """
+    Locate the sections relevant to the row's bird in its strategy file.
+    Returns the updated row or None if the row yields no result.
+    If the species index is given, text windows are anchored on its positions.
+    With span_references a whole-document text is stored as a reference into
+    the text store instead of a copy. Section mappings already made for a
+    shared plan (see map_shared_documents) are reused instead of a new call.
+    The strategy file's text is read from strategy_folder.
+    """
+    strategy_file = row['strategy_file']
+    bird_name = row['Estonian Name']
+    bird_id = bird_name[:-2]
+
+    text_file_path = os.path.join(strategy_folder, strategy_file.replace('.pdf', '_cleaned.txt'))
+    text = read_text_from_file(text_file_path)
+    toc = document_table_of_contents(text_file_path, text, stage=STAGE)
+    anchors = anchor_lines(index, bird_name, strategy_file) if index is not None else None
+
+    if toc:
+        one_bird_centered, multiple_bird_centered = bird_focus(toc, bird_name, strategy_file)
+
+        if multiple_bird_centered or one_bird_centered or row['strategy_present'] == True:
+            json_results = None
+            if multiple_bird_centered and document_mappings:
+                json_results = document_mappings.get(strategy_file, {}).get(bird_name)
+            if not json_results:
+                json_results = format_using_gpt(toc, bird_name, multiple_bird_centered)
+            if json_results:
+                for key, value in json_results.items():
+                    row[key] = value
+                row['Analyze_by_sisukord'] = True
+                return row
+            return None
+        else:
+            non_bird_strategy_texts = extract_bird_sections(text, bird_name, anchors=anchors)
+            row['Kokkuvõte_text'] = non_bird_strategy_texts
+            row['Analyze_by_sisukord'] = False
+            return row
+    elif not toc and bird_id.lower() in strategy_file.lower():
+        if span_references:
+            sha = register_document(text_file_path)
+            row['Kokkuvõte_text'] = make_reference(sha, [(0, os.path.getsize(text_file_path))], "raw")
+        else:
+            row['Kokkuvõte_text'] = text
+        row['Analyze_by_sisukord'] = False
+        return row
+    else:
+        non_bird_strategy_texts = extract_bird_sections(text, bird_name, anchors=anchors)
+        row['Kokkuvõte_text'] = non_bird_strategy_texts
+        row['Analyze_by_sisukord'] = False
+        return row
 
-    return transformed_data
 
-def main():
-    os.chdir('/home/teks/PycharmProjects/biodiversity')
+@profiling.profile_option(STAGE)
+def main(span_references=False, document_level_mapping=True):
     input_csv = 'st5_relevant_pdf_reports.csv'
+    output_csv = 'st6_relevant_sections_extracted.csv'
     df = pd.read_csv(input_csv)
 
+    # Rows deferred by a previous run that ran out of token budget are
+    # processed on their own and appended to the existing output.
+    previous_results = None
+    deferred = budget.load_deferred(STAGE)
+    if deferred is not None and os.path.isfile(output_csv):
+        previous_results = pd.read_csv(output_csv)
+        df = df[df['Estonian Name'].isin(deferred['Estonian Name'])]
+
+    species_index = update_folder_index('strategy_materials', df)
+
+    document_mappings = None
+    if document_level_mapping:
+        pending_rows = [
+            (label, row) for label, row in iter_rows(df)
+            if pd.isna(row.get('Kirjeldus', '')) or pd.isna(row.get('Ohutegurite kirjeldus', ''))
+        ]
+        document_mappings = map_shared_documents(pending_rows)
+
     results = []
+    deferred_rows = []
+
+    for index, row in iter_rows(df):
+        profiling.next_row()
+        if deferred_rows:
+            deferred_rows.append(row)
+            continue
 
-    for index, row in df.iterrows():
         # Check if either "Kirjeldus" or "Ohutegurite kirjeldus" is empty
         if not pd.isna(row.get('Kirjeldus', '')) and not pd.isna(row.get('Ohutegurite kirjeldus', '')):
+            instrumentation.increment(STAGE, "rows_skipped")
             continue
-
-        strategy_file = row['strategy_file']
-        bird_name = row['Estonian Name']
-        bird_id = bird_name[:-2]
-
-        text_file_path = os.path.join('strategy_materials', strategy_file.replace('.pdf', '_cleaned.txt'))
-        text = read_text_from_file(text_file_path)
-        toc, toc_start, toc_end = extract_full_table_of_contents(text)
-
-        if toc:
-            one_bird_centered = False
-            multiple_bird_centered = False
-
-            if bird_id.lower() in toc.lower():
-                multiple_bird_centered = True
-            if bird_id.lower() in strategy_file.lower():
-                one_bird_centered = True
-                multiple_bird_centered = False
-
-            if multiple_bird_centered or one_bird_centered or row['strategy_present'] == True:
-                json_results = format_using_gpt(toc, bird_name, multiple_bird_centered)
-                if json_results:
-                    for key, value in json_results.items():
-                        row[key] = value
-                    row['Analyze_by_sisukord'] = True
-                    results.append(row)
-            else:
-                non_bird_strategy_texts = extract_bird_sections(text, bird_name)
-                row['Kokkuvõte_text'] = non_bird_strategy_texts
-                row['Analyze_by_sisukord'] = False
-                results.append(row)
-        elif not toc and bird_id.lower() in strategy_file.lower():
-            row['Kokkuvõte_text'] = text
-            row['Analyze_by_sisukord'] = False
-            results.append(row)
-        else:
-            non_bird_strategy_texts = extract_bird_sections(text, bird_name)
-            row['Kokkuvõte_text'] = non_bird_strategy_texts
-            row['Analyze_by_sisukord'] = False
-            results.append(row)
+        instrumentation.increment(STAGE, "rows_processed")
+
+        try:
+            result = process_row(
+                row,
+                index=species_index,
+                span_references=span_references,
+                document_mappings=document_mappings,
+            )
+        except budget.BudgetExhausted as e:
+            print(f"{e}. Deferring remaining rows starting from {row['Estonian Name']}.")
+            deferred_rows.append(row)
+            continue
+        if result is not None:
+            results.append(result)
 
     result_df = pd.DataFrame(results)
-    result_df.to_csv("st6_relevant_sections_extracted.csv", index=False, encoding='utf-8')
+    if previous_results is not None:
+        result_df = pd.concat([previous_results, result_df], ignore_index=True)
+    result_df.to_csv(output_csv, index=False, encoding='utf-8')
+    if span_references:
+        save_store()
+    budget.save_deferred(STAGE, deferred_rows)
 
 if __name__ == '__main__':
     main()
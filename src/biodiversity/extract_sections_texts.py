@@ -3,6 +3,15 @@ import os
 import re
 import pandas as pd
 
+from . import instrumentation, profiling
+from .corpus_store import CorpusDocument, normalise_section_text
+from .frames import iter_rows, merge_records
+from .pdf_structure import cached_section_tree, locate_sections, sections_toc_text
+from .pdf_text import cleaned_txt_pdf_path
+from .text_store import REFERENCE_SEPARATOR, save_store, spans_reference
+
+STAGE = "extract_sections_texts"
+
 
 ### File Handling Functions ###
 
@@ -215,89 +224,258 @@ def extract_text_for_sections(text, toc, sections, toc_start_line, toc_end_line)
     return extracted_text
 
 
+### Structural Extraction Functions ###
+
+def structural_sections(document, text_file_path, stage=STAGE):
+    """
+    Section tree of the PDF behind ``text_file_path`` (outline or heading fonts,
+    see pdf_structure) located on the mapped text, or None when the PDF is
+    missing, has no usable structure or the text lost its page breaks.
+    The regex ToC parser is the fallback for those documents.
+    """
+    pdf_path = cleaned_txt_pdf_path(text_file_path)
+    if not pdf_path.is_file():
+        return None
+    try:
+        tree = cached_section_tree(pdf_path)
+    except Exception as e:
+        print(f"Could not read the structure of {pdf_path}: {e}")
+        return None
+    located = locate_sections(document, tree)
+    if located:
+        instrumentation.increment(stage, "toc_from_structure")
+    return located
+
+
+def document_table_of_contents(text_file_path, text, stage=STAGE):
+    """
+    Table of Contents of a strategy text: rendered from the PDF structure when
+    available, otherwise parsed from the printed "Sisukord" in ``text``.
+    """
+    with CorpusDocument(text_file_path) as document:
+        located = structural_sections(document, text_file_path, stage=stage)
+    if located:
+        return sections_toc_text(located)
+    return extract_full_table_of_contents(text)[0]
+
+
+def extract_spans_from_structure(document, located, sections):
+    """
+    Structural counterpart of extract_spans_for_sections: a section's span
+    runs from its heading to the next section of the same or a higher level.
+    """
+    extracted_spans = {}
+    toc_sections_list = normalize_toc(sections_toc_text(located))
+
+    for section in sections:
+        # Split section names by ', ' to handle cases where multiple sections are provided in one line
+        for individual_section in [s.strip() for s in section.split(',')]:
+            section_idx, _ = find_section_in_toc(toc_sections_list, individual_section)
+            if section_idx is None:
+                print(f"Section '{individual_section}' not found in the document structure.")
+                continue
+            entry = located[section_idx]
+            extracted_spans[individual_section] = [document.span(entry["start"], entry["end"])]
+
+    return extracted_spans
+
+
+### Memory-Mapped Extraction Functions ###
+
+def locate_table_of_contents(document, window_pages=10):
+    """
+    Memory-mapped counterpart of extract_full_table_of_contents.
+    Only the pages following 'Sisukord' are decoded; the window is widened
+    while the ToC may continue past it. Line numbers refer to the whole document.
+    """
+    toc_start_offset = document.find("Sisukord")
+    if toc_start_offset == -1:
+        return None, None, None
+
+    prefix_lines = document.count_lines(toc_start_offset)
+    while True:
+        window_end = document.page_end(toc_start_offset, window_pages)
+        window = document.span(toc_start_offset, window_end).text()
+        toc, toc_start_line, toc_end_line = extract_full_table_of_contents(window)
+
+        # The parser stops after more than 10 non-ToC lines; with fewer left in
+        # the window it may have been cut short by the window end.
+        trailing_lines = window.splitlines()[toc_end_line - 1:] if toc else window.splitlines()
+        if window_end >= len(document) or sum(1 for line in trailing_lines if line.strip()) > 11:
+            break
+        window_pages *= 2
+
+    if not toc:
+        return None, None, None
+    return toc, prefix_lines + toc_start_line, prefix_lines + toc_end_line
+
+
+def extract_spans_for_sections(document, toc, sections, toc_start_line, toc_end_line):
+    """
+    Memory-mapped counterpart of extract_text_for_sections.
+    Returns {section: [TextSpan, ...]} instead of the texts; the ToC lines are
+    skipped in the search exactly as extract_text_for_sections removes them.
+    """
+    extracted_spans = {}
+    toc_sections_list = normalize_toc(toc)
+    removed_start = document.line_offset(toc_start_line - 1)
+    removed_end = max(removed_start, document.line_offset(toc_end_line))
+
+    def find_outside_toc(needle, start):
+        if start < removed_start:
+            position = document.find_caseless(needle, start, removed_start)
+            if position != -1:
+                return position
+        return document.find_caseless(needle, max(start, removed_end))
+
+    def spans_outside_toc(start, end):
+        if start < removed_start < end:
+            return [document.span(start, removed_start), document.span(max(removed_end, start), end)]
+        return [document.span(start, end)]
+
+    for section in sections:
+        # Split section names by ', ' to handle cases where multiple sections are provided in one line
+        for individual_section in [s.strip() for s in section.split(',')]:
+            section_idx, start_section_line = find_section_in_toc(toc_sections_list, individual_section)
+            if not start_section_line:
+                print(f"Section '{individual_section}' not found in Table of Contents.")
+                continue
+
+            start_index = find_outside_toc(start_section_line.lower(), 0)
+            if start_index == -1:
+                continue
+
+            end_index = len(document)
+            if section_idx + 1 < len(toc_sections_list):
+                found = find_outside_toc(toc_sections_list[section_idx + 1].lower(), start_index)
+                if found != -1:
+                    end_index = found
+
+            extracted_spans[individual_section] = spans_outside_toc(start_index, end_index)
+
+    return extracted_spans
+
+
+def spans_to_text(spans):
+    """
+    Decode section spans into the text extract_text_for_sections would return
+    (lower-cased, line breaks normalised to newlines, stripped).
+    """
+    return normalise_section_text("".join(span.text() for span in spans))
+
+
 ### CSV Processing Functions ###
 
-def process_row(row, strategy_file_path):
+def process_row(row, strategy_file_path, span_references=False):
     """
     Processes a single row of the CSV to extract relevant text sections from the corresponding strategy file.
     Concatenates extracted texts for each section list specified in the row.
+    With span_references the values are span references into the text store
+    (see text_store) instead of the texts.
     """
     sections_dict = {
-        'Elupaik': row['Elupaik'],
-        'Elupaiga seisund': row['Elupaiga seisund'],
-        'Ohud': row['Ohud'],
-        'Populatsiooni muutused Eestis': row['Populatsiooni muutused Eestis'],
-        'Uuringud': row['Uuringud'],
-        'Seisund ELis': row['Seisund ELis'],
-        'Kokkuvõte': row['Kokkuvõte']
+        'Elupaik': row.get('Elupaik'),
+        'Elupaiga seisund': row.get('Elupaiga seisund'),
+        'Ohud': row.get('Ohud'),
+        'Populatsiooni muutused Eestis': row.get('Populatsiooni muutused Eestis'),
+        'Uuringud': row.get('Uuringud'),
+        'Seisund ELis': row.get('Seisund ELis'),
+        'Kokkuvõte': row.get('Kokkuvõte')
     }
+    # Topics the mapping left out (missing or NaN) have no sections to look up
+    sections_dict = {name: value if isinstance(value, str) else "" for name, value in sections_dict.items()}
+    section_lists = [value for value in sections_dict.values() if value]
 
-    # Read text for the current strategy
-    text = read_text_from_file(strategy_file_path)
-
-    if text is None:
+    if not os.path.isfile(strategy_file_path):
+        print(f"File {strategy_file_path} not found.")
         return None
 
-    # Extract full Table of Contents
-    toc, toc_start_line, toc_end_line = extract_full_table_of_contents(text)
-    if not toc:
-        print(f"Sisukord not found for {strategy_file_path}.")
-        return None
-
-    # Extract text for the sections
-    extracted_text = extract_text_for_sections(text, toc, sections_dict.values(), toc_start_line, toc_end_line)
-
-    processed_data = {}
+    # Map the strategy text instead of reading it; sections are decoded one at a time
+    with CorpusDocument(strategy_file_path) as document:
+        located = structural_sections(document, strategy_file_path)
+        if located:
+            # The PDF outline or headings give the section offsets directly
+            extracted_spans = extract_spans_from_structure(document, located, section_lists)
+        else:
+            # Extract full Table of Contents
+            toc, toc_start_line, toc_end_line = locate_table_of_contents(document)
+            if not toc:
+                print(f"Sisukord not found for {strategy_file_path}.")
+                return None
+
+            # Locate the sections as spans of the mapped document
+            extracted_spans = extract_spans_for_sections(
+                document, toc, section_lists, toc_start_line, toc_end_line
+            )
+
+        processed_data = {}
+
+        # Concatenate texts for each required section and store them in the processed_data dictionary
+        for section_name, section_text in sections_dict.items():
+            individual_sections = [s.strip() for s in section_text.split(',')]
+            if span_references:
+                processed_data[f"{section_name}_text"] = REFERENCE_SEPARATOR.join(
+                    spans_reference(extracted_spans[s]) for s in individual_sections if s in extracted_spans
+                )
+                continue
 
-    # Concatenate texts for each required section and store them in the processed_data dictionary
-    for section_name, section_text in sections_dict.items():
-        individual_sections = [s.strip() for s in section_text.split(',')]
-        concatenated_text = "\n".join(extracted_text[s] for s in individual_sections if s in extracted_text)
+            section_texts = (
+                spans_to_text(extracted_spans[s]) for s in individual_sections if s in extracted_spans
+            )
+            concatenated_text = "\n".join(text for text in section_texts if text)
 
-        # Store concatenated text in a new key such as 'Elupaik_text'
-        processed_data[f"{section_name}_text"] = concatenated_text
+            # Store concatenated text in a new key such as 'Elupaik_text'
+            processed_data[f"{section_name}_text"] = concatenated_text
 
     return processed_data
 
 
-def process_csv(input_csv, strategy_materials_folder, output_csv):
+def process_csv(input_csv, strategy_materials_folder, output_csv, span_references=False):
     """
     Orchestrates the reading of the CSV, processing of each file, and saving the updated CSV.
     """
     # Load the CSV file
     df = pd.read_csv(input_csv)
 
-    # Iterate over each row in the DataFrame
-    for index, row in df.iterrows():
+    # Collect the extracted texts per row and merge them in one go
+    records = {}
+    for index, row in iter_rows(df):
+        profiling.next_row()
         # Extract the strategy file name and path
         strategy_file = row['strategy_file']
         strategy_file_path = os.path.join(strategy_materials_folder, strategy_file.replace('.pdf', '_cleaned.txt'))
 
         # Process the row to obtain extracted text
         if row['Analyze_by_sisukord'] == True:
-            extracted_text = process_row(row, strategy_file_path)
+            instrumentation.increment(STAGE, "rows_processed")
+            extracted_text = process_row(row, strategy_file_path, span_references=span_references)
 
             if extracted_text:
-                # Update the DataFrame with the extracted text for the current row
-                for key, value in extracted_text.items():
-                    df.at[index, key] = value
+                records[index] = extracted_text
+        else:
+            instrumentation.increment(STAGE, "rows_skipped")
+
+    df = merge_records(df, records)
 
     # Save the updated DataFrame to the output CSV file
     df.to_csv(output_csv, index=False)
+    if span_references:
+        save_store()
 
     print(f"Updated CSV file has been saved to {output_csv}")
 
 
 ### Main Function ###
 
-def main():
+@profiling.profile_option(STAGE)
+def main(span_references=False):
     # Define paths
     input_csv = 'st6_relevant_sections_extracted.csv'
     strategy_materials_folder = 'strategy_materials'
     output_csv = 'st7_texts_prepared_for_analysis.csv'
 
     # Process the entire CSV
-    process_csv(input_csv, strategy_materials_folder, output_csv)
+    process_csv(input_csv, strategy_materials_folder, output_csv, span_references=span_references)
 
 
 ### Script Entry Point ###
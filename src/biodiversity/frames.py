@@ -0,0 +1,39 @@
+"""
+Helpers for writing per-row stage results back into a DataFrame.
+
+Stages collect their results as plain records keyed by the row's index label
+and merge them once at the end, instead of setting cells one by one with
+``df.at`` inside the row loop.
+"""
+
+import pandas as pd
+
+
+def iter_rows(df, labels=None):
+    """Yield (index label, row dict) pairs; much cheaper than ``iterrows`` Series."""
+    frame = df if labels is None else df.loc[labels]
+    return iter(frame.to_dict("index").items())
+
+
+def merge_records(df, records):
+    """
+    Merge per-row results into ``df``.
+
+    :param df: DataFrame the records belong to.
+    :param records: {index label: {column: value}}; rows without a record and
+                    columns missing from a record keep their current values.
+    :return: DataFrame with new columns joined and existing columns updated.
+    """
+    if not records:
+        return df
+    results = pd.DataFrame.from_dict(records, orient="index")
+    existing = [column for column in results.columns if column in df.columns]
+    df = df.join(results.drop(columns=existing))
+
+    for column in existing:
+        values = results[column].dropna()
+        if values.empty:
+            continue
+        updated = df.index.isin(values.index)
+        df[column] = values.reindex(df.index).where(updated, df[column])
+    return df
@@ -1,43 +1,86 @@
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
+import hashlib
+import json
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import lxml.html
+import pandas as pd
+import requests
+
+from . import instrumentation, profiling
+
+STAGE = "get_extinct_species"
 
+SPECIES_LIST_FILENAME = "../../data/st1_kaitsekategooria_selgroogsed_loomad.csv"
+ACT_CACHE_DIR = "legal_acts_cache"
+FETCH_STATE_FILENAME = "legal_acts_state.json"
+# Species added, removed or moved to another category since the previous run
+DIFF_FILENAME = "../../data/st1_species_diff.csv"
 
-def fetch_page(url):
+# Riigi Teataja serves UTF-8; without this lxml falls back to Latin-1 for pages without a charset
+HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+
+def fetch_page(url, state=None, cache_dir=ACT_CACHE_DIR):
     """
-    Fetch the HTML content of the web page.
+    Fetch the HTML content of the web page, conditionally if it was fetched before.
 
     :param url: URL of the webpage.
-    :return: The raw HTML content.
+    :param state: Dict with the ETag/Last-Modified of earlier fetches, updated in place.
+    :param cache_dir: Directory holding the last fetched content of each URL.
+    :return: (raw HTML content, whether it changed since the last fetch).
     """
-    response = requests.get(url)
+    state = {} if state is None else state
+    cache_path = Path(cache_dir) / (hashlib.sha256(url.encode("utf-8")).hexdigest() + ".html")
+    previous = state.get(url, {})
+
+    headers = {}
+    if cache_path.is_file():
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    response = requests.get(url, headers=headers)
+    instrumentation.record_http_response(STAGE, response)
+    if response.status_code == 304:
+        return cache_path.read_bytes(), False
     response.raise_for_status()  # Raise an exception for HTTP errors
-    return response.content
+
+    content = response.content
+    content_sha256 = hashlib.sha256(content).hexdigest()
+    changed = content_sha256 != previous.get("sha256")
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_path.write_bytes(content)
+    state[url] = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": content_sha256,
+    }
+    return content, changed
 
 
-def extract_species_data(soup, section_title, category):
+def extract_species_data(document, section_title, category):
     """
     Extract species data from a specific section of the HTML content.
 
-    :param soup: BeautifulSoup object of the parsed HTML content.
-    :param section_title: The section title to search for (e.g., 'I kaitsekategooria selgroogsed loomad').
+    :param document: lxml HTML document of the page.
+    :param section_title: The anchor name of the section (e.g., 'para4' for 'I kaitsekategooria selgroogsed loomad').
     :param category: The extinction category.
     :return: List of extracted species data.
     """
     data = []
-    # Find the section in the text
-    section_header = soup.find("a", {"name": section_title})
-    if section_header:
-        table = section_header.find_next("table")
-        if table:
-            rows = table.find_all("tr")
-            for row in rows:
-                cells = row.find_all("td")
-                if len(cells) >= 2:
-                    estonian_name = cells[0].text.strip()
-                    latin_name = cells[1].text.strip(";").strip()
-                    data.append([estonian_name, latin_name, category])
+    # Find the section anchor and the first table after it
+    tables = document.xpath("(//a[@name=$name])[1]/following::table[1]", name=section_title)
+    if tables:
+        for row in tables[0].iter("tr"):
+            cells = row.xpath("./td")
+            if len(cells) >= 2:
+                estonian_name = cells[0].text_content().strip()
+                latin_name = cells[1].text_content().strip(";").strip()
+                data.append([estonian_name, latin_name, category])
     return data
 
 
@@ -64,24 +107,151 @@ def clean_data(data):
     return cleaned_data
 
 
-def parse_species_data(url, sections):
+def parse_species_data(html_content, sections):
     """
-    Parse species data from a web page.
+    Parse species data from the HTML of a legal act.
 
-    :param url: URL of the web page.
-    :param sections: Dictionary of section titles and their corresponding categories.
+    :param html_content: Raw HTML content of the page.
+    :param sections: Dictionary of section anchor names and their corresponding categories.
     :return: List of extracted species data.
     """
     all_data = []
-    html_content = fetch_page(url)
-    soup = BeautifulSoup(html_content, "html.parser")
+    document = lxml.html.fromstring(html_content, parser=HTML_PARSER)
 
     for section_title, category in sections.items():
-        all_data.extend(extract_species_data(soup, section_title, category))
+        all_data.extend(extract_species_data(document, section_title, category))
 
     return clean_data(all_data)
 
 
+def fetch_acts(acts, state, cache_dir=ACT_CACHE_DIR):
+    """
+    Fetch all acts concurrently.
+
+    :param acts: Dictionary of act URL -> sections.
+    :return: Dictionary of act URL -> (content, changed).
+    """
+    with ThreadPoolExecutor(max_workers=len(acts)) as executor:
+        futures = {url: executor.submit(fetch_page, url, state, cache_dir) for url in acts}
+        return {url: future.result() for url, future in futures.items()}
+
+
+def species_diff(previous, current):
+    """
+    Compare two species tables keyed by Latin name.
+
+    :return: DataFrame of added, removed and recategorised species with a "Change" column.
+    """
+    columns = ["Estonian Name", "Latin Name", "Category", "Previous Category", "Change"]
+    merged = previous.merge(
+        current, on="Latin Name", how="outer", suffixes=(" previous", ""), indicator=True
+    )
+    merged["Estonian Name"] = merged["Estonian Name"].fillna(merged["Estonian Name previous"])
+    merged["Previous Category"] = merged["Category previous"]
+    merged["Change"] = None
+    merged.loc[merged["_merge"] == "right_only", "Change"] = "added"
+    merged.loc[merged["_merge"] == "left_only", "Change"] = "removed"
+    merged.loc[
+        (merged["_merge"] == "both") & (merged["Category"] != merged["Category previous"]), "Change"
+    ] = "recategorised"
+    return merged[merged["Change"].notna()][columns].reset_index(drop=True)
+
+
+def species_list_version(filename):
+    """Version of a species list: the SHA-256 of its content, or None if there is none."""
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def diff_versions_path(diff_filename):
+    return Path(diff_filename).with_suffix(".json")
+
+
+def species_diff_path(input_path):
+    """The species diff read by a downstream stage: next to its input file, as st1 is."""
+    return Path(input_path).with_name(Path(DIFF_FILENAME).name)
+
+
+def save_diff(diff, filename, previous_version, current_version):
+    """Save the diff with the versions of the species lists it leads from and to."""
+    diff.to_csv(filename, index=False)
+    with open(diff_versions_path(filename), "w", encoding="utf-8") as f:
+        json.dump({"previous": previous_version, "current": current_version}, f)
+    print(f"Species diff '{filename}': " + ", ".join(
+        f"{len(diff[diff['Change'] == change])} {change}" for change in ("added", "removed", "recategorised")
+    ))
+
+
+def load_species_diff(diff_filename=DIFF_FILENAME, changes=("added", "recategorised")):
+    """
+    Return ({Latin names of the changed species}, previous version, current
+    version) of the last diff, or None if there is no diff.
+    """
+    versions_path = diff_versions_path(diff_filename)
+    if not os.path.isfile(diff_filename) or not versions_path.is_file():
+        return None
+    diff = pd.read_csv(diff_filename)
+    with open(versions_path, "r", encoding="utf-8") as f:
+        versions = json.load(f)
+    return set(diff.loc[diff["Change"].isin(changes), "Latin Name"]), versions["previous"], versions["current"]
+
+
+### Incremental downstream stages ###
+
+def output_version_path(output_path):
+    """``<output>.st1``: the species list version a stage output was built from."""
+    return Path(f"{output_path}.st1")
+
+
+def split_incremental(df, output_path, diff_filename):
+    """
+    Split the species rows of a stage for an incremental run.
+
+    Species rows are reused from the stage's previous output when that output
+    was built from the species list the last diff leads from (then only the
+    added and recategorised species are processed) or already from the
+    current one (then nothing is processed). Otherwise every row is.
+
+    :param df: Species rows of the stage's input, with a "Latin Name" column.
+    :param output_path: The stage's output file.
+    :return: (rows of ``df`` to process, rows of the previous output to keep or None).
+    """
+    diff = load_species_diff(diff_filename)
+    version_path = output_version_path(output_path)
+    if diff is None or not os.path.isfile(output_path) or not version_path.is_file():
+        return df, None
+    changed, previous_version, current_version = diff
+    output_version = version_path.read_text(encoding="utf-8").strip()
+    if output_version == current_version:
+        changed = set()
+    elif output_version != previous_version:
+        return df, None
+
+    previous = pd.read_csv(output_path)
+    reused = set(df["Latin Name"]) - changed
+    print(f"Incremental run: {len(df) - len(reused & set(previous['Latin Name']))} species to process, "
+          f"the rest reused from {output_path}")
+    return df[df["Latin Name"].isin(changed)], previous[previous["Latin Name"].isin(reused)]
+
+
+def join_incremental(df, processed, kept):
+    """Combine processed and reused output rows in the order of the input rows ``df``."""
+    if kept is None:
+        return processed
+    combined = pd.concat([kept, processed], ignore_index=True)
+    order = {name: position for position, name in enumerate(df["Latin Name"])}
+    return combined.sort_values("Latin Name", key=lambda names: names.map(order), kind="stable").reset_index(drop=True)
+
+
+def stamp_output(output_path, diff_filename):
+    """Record that ``output_path`` was built from the current species list version."""
+    diff = load_species_diff(diff_filename)
+    if diff is not None:
+        output_version_path(output_path).write_text(diff[2] or "", encoding="utf-8")
+
+
 def save_to_csv(data, filename):
     """
     Save the data to a CSV file.
@@ -94,22 +264,59 @@ def save_to_csv(data, filename):
     print(f"CSV file '{filename}' created successfully.")
 
 
-def main():
+def save_fetch_state(state, state_filename):
+    with open(state_filename, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+
+
+@profiling.profile_option(STAGE)
+def main(
+    output_filename: str = SPECIES_LIST_FILENAME,
+    diff_filename: str = DIFF_FILENAME,
+    state_filename: str = FETCH_STATE_FILENAME,
+) -> None:
     url_1 = "https://www.riigiteataja.ee/akt/118062014020"
     url_2 = "https://www.riigiteataja.ee/akt/104072014022"
 
-    sections_url_1 = {
-        "para4": "I",  # I kaitsekategooria selgroogsed loomad
-        "lg11": "II",  # II kaitsekategooria selgroogsed loomad
+    acts = {
+        url_1: {
+            "para4": "I",  # I kaitsekategooria selgroogsed loomad
+            "lg11": "II",  # II kaitsekategooria selgroogsed loomad
+        },
+        url_2: {"lg5": "III"},  # III kaitsekategooria selgroogsed loomad
     }
 
-    sections_url_2 = {"lg5": "III"}  # III kaitsekategooria selgroogsed loomad
+    state = {}
+    if os.path.isfile(state_filename):
+        with open(state_filename, "r", encoding="utf-8") as f:
+            state = json.load(f)
+
+    pages = fetch_acts(acts, state)
+
+    previous = None
+    previous_version = species_list_version(output_filename)
+    if previous_version is not None:
+        previous = pd.read_csv(output_filename)
+        if not any(changed for _, changed in pages.values()):
+            print("Legal acts unchanged since the last run.")
+            instrumentation.increment(STAGE, "rows_skipped", len(previous))
+            save_diff(species_diff(previous, previous), diff_filename, previous_version, previous_version)
+            save_fetch_state(state, state_filename)
+            return
+
+    all_data = []
+    for url, sections in acts.items():
+        all_data.extend(parse_species_data(pages[url][0], sections))
 
-    data_1 = parse_species_data(url_1, sections_url_1)
-    data_2 = parse_species_data(url_2, sections_url_2)
+    instrumentation.increment(STAGE, "rows_processed", len(all_data))
+    save_to_csv(all_data, output_filename)
 
-    all_data = data_1 + data_2
-    save_to_csv(all_data, "../../data/st1_kaitsekategooria_selgroogsed_loomad.csv")
+    if previous is None:
+        previous = pd.DataFrame(columns=["Estonian Name", "Latin Name", "Category"])
+    current = pd.DataFrame(all_data, columns=["Estonian Name", "Latin Name", "Category"])
+    save_diff(species_diff(previous, current), diff_filename, previous_version, species_list_version(output_filename))
+    # Only now: with the state saved earlier, a crash would leave the stale st1 "unchanged" forever
+    save_fetch_state(state, state_filename)
 
 
 if __name__ == "__main__":
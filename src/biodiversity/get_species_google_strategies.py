@@ -1,19 +1,34 @@
+import hashlib
 import os
+import threading
 import pandas as pd
 import requests
 import logging
-import time
-from datetime import datetime
-from googlesearch import search  # Ensure you have 'googlesearch-python' installed
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from . import instrumentation, profiling
+from .frames import iter_rows, merge_records
+from .search_scheduler import AdaptivePacer, SearchCache, SearchScheduler, search_backend
+
+STAGE = "get_species_google_strategies"
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
 # Define the directory to store downloaded PDF files
 strategy_materials_dir = "strategy_materials"
-input_csv_file = "../../data/st3_EELIS_additional_data.csv"  # Original CSV file
-output_csv_file = "../../data/st4_pdf_gathered.csv"  # New CSV file to save results
-search_delay = 10  # Delay between search requests in seconds
+input_csv_file = "st3_EELIS_additional_data.csv"  # Original CSV file
+output_csv_file = "st4_pdf_gathered.csv"  # New CSV file to save results
+search_cache_file = "search_cache.json"  # Query -> results of earlier runs
+search_delay = 10  # Initial delay between search requests in seconds, adapted to 429s
+download_workers = 4  # Downloads running while the next queries are searched
+
+SEARCH_EVENT_COUNTERS = {
+    "query": "search_queries",
+    "cache_hit": "search_cache_hits",
+    "rate_limited": "search_rate_limited",
+}
 
 
 def create_strategy_materials_dir(directory):
@@ -31,46 +46,40 @@ def save_csv(df, file_path):
     logging.info(f"Updated CSV file saved to {file_path}")
 
 
-def search_pdfs(query, num_results=10, max_retries=5):
+def make_scheduler(backend=None, cache_path=search_cache_file):
+    return SearchScheduler(
+        backend=search_backend(backend),
+        cache=SearchCache(cache_path),
+        pacer=AdaptivePacer(initial_delay=search_delay),
+        on_event=lambda name: instrumentation.increment(STAGE, SEARCH_EVENT_COUNTERS[name]),
+    )
+
+
+def search_pdfs(scheduler, query, num_results=10):
     logging.info(f"Searching for: {query}")
-    retries = 0
-    pdf_links = []
-
-    while retries < max_retries:
-        try:
-            for result in search(query, num_results=num_results):
-                if result.lower().endswith(".pdf"):
-                    pdf_links.append(result)
-                if len(pdf_links) >= 3:
-                    break
-            time.sleep(search_delay)  # Delay between queries
-            return pdf_links
-
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:
-                retries += 1
-                wait_time = search_delay * retries
-                logging.warning(f"Too many requests. Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-            else:
-                logging.error(f"HTTPError encountered: {e}")
-                break
-        except Exception as e:
-            retries += 1
-            wait_time = search_delay * retries
-            logging.error(f"Error encountered: {e}. Retrying in {wait_time} seconds...")
-            time.sleep(wait_time)
-
-    return []
+    results = scheduler.search(query, num_results=num_results)
+    return [result for result in results if result.lower().endswith(".pdf")][:3]
+
+
+def download_file_name(url):
+    """Local name of a downloaded URL; the hash of the full URL keeps documents with the same base name apart."""
+    base_name = os.path.basename(urlparse(url).path) or "document.pdf"
+    return f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:12]}_{base_name}"
 
 
 def download_pdf(url, folder):
+    file_name = os.path.join(folder, download_file_name(url))
+    if os.path.isfile(file_name) and os.path.getsize(file_name) > 0:
+        return file_name
     try:
         response = requests.get(url)
+        instrumentation.record_http_response(STAGE, response)
         if response.status_code == 200:
-            file_name = os.path.join(folder, url.split('/')[-1])
-            with open(file_name, 'wb') as f:
+            # Renamed into place, so concurrent downloads of the same URL never leave a mixed file
+            tmp_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_name, 'wb') as f:
                 f.write(response.content)
+            os.replace(tmp_name, file_name)
             logging.info(f"Downloaded: {url}")
             return file_name
         else:
@@ -80,29 +89,54 @@ def download_pdf(url, folder):
     return None
 
 
-def update_dataframe(df, directory):
-    for index, row in df.iterrows():
-        if not row['strategy_present']:  # Check if strategy_present is False
+def download_pdfs(links, directory):
+    downloaded_files = []
+    for link in links:
+        file_name = download_pdf(link, directory)
+        if file_name:
+            downloaded_files.append(file_name)
+    return downloaded_files
+
+
+def update_dataframe(df, directory, scheduler):
+    """
+    Search strategy PDFs for the species without one. Searches run one at a
+    time under the scheduler's pacing while the downloads of earlier hits run
+    in a thread pool.
+    """
+    downloads = {}
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        for index, row in iter_rows(df):
+            profiling.next_row()
+            if row['strategy_present']:
+                instrumentation.increment(STAGE, "rows_skipped")
+                continue
+            instrumentation.increment(STAGE, "rows_processed")
             query = f'"kaitse tegevuskava" "{row["Estonian Name"]}" pdf'
-            pdf_links = search_pdfs(query)
-            downloaded_files = []
-            for link in pdf_links:
-                file_name = download_pdf(link, directory)
-                if file_name:
-                    downloaded_files.append(file_name)
-            if downloaded_files:
-                df.at[index, 'strategy_present'] = True
-                df.at[index, 'strategy_file'] = ",".join(downloaded_files)
-                save_csv(df, output_csv_file)  # Save results to the specified new CSV file
-    return df
-
-
-def main():
+            pdf_links = search_pdfs(scheduler, query)
+            if pdf_links:
+                downloads[index] = executor.submit(download_pdfs, pdf_links, directory)
+
+    records = {}
+    for index, future in downloads.items():
+        downloaded_files = future.result()
+        if downloaded_files:
+            records[index] = {'strategy_present': True, 'strategy_file': ",".join(downloaded_files)}
+    return merge_records(df, records)
+
+
+@profiling.profile_option(STAGE)
+def main(
+    backend: str = None,
+    cache_path: str = search_cache_file,
+    input_csv_path: str = input_csv_file,
+    output_csv_path: str = output_csv_file,
+) -> None:
     create_strategy_materials_dir(strategy_materials_dir)
-    df = load_csv(input_csv_file)
-    df = update_dataframe(df, strategy_materials_dir)
-    save_csv(df, output_csv_file)  # Final save to ensure all changes are written to the new CSV file
+    df = load_csv(input_csv_path)
+    df = update_dataframe(df, strategy_materials_dir, make_scheduler(backend, cache_path))
+    save_csv(df, output_csv_path)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,240 @@
+"""
+Shared run instrumentation: per-stage counters, timings and run reports.
+
+Stages call ``increment`` for counters (rows processed/skipped, HTTP requests
+and bytes, PDF pages extracted/OCR'd, LLM calls and tokens) and ``observe`` for
+latency samples. ``run_pipeline`` wraps each stage in ``stage_timer`` and
+writes the collected values with ``write_run_report`` (JSON) and
+``write_openmetrics`` (OpenMetrics text exposition).
+"""
+
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+METRIC_PREFIX = "biodiversity"
+
+# Counter names used across the stages, with their OpenMetrics help text.
+COUNTER_HELP = {
+    "rows_processed": "Rows processed by the stage.",
+    "rows_skipped": "Rows skipped by the stage.",
+    "rows_failed": "Rows the stage failed on.",
+    "rows_not_found": "Rows whose registry lookup found nothing.",
+    "search_queries": "Web search queries issued.",
+    "search_cache_hits": "Web search queries answered from the search cache.",
+    "search_rate_limited": "Web search queries answered with HTTP 429.",
+    "http_requests": "HTTP requests and page loads issued.",
+    "http_bytes": "Bytes received over HTTP.",
+    "pdf_pages_extracted": "PDF pages converted from the embedded text layer.",
+    "pdf_pages_ocr": "PDF pages recognised with OCR.",
+    "toc_from_structure": "ToC lookups answered from the PDF outline or heading fonts.",
+    "ocr_cache_hits": "Scanned PDF pages answered from the OCR page cache.",
+    "stream_items_dropped": "Species a pipelined step dropped (no EELIS page, no strategy document, ...).",
+    "stream_items_failed": "Species a pipelined step failed on; retried by the next run.",
+    "work_queue_tasks_completed": "Work queue tasks this process completed.",
+    "work_queue_tasks_failed": "Work queue task attempts that raised an error.",
+    "work_queue_leases_reclaimed": "Work queue tasks taken over from a worker whose lease expired.",
+    "llm_calls": "LLM chat completion calls.",
+    "llm_errors": "LLM chat completion calls that raised an error.",
+    "llm_invalid_responses": "Structured LLM responses that failed schema validation.",
+    "llm_map_reduce_chunks": "Text chunks summarised separately in map-reduce mode.",
+    "llm_prompt_tokens": "Prompt tokens reported in LLM usage.",
+    "llm_completion_tokens": "Completion tokens reported in LLM usage.",
+}
+
+LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_samples = defaultdict(list)
+_wall_times = {}
+_stage_order = []
+
+
+def _register_stage(stage):
+    if stage not in _stage_order:
+        _stage_order.append(stage)
+
+
+def reset():
+    """Forget all collected values (used at the start of a pipeline run)."""
+    with _lock:
+        _counters.clear()
+        _samples.clear()
+        _wall_times.clear()
+        _stage_order.clear()
+
+
+def increment(stage, name, value=1):
+    """Add ``value`` to the counter ``name`` of ``stage``."""
+    with _lock:
+        _register_stage(stage)
+        _counters[(stage, name)] += value
+
+
+def observe(stage, name, value):
+    """Record one sample (e.g. a latency in seconds) for ``stage``."""
+    with _lock:
+        _register_stage(stage)
+        _samples[(stage, name)].append(float(value))
+
+
+@contextmanager
+def timed(stage, name):
+    """Observe the duration of the wrapped block as a sample of ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, name, time.perf_counter() - start)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Measure the wall time of a whole stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _register_stage(stage)
+            _wall_times[stage] = _wall_times.get(stage, 0.0) + elapsed
+
+
+def record_http_response(stage, response):
+    """Count a ``requests`` response and its payload size."""
+    increment(stage, "http_requests")
+    increment(stage, "http_bytes", len(response.content or b""))
+
+
+def record_llm_usage(stage, usage, latency):
+    """Count an LLM call with its ``usage`` block and latency in seconds."""
+    increment(stage, "llm_calls")
+    observe(stage, "llm_latency_seconds", latency)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if isinstance(usage, dict):
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+    increment(stage, "llm_prompt_tokens", prompt_tokens or 0)
+    increment(stage, "llm_completion_tokens", completion_tokens or 0)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of ``values`` (``q`` in 0..1)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarise_samples(values):
+    summary = {
+        "count": len(values),
+        "sum": sum(values),
+        "mean": sum(values) / len(values) if values else None,
+        "max": max(values) if values else None,
+    }
+    for q in LATENCY_QUANTILES:
+        summary[f"p{int(q * 100)}"] = percentile(values, q)
+    return summary
+
+
+def snapshot():
+    """
+    Return the collected values grouped by stage.
+
+    :return: {stage: {"wall_time_seconds": float, "counters": {...}, "samples": {...}}}
+    """
+    with _lock:
+        report = {}
+        for stage in _stage_order:
+            counters = {
+                name: value for (s, name), value in _counters.items() if s == stage
+            }
+            samples = {
+                name: summarise_samples(values)
+                for (s, name), values in _samples.items()
+                if s == stage
+            }
+            report[stage] = {
+                "wall_time_seconds": _wall_times.get(stage),
+                "counters": counters,
+                "samples": samples,
+            }
+        return report
+
+
+def write_run_report(path, extra=None):
+    """Write the JSON run report."""
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "stages": snapshot(),
+    }
+    if extra:
+        report.update(extra)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Run report saved to {path}")
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def write_openmetrics(path):
+    """Write the collected values in OpenMetrics text format."""
+    stages = snapshot()
+    lines = []
+
+    family = f"{METRIC_PREFIX}_stage_wall_time_seconds"
+    lines.append(f"# TYPE {family} gauge")
+    lines.append(f"# HELP {family} Wall time spent in the stage.")
+    for stage, data in stages.items():
+        if data["wall_time_seconds"] is not None:
+            lines.append(f'{family}{{stage="{stage}"}} {_format_value(data["wall_time_seconds"])}')
+
+    counter_names = sorted({name for data in stages.values() for name in data["counters"]})
+    for name in counter_names:
+        family = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# TYPE {family} counter")
+        lines.append(f"# HELP {family} {COUNTER_HELP.get(name, name)}")
+        for stage, data in stages.items():
+            if name in data["counters"]:
+                lines.append(f'{family}_total{{stage="{stage}"}} {_format_value(data["counters"][name])}')
+
+    sample_names = sorted({name for data in stages.values() for name in data["samples"]})
+    for name in sample_names:
+        family = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# TYPE {family} summary")
+        for stage, data in stages.items():
+            summary = data["samples"].get(name)
+            if not summary:
+                continue
+            for q in LATENCY_QUANTILES:
+                value = summary[f"p{int(q * 100)}"]
+                lines.append(f'{family}{{stage="{stage}",quantile="{q}"}} {_format_value(value)}')
+            lines.append(f'{family}_sum{{stage="{stage}"}} {_format_value(summary["sum"])}')
+            lines.append(f'{family}_count{{stage="{stage}"}} {summary["count"]}')
+
+    lines.append("# EOF")
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    print(f"OpenMetrics file saved to {path}")
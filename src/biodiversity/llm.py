@@ -0,0 +1,141 @@
+"""
+Thin wrapper around OpenAI chat completions shared by the LLM stages.
+
+Every call goes through ``chat_completion`` so that call counts, token usage
+and latency are recorded per stage in ``instrumentation`` and charged against
+the token budgets in ``budget``. ``structured_completion`` adds JSON-schema
+constrained responses (see ``llm_schemas``) that are parsed and validated.
+"""
+
+import json
+import time
+
+from . import budget, instrumentation
+
+
+def chat_completion(client, stage, **kwargs):
+    """
+    Run a chat completion and return the assistant message content.
+
+    Streaming requests (``stream=True``) are consumed here and returned as one
+    string; usage is requested via ``stream_options`` so it can be recorded.
+
+    :param client: OpenAI client instance.
+    :param stage: Name of the calling stage (used for metrics).
+    :param kwargs: Arguments passed to ``client.chat.completions.create``.
+    :return: The response text.
+    :raises budget.BudgetExhausted: If the call does not fit the remaining budget.
+    """
+    estimated_tokens = budget.estimate_tokens(
+        "".join(str(message.get("content") or "") for message in kwargs.get("messages", []))
+    )
+    budget.ensure_available(stage, estimated_tokens)
+    if "model" in kwargs:
+        kwargs["model"] = budget.select_model(stage, kwargs["model"])
+
+    if kwargs.get("stream"):
+        kwargs.setdefault("stream_options", {"include_usage": True})
+
+    start = time.perf_counter()
+    try:
+        response = client.chat.completions.create(**kwargs)
+        if kwargs.get("stream"):
+            content = ""
+            usage = None
+            for chunk in response:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    content += chunk.choices[0].delta.content
+        else:
+            content = response.choices[0].message.content
+            usage = getattr(response, "usage", None)
+    except Exception:
+        instrumentation.increment(stage, "llm_errors")
+        budget.release(stage, estimated_tokens)
+        raise
+
+    instrumentation.record_llm_usage(stage, usage, time.perf_counter() - start)
+    budget.charge(stage, usage, estimated_tokens=estimated_tokens)
+    return content
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a structured response is still invalid after the retry."""
+
+
+def validate(instance, schema, path="$"):
+    """
+    Check ``instance`` against the JSON schema subset used in ``llm_schemas``.
+
+    :raises StructuredOutputError: Describing the first violation found.
+    """
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        if not isinstance(instance, dict):
+            raise StructuredOutputError(f"{path} should be an object")
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in instance:
+                raise StructuredOutputError(f"{path} is missing '{key}'")
+        for key, value in instance.items():
+            if key in properties:
+                validate(value, properties[key], f"{path}.{key}")
+            elif schema.get("additionalProperties") is False:
+                raise StructuredOutputError(f"{path} has unexpected property '{key}'")
+    elif schema_type == "array":
+        if not isinstance(instance, list):
+            raise StructuredOutputError(f"{path} should be an array")
+        for position, item in enumerate(instance):
+            validate(item, schema.get("items", {}), f"{path}[{position}]")
+    elif schema_type == "string" and not isinstance(instance, str):
+        raise StructuredOutputError(f"{path} should be a string")
+    if "enum" in schema and instance not in schema["enum"]:
+        raise StructuredOutputError(f"{path} should be one of {schema['enum']}")
+
+
+def parse_structured(content, schema):
+    """Parse and validate a structured response."""
+    try:
+        instance = json.loads(content)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise StructuredOutputError(f"Response is not valid JSON: {e}") from e
+    validate(instance, schema)
+    return instance
+
+
+def structured_completion(client, stage, schema_name, schema, **kwargs):
+    """
+    Run a chat completion constrained to ``schema`` and return the parsed result.
+
+    If the response does not parse or validate, the call is retried once with
+    the invalid reply and the validation error added to the conversation.
+
+    :param schema_name: Name of the schema sent with the request.
+    :param schema: JSON schema of the expected response.
+    :param kwargs: Arguments passed to ``chat_completion``.
+    :return: The validated response (dict).
+    :raises StructuredOutputError: If the retry is invalid as well.
+    """
+    kwargs["response_format"] = {
+        "type": "json_schema",
+        "json_schema": {"name": schema_name, "strict": True, "schema": schema},
+    }
+    content = chat_completion(client, stage, **kwargs)
+    try:
+        return parse_structured(content, schema)
+    except StructuredOutputError as e:
+        instrumentation.increment(stage, "llm_invalid_responses")
+        print(f"Invalid {schema_name} response, retrying once: {e}")
+        kwargs["messages"] = list(kwargs["messages"]) + [
+            {"role": "assistant", "content": content or ""},
+            {"role": "user", "content": f"The reply above is invalid: {e}. "
+                                        "Answer again with JSON that matches the schema."},
+        ]
+
+    content = chat_completion(client, stage, **kwargs)
+    try:
+        return parse_structured(content, schema)
+    except StructuredOutputError:
+        instrumentation.increment(stage, "llm_invalid_responses")
+        raise
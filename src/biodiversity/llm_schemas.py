@@ -0,0 +1,55 @@
+"""
+JSON schemas of the structured LLM responses.
+
+The schemas are sent as ``response_format`` of type ``json_schema`` with
+``strict`` enabled, so they stick to the subset strict mode accepts: every
+object lists all of its properties as required and allows no others.
+"""
+
+SUMMARY_KEYS = (
+    "Kirjeldus (seisund, elupaik, populatsiooni muutused)",
+    "Ohutegurite kirjeldus (ohud, elupaiga seisund)",
+)
+
+SECTION_TOPICS = (
+    "Elupaik",
+    "Elupaiga seisund",
+    "Ohud",
+    "Populatsiooni muutused Eestis",
+    "Uuringud",
+    "Seisund ELis",
+    "Kokkuvõte",
+)
+
+
+def _object(properties):
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+# Topic -> ToC section titles related to it
+SECTION_MAPPING_SCHEMA = _object({
+    topic: {"type": "array", "items": {"type": "string"}}
+    for topic in SECTION_TOPICS
+})
+
+# Section mappings of several birds sharing one plan
+DOCUMENT_SECTION_MAPPING_SCHEMA = _object({
+    "birds": {
+        "type": "array",
+        "items": _object({
+            "bird": {"type": "string"},
+            "sections": SECTION_MAPPING_SCHEMA,
+        }),
+    },
+})
+
+# Description and threat summaries of one bird ("NA" if the text has none)
+SUMMARY_SCHEMA = _object({key: {"type": "string"} for key in SUMMARY_KEYS})
+
+# Summary of one topic ("NA" if the text has none)
+SECTION_SUMMARY_SCHEMA = _object({"summary": {"type": "string"}})
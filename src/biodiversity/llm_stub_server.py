@@ -0,0 +1,433 @@
+"""
+Local OpenAI-compatible stand-in for the LLM stages.
+
+The server answers ``POST /v1/chat/completions`` in three modes:
+
+* ``record`` - forward the request to the real API, store the response in the
+  cassette directory under the request hash and return it.
+* ``replay`` - return the stored response for the request hash; unseen
+  requests get a synthesised, schema-valid answer.
+* ``synth`` - always synthesise, never touch the cassette directory.
+
+Point the pipeline at it by exporting ``OPENAI_BASE_URL=http://127.0.0.1:8765/v1``
+before running a stage; the ``OpenAI`` clients created in the stage modules
+pick the variable up automatically.
+
+Example:
+
+    python -m biodiversity.llm_stub_server --mode replay --latency-ms 800 \
+        --error-rate 0.01 --rate-limit-rate 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+from .llm_schemas import SECTION_TOPICS, SUMMARY_KEYS
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Fields that change the answer; streaming flags only change the transport.
+HASHED_FIELDS = ("model", "messages", "response_format", "temperature", "top_p", "max_tokens")
+
+
+def request_hash(body):
+    """
+    Return a stable hash of the parts of a chat completion request that affect the answer.
+    """
+    payload = {field: body.get(field) for field in HASHED_FIELDS if field in body}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(text):
+    """Rough token estimate (about four characters per token)."""
+    return max(1, len(text or "") // 4)
+
+
+def prompt_text(body):
+    """Concatenate the contents of all messages in a request."""
+    return "\n".join(str(message.get("content") or "") for message in body.get("messages", []))
+
+
+def user_text(body):
+    """Return the content of the last user message of a request."""
+    for message in reversed(body.get("messages", [])):
+        if message.get("role") == "user":
+            return str(message.get("content") or "")
+    return ""
+
+
+### Synthesis ###
+
+def example_from_schema(schema, rng, toc_titles=()):
+    """
+    Build a value that validates against a (subset of) JSON schema.
+    """
+    schema_type = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        return {
+            key: example_from_schema(value, rng, toc_titles)
+            for key, value in properties.items()
+        }
+    if schema_type == "array":
+        item_schema = schema.get("items", {"type": "string"})
+        count = max(1, schema.get("minItems", 1))
+        return [example_from_schema(item_schema, rng, toc_titles) for _ in range(count)]
+    if schema_type == "integer":
+        return rng.randint(0, 10)
+    if schema_type == "number":
+        return round(rng.random(), 3)
+    if schema_type == "boolean":
+        return False
+    if toc_titles:
+        return rng.choice(toc_titles)
+    return "NA"
+
+
+def toc_titles_from_prompt(text):
+    """Extract the ToC entry titles (lines with dotted leaders) embedded in a prompt."""
+    titles = []
+    for line in text.splitlines():
+        if re.search(r"\.{5,}\s*\d+\s*$", line):
+            title = re.sub(r"\.{5,}\s*\d+\s*$", "", line).strip()
+            if title:
+                titles.append(title)
+    return titles
+
+
+def synthesise_section_mapping(text, rng):
+    """Answer a ToC section-mapping prompt in the structure expected by ``transform_json_response``."""
+    titles = toc_titles_from_prompt(text) or ["Kokkuvõte"]
+    match = re.search(r"seotud linnuga (.+?) ja järgmiste", text)
+    bird_name = match.group(1).strip() if match else "Lind"
+    sections = [{topic: [rng.choice(titles)]} for topic in SECTION_TOPICS]
+    return json.dumps({bird_name: sections}, ensure_ascii=False)
+
+
+def synthesise_text_summary(text, rng):
+    """Return a short deterministic summary built from the sentences of the prompt."""
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if len(s.strip()) > 20]
+    if not sentences:
+        return "NA"
+    count = min(len(sentences), rng.randint(1, 10))
+    start = rng.randint(0, len(sentences) - count)
+    return " ".join(sentences[start:start + count])
+
+
+def synthesise_content(body, rng):
+    """
+    Produce a plausible answer for a request that has no recording.
+    """
+    text = user_text(body)
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format.get("json_schema", {}).get("schema", {})
+        toc_titles = toc_titles_from_prompt(text)
+        content = example_from_schema(schema, rng, toc_titles)
+        if isinstance(content, dict) and "birds" in content:
+            # Document-level section mapping: one entry per bird named in the prompt
+            listed = re.split(r"iga järgmise \w+:", text, maxsplit=1)[-1].split(";", 1)[0]
+            bird_names = re.findall(r"'([^']+)'", listed)
+            content["birds"] = [
+                {"bird": bird_name, "sections": example_from_schema(
+                    schema["properties"]["birds"]["items"]["properties"]["sections"], rng, toc_titles
+                )}
+                for bird_name in bird_names
+            ]
+        return json.dumps(content, ensure_ascii=False)
+    if "sisukorda" in text and "JSON" in text:
+        return synthesise_section_mapping(text, rng)
+    if SUMMARY_KEYS[0] in text and "JSON" in text:
+        return json.dumps(
+            {key: synthesise_text_summary(text, rng) for key in SUMMARY_KEYS}, ensure_ascii=False
+        )
+    return synthesise_text_summary(text, rng)
+
+
+def completion_payload(body, content):
+    """Wrap synthesised content into a chat completion response."""
+    prompt_tokens = estimate_tokens(prompt_text(body))
+    completion_tokens = estimate_tokens(content)
+    return {
+        "id": f"chatcmpl-stub-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def stream_events(payload, include_usage, piece_size=64):
+    """Convert a chat completion into server-sent-event chunks."""
+    content = payload["choices"][0]["message"]["content"] or ""
+    base = {
+        "id": payload["id"],
+        "object": "chat.completion.chunk",
+        "created": payload["created"],
+        "model": payload["model"],
+    }
+    first = dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+    yield first
+    for start in range(0, len(content), piece_size):
+        piece = content[start:start + piece_size]
+        yield dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+    yield dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if include_usage:
+        yield dict(base, choices=[], usage=payload.get("usage"))
+
+
+### Cassette storage ###
+
+def load_recording(cassette_dir, key):
+    path = Path(cassette_dir) / f"{key}.json"
+    if not path.is_file():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["response"]
+
+
+def save_recording(cassette_dir, key, body, response):
+    cassette_path = Path(cassette_dir)
+    cassette_path.mkdir(parents=True, exist_ok=True)
+    tmp_path = cassette_path / f"{key}.json.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"request": body, "response": response}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, cassette_path / f"{key}.json")
+
+
+def forward_upstream(upstream_url, api_key, body):
+    """Send the request (non-streaming) to the real API and return the parsed response."""
+    upstream_body = {k: v for k, v in body.items() if k not in ("stream", "stream_options")}
+    response = requests.post(
+        upstream_url.rstrip("/") + "/chat/completions",
+        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        json=upstream_body,
+        timeout=600,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+### HTTP server ###
+
+class StubConfig:
+    """Runtime settings shared by all request handlers."""
+
+    def __init__(
+        self,
+        mode="replay",
+        cassette_dir="llm_cassettes",
+        upstream_url="https://api.openai.com/v1",
+        api_key=None,
+        latency_ms=0.0,
+        latency_jitter_ms=0.0,
+        latency_per_token_ms=0.0,
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        retry_after=1.0,
+        seed=0,
+    ):
+        self.mode = mode
+        self.cassette_dir = cassette_dir
+        self.upstream_url = upstream_url
+        self.api_key = api_key
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_per_token_ms = latency_per_token_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "replayed": 0, "recorded": 0, "synthesised": 0, "errors": 0, "rate_limited": 0}
+
+    def draw(self):
+        with self.lock:
+            return self.rng.random()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = StubConfig()
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, payload, include_usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        for event in stream_events(payload, include_usage):
+            self.wfile.write(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self.send_json(200, self.config.stats)
+        elif self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+        else:
+            self.send_json(404, {"error": {"message": "Not found"}})
+
+    def send_upstream_error(self, error):
+        """Pass an upstream error response on as is; connection errors become a 502."""
+        response = error.response
+        if response is None:
+            self.send_json(502, {"error": {"message": f"Upstream request failed: {error}", "type": "upstream_error"}})
+            return
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"error": {"message": response.text, "type": "upstream_error"}}
+        self.send_json(response.status_code, body)
+
+    def do_POST(self):
+        config = self.config
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unsupported path {self.path}"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config.count("requests")
+
+        draw = config.draw()
+        if draw < config.rate_limit_rate:
+            config.count("rate_limited")
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers={"Retry-After": str(config.retry_after)},
+            )
+            return
+        if draw < config.rate_limit_rate + config.error_rate:
+            config.count("errors")
+            self.send_json(500, {"error": {"message": "Injected server error (stub)", "type": "server_error"}})
+            return
+
+        key = request_hash(body)
+        payload = None
+        if config.mode in ("record", "replay"):
+            payload = load_recording(config.cassette_dir, key)
+            if payload is not None:
+                config.count("replayed")
+        if payload is None and config.mode == "record":
+            try:
+                payload = forward_upstream(config.upstream_url, config.api_key, body)
+            except requests.RequestException as e:
+                self.send_upstream_error(e)
+                return
+            save_recording(config.cassette_dir, key, body, payload)
+            config.count("recorded")
+        if payload is None:
+            rng = random.Random(key)
+            payload = completion_payload(body, synthesise_content(body, rng))
+            config.count("synthesised")
+        else:
+            # Recorded responses keep their original usage but get fresh latency.
+            payload = dict(payload)
+
+        completion_tokens = (payload.get("usage") or {}).get("completion_tokens", 0)
+        delay_ms = (
+            config.latency_ms
+            + config.latency_jitter_ms * (2 * config.draw() - 1)
+            + config.latency_per_token_ms * completion_tokens
+        )
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            self.send_stream(payload, include_usage)
+        else:
+            self.send_json(200, payload)
+
+
+def serve(config, host="127.0.0.1", port=8765):
+    """Start the stand-in server and block until interrupted."""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    logging.info(f"LLM stand-in ({config.mode}) listening on http://{host}:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info(f"LLM stand-in stats: {config.stats}")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="OpenAI-compatible record/replay stand-in server.")
+    parser.add_argument("--mode", choices=("record", "replay", "synth"), default="replay")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cassette-dir", default="llm_cassettes")
+    parser.add_argument("--upstream-url", default="https://api.openai.com/v1")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--latency-per-token-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = StubConfig(
+        mode=args.mode,
+        cassette_dir=args.cassette_dir,
+        upstream_url=args.upstream_url,
+        api_key=os.getenv("OPENAI_API_KEY") or os.getenv("OPENAIKEY"),
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        latency_per_token_ms=args.latency_per_token_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    serve(config, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
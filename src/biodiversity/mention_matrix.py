@@ -0,0 +1,68 @@
+"""
+Multi-pattern matching for the species mention index.
+
+All search terms are compiled into a single Aho-Corasick automaton, so every
+document is scanned exactly once no matter how many species are searched for
+(see ``species_index.scan_text``). Like the ``re.findall`` it replaces,
+matching is not restricted to word boundaries; callers lower-case the text.
+"""
+
+from collections import deque
+
+
+def build_automaton(patterns):
+    """
+    Build an Aho-Corasick automaton for the given patterns.
+
+    :param patterns: List of (already lower-cased) pattern strings.
+    :return: (goto, fail, output) where ``goto`` is a list of {char: state}
+             transitions, ``fail`` the failure links and ``output`` the list of
+             pattern ids ending in each state.
+    """
+    goto = [{}]
+    output = [[]]
+    for pattern_id, pattern in enumerate(patterns):
+        if not pattern:
+            continue
+        state = 0
+        for char in pattern:
+            next_state = goto[state].get(char)
+            if next_state is None:
+                next_state = len(goto)
+                goto[state][char] = next_state
+                goto.append({})
+                output.append([])
+            state = next_state
+        output[state].append(pattern_id)
+
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, next_state in goto[state].items():
+            queue.append(next_state)
+            fallback = fail[state]
+            while fallback and char not in goto[fallback]:
+                fallback = fail[fallback]
+            candidate = goto[fallback].get(char, 0)
+            # Children of the root fall back to the root itself
+            fail[next_state] = candidate if candidate != next_state else 0
+            output[next_state] = output[next_state] + output[fail[next_state]]
+    return goto, fail, output
+
+
+def iter_matches(automaton, text):
+    """Yield (end_index, pattern_id) for every occurrence of every pattern in ``text``."""
+    goto, fail, output = automaton
+    state = 0
+    for index, char in enumerate(text):
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        for pattern_id in output[state]:
+            yield index, pattern_id
+
+
+def save_mention_matrix(matrix, path):
+    matrix.to_csv(path)
+    print(f"Mention matrix saved to {path}")
@@ -0,0 +1,153 @@
+"""
+OCR of scanned PDF pages.
+
+Pages are rendered with PyMuPDF straight into 8-bit grayscale buffers at
+``OCR_DPI`` (default 300) - no pdftoppm subprocess and no PPM files on disk -
+and handed to an OCR engine that stays loaded for the life of the process:
+
+``tesserocr``
+    A single in-process Tesseract API handle per language, so the ``est``
+    model is loaded once and every page only pays for recognition.
+``pytesseract``
+    Fallback when tesserocr is not installed; runs the tesseract binary per
+    page, but still skips the PDF rasterisation round trip.
+
+The engine is chosen with ``OCR_ENGINE`` (default: tesserocr if importable).
+
+``OCRPageCache`` keeps the raw text of every recognised page on disk, keyed by
+the SHA-256 of the rendered pixels plus engine, language and DPI. Re-runs,
+e.g. after a change to the LLM cleanup, skip recognition entirely, and a page
+that appears in several documents is only recognised once.
+"""
+
+import hashlib
+import os
+import socket
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+try:
+    import tesserocr
+except ImportError:  # optional, much faster than pytesseract
+    tesserocr = None
+
+DEFAULT_LANG = "est"
+DEFAULT_CACHE_DIR = ".ocr_cache"
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+
+PageImage = namedtuple("PageImage", ["samples", "width", "height", "stride", "dpi"])
+
+
+def render_page(page, dpi=OCR_DPI):
+    """Render a PyMuPDF page to an 8-bit grayscale ``PageImage``."""
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return PageImage(pix.samples, pix.width, pix.height, pix.stride, dpi)
+
+
+def iter_page_images(pdf_path, dpi=OCR_DPI):
+    """Yield the pages of a PDF as grayscale images, one page in memory at a time."""
+    with fitz.open(pdf_path) as pdf_document:
+        for page in pdf_document:
+            yield render_page(page, dpi=dpi)
+
+
+### Engines ###
+
+class OCREngine:
+    name = "base"
+
+    def __init__(self, lang=DEFAULT_LANG):
+        self.lang = lang
+
+    def recognise(self, image):
+        """Return the text of a ``PageImage``."""
+        raise NotImplementedError
+
+
+class TesserocrEngine(OCREngine):
+    name = "tesserocr"
+
+    def __init__(self, lang=DEFAULT_LANG):
+        if tesserocr is None:
+            raise ImportError("tesserocr is not installed")
+        super().__init__(lang)
+        self.api = tesserocr.PyTessBaseAPI(lang=lang)
+        # A Tesseract handle must not be used from two threads at once
+        self._lock = threading.Lock()
+
+    def recognise(self, image):
+        with self._lock:
+            self.api.SetImageBytes(image.samples, image.width, image.height, 1, image.stride)
+            self.api.SetSourceResolution(image.dpi)
+            return self.api.GetUTF8Text()
+
+
+class PytesseractEngine(OCREngine):
+    name = "pytesseract"
+
+    def recognise(self, image):
+        import pytesseract
+        from PIL import Image
+
+        pil_image = Image.frombuffer(
+            "L", (image.width, image.height), image.samples, "raw", "L", image.stride, 1
+        )
+        return pytesseract.image_to_string(pil_image, lang=self.lang, config=f"--dpi {image.dpi}")
+
+
+OCR_ENGINES = {
+    "tesserocr": TesserocrEngine,
+    "pytesseract": PytesseractEngine,
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def default_engine_name():
+    return os.getenv("OCR_ENGINE") or ("tesserocr" if tesserocr is not None else "pytesseract")
+
+
+def ocr_engine(name=None, lang=DEFAULT_LANG):
+    """
+    Return the process-wide engine ``name`` for ``lang``, creating it on first use.
+    """
+    name = name or default_engine_name()
+    if name not in OCR_ENGINES:
+        raise ValueError(f"Unknown OCR engine '{name}', expected one of {sorted(OCR_ENGINES)}")
+    with _engines_lock:
+        if (name, lang) not in _engines:
+            _engines[(name, lang)] = OCR_ENGINES[name](lang=lang)
+        return _engines[(name, lang)]
+
+
+### Page cache ###
+
+class OCRPageCache:
+    """Raw OCR text per page image, stored as ``<cache dir>/<key>.txt``."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, engine, image):
+        digest = hashlib.sha256()
+        digest.update(f"{image.width}x{image.height}/{image.stride}".encode())
+        digest.update(image.samples)
+        return f"{digest.hexdigest()}-{engine.name}-{engine.lang}-{image.dpi}"
+
+    def get(self, engine, image):
+        path = self.cache_dir / f"{self.key(engine, image)}.txt"
+        if not path.is_file():
+            return None
+        return path.read_text(encoding="utf-8")
+
+    def put(self, engine, image, text):
+        path = self.cache_dir / f"{self.key(engine, image)}.txt"
+        # Unique per writer: hosts sharing the cache directory may OCR the same page
+        tmp_path = path.with_name(f"{path.name}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
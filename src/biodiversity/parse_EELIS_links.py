@@ -1,32 +1,23 @@
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 import pandas as pd
 
+from . import instrumentation, profiling
+from .browser import init_webdriver
+from .get_extinct_species import join_incremental, species_diff_path, split_incremental, stamp_output
+
+STAGE = "parse_EELIS_links"
+
 
 def read_csv(file_path):
     """Read the CSV file and return a DataFrame."""
     return pd.read_csv(file_path)
 
 
-def init_webdriver(headless=True):
-    """Initialize the Selenium WebDriver using webdriver_manager."""
-    options = webdriver.ChromeOptions()
-    if headless:
-        options.add_argument("--headless")
-    driver = webdriver.Chrome(
-        service=Service(ChromeDriverManager().install()), options=options
-    )
-    wait = WebDriverWait(driver, 10)
-    return driver, wait
-
-
-def search_with_name(driver, wait, url, name):
+def search_with_name(driver, wait, url, name, stage=STAGE):
     """Search for the species on the provided URL using the second search window and return the first link found."""
     driver.get(url)
+    instrumentation.increment(stage, "http_requests")
 
     search_field = wait.until(EC.presence_of_element_located((By.ID, "otsi_nimi")))
     search_field.clear()
@@ -50,31 +41,52 @@ def search_with_name(driver, wait, url, name):
     return link
 
 
-def search_and_get_link(driver, wait, url, estonian_name, latin_name):
-    """Search for the species on the provided URL using the second search window and return the first link found."""
+def search_and_get_link(driver, wait, url, estonian_name, latin_name, stage=STAGE):
+    """
+    Search for the species on the provided URL using the second search window and return the first link found.
+    Requests and misses are counted under ``stage``; counting the row is up to the caller.
+    """
     combined_name = f"{estonian_name} ({latin_name})"
-    link = search_with_name(driver, wait, url, combined_name)
+    link = search_with_name(driver, wait, url, combined_name, stage=stage)
     if link == "NotFound":
-        link = search_with_name(driver, wait, url, estonian_name)
+        link = search_with_name(driver, wait, url, estonian_name, stage=stage)
+    if link == "NotFound":
+        instrumentation.increment(stage, "rows_not_found")
     return link
 
 
 def process_csv_and_search_links(csv_file_path, updated_csv_file_path, url, headless=True):
-    """Main function to read CSV, search for each species using the second search window, and save updated CSV."""
+    """
+    Main function to read CSV, search for each species using the second search window, and save updated CSV.
+    Species unchanged since the previous output keep their link (see get_extinct_species.split_incremental).
+    """
     df = read_csv(csv_file_path)
-    driver, wait = init_webdriver(headless=headless)
+    diff_path = species_diff_path(csv_file_path)
+    pending, kept = split_incremental(df, updated_csv_file_path, diff_path)
+
+    pending = pending.copy()
+    pending["EELIS link"] = None
+    if len(pending):
+        driver, wait = init_webdriver(headless=headless)
 
-    def process_row(row):
-        return search_and_get_link(driver, wait, url, row["Estonian Name"], row["Latin Name"])
+        def process_row(row):
+            profiling.next_row()
+            instrumentation.increment(STAGE, "rows_processed")
+            return search_and_get_link(driver, wait, url, row["Estonian Name"], row["Latin Name"])
 
-    df["EELIS link"] = df.apply(lambda row: process_row(row), axis=1)
+        pending["EELIS link"] = pending.apply(lambda row: process_row(row), axis=1)
 
-    driver.quit()
+        driver.quit()
+    if kept is not None:
+        instrumentation.increment(STAGE, "rows_skipped", len(kept))
 
+    df = join_incremental(df, pending, kept)
     df.to_csv(updated_csv_file_path, index=False)
+    stamp_output(updated_csv_file_path, diff_path)
     print(f"Updated CSV saved to {updated_csv_file_path}")
 
 
+@profiling.profile_option(STAGE)
 def main(
     input_csv_path: str = "st1_kaitsekategooria_selgroogsed_loomad.csv",
     output_csv_path: str = "st2_EELIS_kaitsekategooria_selgroogsed_loomad.csv",
@@ -0,0 +1,196 @@
+"""
+Section structure of strategy PDFs, read from the PDF itself.
+
+The regex ToC parser in ``extract_sections_texts`` depends on a printed
+"Sisukord" with dotted leaders. Many action plans carry the same information
+in a structured form, so it is tried first:
+
+1. the embedded outline (bookmarks) from ``doc.get_toc()``;
+2. otherwise headings detected from font size and weight in the
+   ``get_text("dict")`` spans - lines set larger than the body text, or bold
+   at body size, with the distinct heading sizes as levels.
+
+The section tree depends only on the PDF and is cached next to the text
+sidecars as ``<sha256>.sections.json``. ``locate_sections`` places it on the
+form-feed separated ``_cleaned.txt`` text: every section is searched for on
+its own page, which yields byte offsets for the section and its subsections
+directly, without scanning the printed ToC.
+"""
+
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+from .pdf_text import DEFAULT_CACHE_DIR, file_sha256
+
+# Span flag PyMuPDF sets for bold fonts
+BOLD_FLAG = 16
+# Lines at least this much larger than the body text are headings
+HEADING_SIZE_RATIO = 1.15
+MAX_HEADING_CHARS = 120
+# Fewer detected headings than this is not a usable structure
+MIN_SECTIONS = 3
+# Heading-like lines repeated on more pages are running headers, not sections
+MAX_HEADING_REPEATS = 2
+
+
+def _clean_title(title):
+    return " ".join(title.split())
+
+
+def outline_sections(pdf_document):
+    """Sections from the embedded outline as [{"level", "title", "page"}] (0-based pages)."""
+    sections = []
+    for level, title, page in pdf_document.get_toc(simple=True):
+        title = _clean_title(title)
+        if title and page >= 1:
+            sections.append({"level": level, "title": title, "page": page - 1})
+    return sections
+
+
+def _text_lines(pdf_document):
+    """Return [(page, text, font size, bold, characters)] for every non-empty text line."""
+    lines = []
+    for page_number, page in enumerate(pdf_document):
+        for block in page.get_text("dict")["blocks"]:
+            # Image blocks have no lines
+            for line in block.get("lines", []):
+                spans = [span for span in line["spans"] if span["text"].strip()]
+                if not spans:
+                    continue
+                lines.append((
+                    page_number,
+                    _clean_title(" ".join(span["text"] for span in spans)),
+                    round(max(span["size"] for span in spans), 1),
+                    all(span["flags"] & BOLD_FLAG for span in spans),
+                    sum(len(span["text"].strip()) for span in spans),
+                ))
+    return lines
+
+
+def font_sections(pdf_document):
+    """Sections detected from heading fonts, in the format of ``outline_sections``."""
+    lines = _text_lines(pdf_document)
+    size_chars = Counter()
+    for _, _, size, _, chars in lines:
+        size_chars[size] += chars
+    if not size_chars:
+        return []
+    body_size = size_chars.most_common(1)[0][0]
+
+    headings = []
+    previous_line = None
+    for line_number, (page_number, text, size, bold, _) in enumerate(lines):
+        if len(text) > MAX_HEADING_CHARS or not any(char.isalpha() for char in text):
+            continue
+        if size < body_size * HEADING_SIZE_RATIO and not (bold and size >= body_size):
+            continue
+        previous = headings[-1] if headings else None
+        # A heading wrapped over several lines continues in the same font on the next line
+        if (
+            previous is not None
+            and previous_line == line_number - 1
+            and previous["page"] == page_number
+            and previous["size"] == size
+            and not text[0].isdigit()
+        ):
+            previous["title"] = f"{previous['title']} {text}"
+        else:
+            headings.append({"title": text, "page": page_number, "size": size})
+        previous_line = line_number
+
+    pages_per_title = Counter(title for title, _ in {(h["title"], h["page"]) for h in headings})
+    headings = [h for h in headings if pages_per_title[h["title"]] <= MAX_HEADING_REPEATS]
+
+    sizes = sorted({h["size"] for h in headings}, reverse=True)
+    return [
+        {"level": sizes.index(h["size"]) + 1, "title": h["title"], "page": h["page"]}
+        for h in headings
+    ]
+
+
+def extract_section_tree(pdf_path):
+    """
+    Read the section tree of a PDF.
+
+    :return: {"source": "outline", "fonts" or None, "page_count", "sections"}.
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        page_count = len(pdf_document)
+        for source, extractor in (("outline", outline_sections), ("fonts", font_sections)):
+            sections = extractor(pdf_document)
+            if len(sections) >= MIN_SECTIONS:
+                return {"source": source, "page_count": page_count, "sections": sections}
+    return {"source": None, "page_count": page_count, "sections": []}
+
+
+def cached_section_tree(pdf_path, cache_dir=DEFAULT_CACHE_DIR):
+    """``extract_section_tree`` cached per PDF content as ``<sha256>.sections.json``."""
+    cache_path = Path(cache_dir) / f"{file_sha256(pdf_path)}.sections.json"
+    if cache_path.is_file():
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    tree = extract_section_tree(pdf_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(tree, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+    return tree
+
+
+def _find_title(document, title, start, end):
+    """Offset of a section title on its page; section numbers may be missing from the text."""
+    position = document.find_words_caseless(title, start, end)
+    words = title.split()
+    if position == -1 and len(words) > 1 and not any(char.isalpha() for char in words[0]):
+        position = document.find_words_caseless(" ".join(words[1:]), start, end)
+    return position
+
+
+def locate_sections(document, tree):
+    """
+    Place a section tree on a form-feed separated ``CorpusDocument``.
+
+    :return: The sections with "start" and "end" byte offsets (a section ends
+             where the next section of the same or a higher level starts), or
+             None if the text does not have the PDF's pages.
+    """
+    if not tree["sections"]:
+        return None
+    page_offsets = document.page_offsets()
+    if len(page_offsets) < tree["page_count"] + 1:
+        return None
+
+    located = []
+    previous_start = 0
+    for section in tree["sections"]:
+        page_start = page_offsets[min(section["page"], len(page_offsets) - 1)]
+        page_end = page_offsets[min(section["page"] + 1, len(page_offsets) - 1)]
+        search_start = max(page_start, previous_start)
+        position = _find_title(document, section["title"], search_start, max(page_end, search_start))
+        start = position if position != -1 else search_start
+        located.append(dict(section, start=start))
+        previous_start = start
+
+    for i, section in enumerate(located):
+        section["end"] = next(
+            (later["start"] for later in located[i + 1:] if later["level"] <= section["level"]),
+            len(document),
+        )
+    return located
+
+
+def sections_toc_text(sections):
+    """
+    Render sections as ToC lines ("title ..... page") in the format the regex
+    parser produces, so the section names work with the existing ToC helpers.
+    """
+    return "\n".join(
+        f"{'  ' * (section['level'] - 1)}{section['title']} ..... {section['page'] + 1}"
+        for section in sections
+    )
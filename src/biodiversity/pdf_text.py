@@ -0,0 +1,269 @@
+"""
+In-process PDF text extraction with PyMuPDF.
+
+``page_layout_text`` produces text in the shape of ``pdftotext -layout``:
+words are placed on a fixed-pitch grid so dotted ToC leaders and column
+alignment survive. ``write_layout_text`` streams a PDF through it page by
+page and terminates every page with a form feed (``\\f``), which the ToC
+parser in ``extract_sections_texts`` relies on.
+
+``cached_pdf_text`` is the shared, content-addressed text cache: it reuses the
+``_cleaned.txt`` produced by the conversion/OCR stages when it was made from
+the PDF's current content (see ``cleaned_txt_is_current``), otherwise a
+sidecar ``<sha256>.txt`` in the cache directory, and only as a last resort
+streams the PDF page by page (writing the sidecar for the next caller).
+Texts kept in memory are keyed by ``text_fingerprint``, so a ``_cleaned.txt``
+written after the PDF's text layer was read (e.g. by OCR) is picked up.
+"""
+
+import hashlib
+import os
+import statistics
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+from . import instrumentation
+
+DEFAULT_CACHE_DIR = ".pdf_text_cache"
+MEMORY_CACHE_SIZE = 16
+
+# Vertical gap (in line heights) above which an empty line is emitted.
+BLANK_LINE_GAP = 1.6
+
+
+def _group_words_into_lines(words):
+    """Group PyMuPDF word tuples into visual lines ordered top to bottom."""
+    words = sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0]))
+    lines = []
+    for word in words:
+        center = (word[1] + word[3]) / 2
+        height = word[3] - word[1]
+        if lines:
+            line = lines[-1]
+            if abs(center - line["center"]) <= max(line["height"], height) / 2:
+                line["words"].append(word)
+                count = len(line["words"])
+                line["center"] += (center - line["center"]) / count
+                line["height"] = max(line["height"], height)
+                continue
+        lines.append({"center": center, "height": height, "top": word[1], "words": [word]})
+    return lines
+
+
+def page_layout_text(page):
+    """
+    Render the text of one page on a fixed-pitch grid, similar to ``pdftotext -layout``.
+    """
+    words = page.get_text("words")
+    if not words:
+        return ""
+
+    char_widths = [(w[2] - w[0]) / len(w[4]) for w in words if w[4]]
+    char_width = statistics.median(char_widths) if char_widths else 5.0
+    char_width = max(char_width, 1.0)
+    left_margin = min(w[0] for w in words)
+
+    output_lines = []
+    previous_line = None
+    for line in _group_words_into_lines(words):
+        if previous_line is not None:
+            gap = line["top"] - (previous_line["top"] + previous_line["height"])
+            if gap > BLANK_LINE_GAP * previous_line["height"]:
+                output_lines.append("")
+
+        text = ""
+        for word in sorted(line["words"], key=lambda w: w[0]):
+            column = int(round((word[0] - left_margin) / char_width))
+            if text:
+                column = max(column, len(text) + 1)
+            text = text.ljust(column) + word[4]
+        output_lines.append(text.rstrip())
+        previous_line = line
+
+    return "\n".join(output_lines) + "\n"
+
+
+def iter_page_texts(pdf_path, layout=True):
+    """
+    Yield the text of each page, keeping only one page in memory and closing the document.
+    """
+    with fitz.open(pdf_path) as document:
+        for page in document:
+            yield page_layout_text(page) if layout else page.get_text()
+
+
+### Shared text cache ###
+
+_lock = threading.Lock()
+_hash_memo = {}
+_memory_cache = OrderedDict()
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Return the SHA-256 of a file, memoised on (path, size, mtime)."""
+    path = Path(path)
+    stat = path.stat()
+    memo_key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    sha = digest.hexdigest()
+
+    with _lock:
+        _hash_memo[memo_key] = sha
+    return sha
+
+
+def cleaned_txt_path(pdf_path):
+    pdf_path = Path(pdf_path)
+    return pdf_path.with_name(pdf_path.stem + "_cleaned.txt")
+
+
+def cleaned_txt_stamp_path(pdf_path):
+    """``<name>_cleaned.txt.sha256``: the SHA-256 of the PDF the text was produced from."""
+    text_path = cleaned_txt_path(pdf_path)
+    return text_path.with_name(text_path.name + ".sha256")
+
+
+def stamp_cleaned_txt(pdf_path):
+    """Record the PDF content the ``_cleaned.txt`` next to ``pdf_path`` was just produced from."""
+    cleaned_txt_stamp_path(pdf_path).write_text(file_sha256(pdf_path), encoding="utf-8")
+
+
+def cleaned_txt_is_current(pdf_path, sha=None):
+    """
+    Whether the ``_cleaned.txt`` of a PDF exists and was produced from its
+    current content. Texts written before stamps existed count as current
+    while they are newer than the PDF.
+    """
+    text_path = cleaned_txt_path(pdf_path)
+    if not text_path.is_file():
+        return False
+    stamp_path = cleaned_txt_stamp_path(pdf_path)
+    if stamp_path.is_file():
+        return stamp_path.read_text(encoding="utf-8").strip() == (sha or file_sha256(pdf_path))
+    return text_path.stat().st_mtime_ns >= Path(pdf_path).stat().st_mtime_ns
+
+
+def cleaned_txt_pdf_path(text_path):
+    """The PDF a ``_cleaned.txt`` file was produced from."""
+    text_path = Path(text_path)
+    return text_path.with_name(text_path.name[:-len("_cleaned.txt")] + ".pdf")
+
+
+def text_fingerprint(pdf_path, sha=None):
+    """
+    Identity of the text ``cached_pdf_text`` returns for a PDF: its content
+    hash and, when the text comes from a current ``_cleaned.txt``, that
+    file's size and modification time.
+    """
+    sha = sha or file_sha256(pdf_path)
+    fingerprint = {"sha256": sha}
+    if cleaned_txt_is_current(pdf_path, sha):
+        stat = cleaned_txt_path(pdf_path).stat()
+        fingerprint["cleaned_txt"] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def _memory_key(fingerprint):
+    return (fingerprint["sha256"], *fingerprint.get("cleaned_txt", ()))
+
+
+def sidecar_path(sha, cache_dir=DEFAULT_CACHE_DIR):
+    return Path(cache_dir) / f"{sha}.txt"
+
+
+def _remember(key, text):
+    with _lock:
+        _memory_cache[key] = text
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+
+def _read_text(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def write_layout_text(pdf_path, target):
+    """
+    Stream the layout text of a PDF page by page into ``target`` (written atomically).
+
+    :return: Number of pages written.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    pages = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for page_text in iter_page_texts(pdf_path):
+            f.write(page_text + "\f")
+            pages += 1
+    os.replace(tmp_path, target)
+    return pages
+
+
+def write_sidecar(pdf_path, sha, cache_dir=DEFAULT_CACHE_DIR, stage=None):
+    """
+    Stream the pages of a PDF into its sidecar file and return the sidecar path.
+    """
+    target = sidecar_path(sha, cache_dir)
+    pages = write_layout_text(pdf_path, target)
+    if stage:
+        instrumentation.increment(stage, "pdf_pages_extracted", pages)
+    return target
+
+
+def read_pdf_text(pdf_path, cache_dir=DEFAULT_CACHE_DIR, stage=None):
+    """
+    Return the text of a PDF and the ``text_fingerprint`` of what was read,
+    extracting it at most once per file content.
+
+    :param pdf_path: Path of the PDF file.
+    :param cache_dir: Directory holding the ``<sha256>.txt`` sidecars.
+    :param stage: Optional stage name for cache hit/miss metrics.
+    :return: (document text, fingerprint).
+    """
+    fingerprint = text_fingerprint(pdf_path)
+    sha = fingerprint["sha256"]
+    key = _memory_key(fingerprint)
+    with _lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            if stage:
+                instrumentation.increment(stage, "pdf_text_cache_hits")
+            return _memory_cache[key], fingerprint
+
+    cached_path = sidecar_path(sha, cache_dir)
+    if "cleaned_txt" in fingerprint:
+        text = _read_text(cleaned_txt_path(pdf_path))
+    elif cached_path.is_file():
+        text = _read_text(cached_path)
+    else:
+        if stage:
+            instrumentation.increment(stage, "pdf_text_cache_misses")
+        text = _read_text(write_sidecar(pdf_path, sha, cache_dir, stage=stage))
+        _remember(key, text)
+        return text, fingerprint
+
+    if stage:
+        instrumentation.increment(stage, "pdf_text_cache_hits")
+    _remember(key, text)
+    return text, fingerprint
+
+
+def cached_pdf_text(pdf_path, cache_dir=DEFAULT_CACHE_DIR, stage=None):
+    """
+    Return the text of a PDF, extracting it at most once per file content.
+    See ``read_pdf_text`` for the parameters.
+    """
+    return read_pdf_text(pdf_path, cache_dir=cache_dir, stage=stage)[0]
@@ -1,37 +1,65 @@
-import os
+from pathlib import Path
+
 import pandas as pd
-import fitz  # PyMuPDF
-import re
 
+from . import instrumentation, profiling
+from .frames import iter_rows, merge_records
+from .mention_matrix import save_mention_matrix
+from .species_index import DEFAULT_INDEX_PATH, load_index, mention_matrix, save_index, update_index
+
+STAGE = "prepare_strategy_files"
 
-def extract_text_from_pdf(pdf_path):
-    """ Extract text from a PDF file """
-    try:
-        document = fitz.open(pdf_path)
-        text = ""
-        for page_num in range(len(document)):
-            page = document.load_page(page_num)
-            text += page.get_text()
-        return text
-    except Exception as e:
-        print(f"Could not extract text from {pdf_path}: {e}")
-        return None
 
+def candidate_files(row):
+    """ Return the PDF files listed in the row's strategy_file column """
+    return [pdf.strip() for pdf in str(row["strategy_file"]).split(",") if pdf.strip()]
 
-def count_occurrences(text, name):
-    """ Count the occurrences of a name in the text """
-    if not text:
-        return 0
-    return len(re.findall(name, text, re.IGNORECASE))
 
+def process_pdfs_in_csv(
+    filename,
+    output_filename="st5_relevant_pdf_reports.csv",
+    matrix_filename="st5_mention_matrix.csv",
+    corpus_folder="strategy_materials",
+    index_path=DEFAULT_INDEX_PATH,
+):
+    """
+    Process each row in the CSV file.
 
-def process_pdfs_in_csv(filename, output_filename="st5_relevant_pdf_reports.csv"):
-    """ Process each row in the CSV file """
+    Mentions of every species in every candidate PDF are read from the
+    persistent species index (see species_index), which scans new or changed
+    documents once for all species. The species x document counts are saved
+    to matrix_filename and the most relevant PDF of each species is picked
+    from them.
+    The matrix covers every PDF in corpus_folder, and for species with several
+    candidate files every corpus PDF is a candidate as well, not only the
+    files listed in the species' own row. corpus_folder=None limits both to
+    the rows' own files.
+    """
     df = pd.read_csv(filename)
 
-    for index, row in df.iterrows():
-        files = str(row["strategy_file"]).split(",")
-        if len(files) > 1:
+    row_files = {}
+    for index, row in iter_rows(df):
+        if len(str(row["strategy_file"]).split(",")) > 1:
+            row_files[index] = candidate_files(row)
+
+    corpus_files = []
+    if corpus_folder:
+        corpus_files = sorted(str(path) for path in Path(corpus_folder).glob("*.pdf"))
+        for index in row_files:
+            row_files[index] = list(dict.fromkeys(row_files[index] + corpus_files))
+
+    documents = list(dict.fromkeys(corpus_files + [pdf for files in row_files.values() for pdf in files]))
+    index = update_index(load_index(index_path), documents, df)
+    save_index(index, index_path)
+    species = [name for name in df["Estonian Name"] if isinstance(name, str) and name]
+    matrix = mention_matrix(index, list(dict.fromkeys(species)), documents)
+    save_mention_matrix(matrix, matrix_filename)
+
+    choices = {}
+    for index, row in iter_rows(df):
+        profiling.next_row()
+        if index in row_files:
+            instrumentation.increment(STAGE, "rows_processed")
             name = row["Estonian Name"]
             if not name:
                 continue
@@ -39,33 +67,38 @@ def process_pdfs_in_csv(filename, output_filename="st5_relevant_pdf_reports.csv"
             max_mentions = 0
             most_mentions_file = None
 
-            for pdf in files:
-                pdf = pdf.strip()
-                if not pdf:
-                    continue
-                text = extract_text_from_pdf(pdf)
-                if text is None:
-                    continue
-                mentions = count_occurrences(text, name)
+            for pdf in row_files[index]:
+                mentions = matrix.at[name, pdf] if name in matrix.index else 0
                 if mentions > max_mentions:
                     max_mentions = mentions
                     most_mentions_file = pdf
 
             if most_mentions_file:
-                df.at[index, "strategy_file"] = most_mentions_file.replace(
-                    "strategy_materials/", ""
-                )
+                choices[index] = {"strategy_file": Path(most_mentions_file).name}
             else:
-                df.at[index, "strategy_file"] = "Not Present"
+                choices[index] = {"strategy_file": "Not Present"}
+        else:
+            instrumentation.increment(STAGE, "rows_skipped")
 
+    df = merge_records(df, choices)
     df.to_csv(output_filename, index=False)
 
 
+@profiling.profile_option(STAGE)
 def main(
     input_filename: str = "st4_pdf_gathered.csv",
     output_filename: str = "st5_relevant_pdf_reports.csv",
+    matrix_filename: str = "st5_mention_matrix.csv",
+    corpus_folder: str = "strategy_materials",
+    index_path: str = DEFAULT_INDEX_PATH,
 ) -> None:
-    process_pdfs_in_csv(input_filename, output_filename)
+    process_pdfs_in_csv(
+        input_filename,
+        output_filename,
+        matrix_filename=matrix_filename,
+        corpus_folder=corpus_folder,
+        index_path=index_path,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,265 @@
+"""
+Built-in profiling of pipeline stages.
+
+A stage is profiled with the pipeline runner's ``--profile`` option or by
+calling its ``main(profile=...)``; ``profile`` is the mode:
+
+``cprofile``
+    Deterministic ``cProfile`` of the stage's thread. Writes the raw
+    ``<name>.prof`` (for pstats/snakeviz) per stage and per species batch.
+``sampling``
+    Wall-clock sampling of all threads every ``PROFILE_SAMPLE_INTERVAL``
+    seconds (default 0.005), so worker pools are included.
+
+Both write ``<name>.top.txt`` (top-N hot functions for the stage and for each
+batch) and ``<name>.collapsed`` (collapsed stacks for flamegraph.pl or
+speedscope, rooted at ``<stage>;<batch>``) into the profile directory: the
+``directory`` given, else ``BIODIVERSITY_PROFILE_DIR``, else ``profiles``.
+
+Row loops call ``next_row()``; every ``PROFILE_BATCH_SIZE`` rows (default 10)
+start a new species batch, so the time is attributable per batch. Outside a
+profiled stage ``next_row()`` does nothing.
+"""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+PROFILE_MODES = ("cprofile", "sampling")
+DEFAULT_TOP_N = 30
+PROFILE_BATCH_SIZE = int(os.getenv("PROFILE_BATCH_SIZE", "10"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+# cProfile call graph paths below this many seconds are left out of the collapsed stacks
+MIN_COLLAPSED_SECONDS = 1e-4
+MAX_STACK_DEPTH = 64
+SETUP_BATCH = "setup"
+# Other threads sampled inside these modules are idle pool workers
+IDLE_THREAD_MODULES = ("threading.py", "queue.py", "thread.py")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def profile_dir(directory=None):
+    return Path(directory or os.getenv("BIODIVERSITY_PROFILE_DIR", "profiles"))
+
+
+def _frame_name(filename, line, function):
+    return f"{function} ({os.path.basename(filename)}:{line})"
+
+
+class _Session:
+    def __init__(self, name, mode, batch_size):
+        self.name = name
+        self.mode = mode
+        self.batch_size = batch_size
+        self.batch = SETUP_BATCH
+        # Batch of the enabled cProfile profiler; lags self.batch while rows come from other threads
+        self.enabled_batch = SETUP_BATCH
+        self.rows = 0
+        self.thread_id = threading.get_ident()
+        self.profilers = {}
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        if self.mode == "cprofile":
+            self._profiler(self.batch).enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, name="profiling-sampler", daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        if self.mode == "cprofile":
+            self.profilers[self.enabled_batch].disable()
+        else:
+            self._stop.set()
+            self._sampler.join()
+
+    def _profiler(self, batch):
+        if batch not in self.profilers:
+            self.profilers[batch] = cProfile.Profile()
+        return self.profilers[batch]
+
+    def next_row(self):
+        if self.rows % self.batch_size == 0:
+            self.batch = f"rows_{self.rows:05d}-{self.rows + self.batch_size - 1:05d}"
+        self.rows += 1
+        # A cProfile profiler only covers the thread that enabled it
+        if self.mode == "cprofile" and threading.get_ident() == self.thread_id and self.batch != self.enabled_batch:
+            self.profilers[self.enabled_batch].disable()
+            self._profiler(self.batch).enable()
+            self.enabled_batch = self.batch
+
+    def _sample(self):
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL):
+            batch = self.batch
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                if thread_id != self.thread_id and os.path.basename(frame.f_code.co_filename) in IDLE_THREAD_MODULES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(_frame_name(code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                self.samples[(batch, tuple(reversed(stack)))] += 1
+
+
+### Reports ###
+
+def _collapsed_from_stats(stats, prefix):
+    """
+    Approximate collapsed stacks (in microseconds) from a cProfile call graph:
+    a callee's time is split over its callers in proportion to the time each
+    caller spent in it.
+    """
+    callees = defaultdict(list)
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller in callers:
+            callees[caller].append(function)
+
+    lines = Counter()
+
+    def walk(function, path, fraction):
+        own_time = stats[function][2]
+        path = path + (_frame_name(*function),)
+        if own_time * fraction >= 1e-6:
+            lines[";".join(path)] += int(own_time * fraction * 1e6)
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for callee in callees[function]:
+            callee_total = stats[callee][3]
+            edge_time = stats[callee][4][function][3]
+            if callee_total <= 0 or edge_time * fraction < MIN_COLLAPSED_SECONDS:
+                continue
+            if _frame_name(*callee) in path:
+                continue
+            walk(callee, path, fraction * edge_time / callee_total)
+
+    for function, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            walk(function, prefix, 1.0)
+    return lines
+
+
+def _sample_summary(samples, top_n):
+    own = Counter()
+    total = Counter()
+    for stack, count in samples.items():
+        if stack:
+            own[stack[-1]] += count
+        for frame in set(stack):
+            total[frame] += count
+    all_samples = sum(samples.values()) or 1
+    lines = [f"{'own %':>7} {'total %':>8}  function"]
+    for frame, count in total.most_common(top_n):
+        lines.append(f"{100 * own[frame] / all_samples:7.1f} {100 * count / all_samples:8.1f}  {frame}")
+    return "\n".join(lines) + "\n"
+
+
+def _pstats_summary(stats, top_n):
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats("cumulative").print_stats(top_n)
+    return stream.getvalue()
+
+
+def write_reports(session, directory, top_n=DEFAULT_TOP_N):
+    """Write the raw profile, top-N summary and collapsed stacks of a finished session."""
+    directory.mkdir(parents=True, exist_ok=True)
+    base = directory / session.name
+    summaries = []
+    collapsed = Counter()
+
+    if session.mode == "cprofile":
+        profilers = list(session.profilers.items())
+        stage_stats = pstats.Stats(*(profiler for _, profiler in profilers))
+        stage_stats.dump_stats(f"{base}.prof")
+        summaries.append((session.name, _pstats_summary(stage_stats, top_n)))
+        for batch, profiler in profilers:
+            batch_stats = pstats.Stats(profiler)
+            if not batch_stats.stats:
+                continue
+            if len(profilers) > 1:
+                batch_stats.dump_stats(f"{base}.{batch}.prof")
+                summaries.append((f"{session.name} {batch}", _pstats_summary(batch_stats, top_n)))
+            collapsed.update(_collapsed_from_stats(batch_stats.stats, (session.name, batch)))
+    else:
+        by_batch = defaultdict(Counter)
+        stage_samples = Counter()
+        for (batch, stack), count in session.samples.items():
+            by_batch[batch][stack] += count
+            stage_samples[stack] += count
+            collapsed[";".join((session.name, batch) + stack)] += count
+        summaries.append((session.name, _sample_summary(stage_samples, top_n)))
+        if len(by_batch) > 1:
+            for batch, samples in by_batch.items():
+                summaries.append((f"{session.name} {batch}", _sample_summary(samples, top_n)))
+
+    with open(f"{base}.top.txt", "w", encoding="utf-8") as f:
+        for title, summary in summaries:
+            f.write(f"### {title} ({session.mode}, top {top_n})\n{summary}\n")
+    with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+        for stack, count in collapsed.items():
+            if count > 0:
+                f.write(f"{stack} {count}\n")
+    print(f"Profile of {session.name} written to {directory}")
+
+
+### Public API ###
+
+@contextmanager
+def profiled(name, directory=None, mode="cprofile", top_n=DEFAULT_TOP_N, batch_size=PROFILE_BATCH_SIZE):
+    """
+    Profile the block as ``name``. A falsy ``mode`` disables profiling, and a
+    block inside an already profiled one is attributed to the outer profile.
+    """
+    global _session
+    mode = "cprofile" if mode is True else mode
+    if mode and mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}', expected one of {PROFILE_MODES}")
+    with _session_lock:
+        nested = _session is not None
+        if mode and not nested:
+            session = _session = _Session(name, mode, batch_size)
+    if not mode or nested:
+        yield
+        return
+
+    session.start()
+    try:
+        yield
+    finally:
+        session.stop()
+        with _session_lock:
+            _session = None
+        write_reports(session, profile_dir(directory), top_n=top_n)
+
+
+def next_row():
+    """Mark the start of a species row of the profiled stage (a no-op otherwise)."""
+    session = _session
+    if session is not None:
+        session.next_row()
+
+
+def profile_option(stage):
+    """Give a stage ``main()`` a ``profile`` argument that runs it under ``profiled(stage)``."""
+    def decorator(main):
+        @functools.wraps(main)
+        def wrapper(*args, profile=None, **kwargs):
+            with profiled(stage, mode=profile):
+                return main(*args, **kwargs)
+        return wrapper
+    return decorator
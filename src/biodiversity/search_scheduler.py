@@ -0,0 +1,206 @@
+"""
+Paced, cached web search for the strategy document lookup.
+
+A ``SearchScheduler`` answers queries from a persistent query -> results
+cache and only sends cache misses to its backend. Requests to the backend are
+spaced by an ``AdaptivePacer``: the delay between queries halves towards the
+minimum while queries succeed and doubles (or follows Retry-After) on every
+429, so a run goes as fast as the search engine currently allows. Other
+errors are retried after the current delay without changing it.
+
+Backends implement ``search(query, num_results)`` and raise ``RateLimited``
+when throttled. ``google`` uses googlesearch-python; ``local`` answers from a
+JSON file of {query: [urls]} and never touches the network, so it is not paced
+(``paced = False``).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+DEFAULT_CACHE_PATH = "search_cache.json"
+
+
+class RateLimited(Exception):
+    """The backend refused a query because of rate limiting."""
+
+    def __init__(self, retry_after=None):
+        super().__init__("Search rate limited")
+        self.retry_after = retry_after
+
+
+### Backends ###
+
+class SearchBackend:
+    name = "base"
+    # Whether queries are spaced by the scheduler's pacer
+    paced = True
+
+    def search(self, query, num_results=10):
+        """Return a list of result URLs for ``query``."""
+        raise NotImplementedError
+
+
+class GoogleSearchBackend(SearchBackend):
+    name = "google"
+
+    def search(self, query, num_results=10):
+        from googlesearch import search  # Ensure you have 'googlesearch-python' installed
+
+        try:
+            return list(search(query, num_results=num_results))
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 429:
+                retry_after = e.response.headers.get("Retry-After")
+                raise RateLimited(float(retry_after) if retry_after and retry_after.isdigit() else None) from e
+            raise
+
+
+class LocalSearchBackend(SearchBackend):
+    """Answers from a JSON file of {query: [urls]}; unknown queries have no results."""
+
+    name = "local"
+    paced = False
+
+    def __init__(self, results_path="search_results.json"):
+        self.results = {}
+        if os.path.isfile(results_path):
+            with open(results_path, "r", encoding="utf-8") as f:
+                self.results = json.load(f)
+
+    def search(self, query, num_results=10):
+        return list(self.results.get(query, []))[:num_results]
+
+
+SEARCH_BACKENDS = {
+    "google": GoogleSearchBackend,
+    "local": LocalSearchBackend,
+}
+
+
+def search_backend(name=None, **kwargs):
+    """Create the backend ``name`` (default: ``SEARCH_BACKEND`` env variable or google)."""
+    name = name or os.getenv("SEARCH_BACKEND", "google")
+    if name not in SEARCH_BACKENDS:
+        raise ValueError(f"Unknown search backend '{name}', expected one of {sorted(SEARCH_BACKENDS)}")
+    return SEARCH_BACKENDS[name](**kwargs)
+
+
+### Cache ###
+
+class SearchCache:
+    """Persistent query -> results cache, saved after every new entry."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = Path(path)
+        self.entries = {}
+        self._lock = threading.Lock()
+        if self.path.is_file():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def key(self, backend, query, num_results):
+        return f"{backend}|{num_results}|{query}"
+
+    def get(self, backend, query, num_results):
+        entry = self.entries.get(self.key(backend, query, num_results))
+        return None if entry is None else entry["results"]
+
+    def put(self, backend, query, num_results, results):
+        with self._lock:
+            self.entries[self.key(backend, query, num_results)] = {
+                "results": results,
+                "fetched_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+### Pacing ###
+
+class AdaptivePacer:
+    """
+    Delay between backend queries: multiplicative decrease while queries
+    succeed, doubling (or the server's Retry-After) on rate limits.
+    """
+
+    def __init__(self, initial_delay=10.0, min_delay=2.0, max_delay=300.0, speedup=0.5):
+        self.delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.speedup = speedup
+        self._next_request = 0.0
+
+    def wait(self):
+        pause = self._next_request - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def on_success(self):
+        self.delay = max(self.min_delay, self.delay * self.speedup)
+        self._next_request = time.monotonic() + self.delay
+
+    def on_error(self):
+        """Wait the current delay before the next query, without changing it."""
+        self._next_request = time.monotonic() + self.delay
+
+    def on_rate_limited(self, retry_after=None):
+        self.delay = min(self.max_delay, max(self.delay * 2, retry_after or 0))
+        self._next_request = time.monotonic() + self.delay
+
+
+### Scheduler ###
+
+class SearchScheduler:
+    def __init__(self, backend=None, cache=None, pacer=None, max_retries=5, on_event=None):
+        """
+        :param on_event: Optional callback(name) for "query", "cache_hit" and "rate_limited" events.
+        """
+        self.backend = backend or search_backend()
+        self.cache = cache if cache is not None else SearchCache()
+        self.pacer = pacer or AdaptivePacer()
+        self.max_retries = max_retries
+        self.on_event = on_event or (lambda name: None)
+
+    def search(self, query, num_results=10):
+        """Return the result URLs for ``query``, from the cache if it was searched before."""
+        cached = self.cache.get(self.backend.name, query, num_results)
+        if cached is not None:
+            self.on_event("cache_hit")
+            return cached
+
+        paced = self.backend.paced
+        for attempt in range(1, self.max_retries + 1):
+            if paced:
+                self.pacer.wait()
+            self.on_event("query")
+            try:
+                results = self.backend.search(query, num_results=num_results)
+            except RateLimited as e:
+                self.pacer.on_rate_limited(e.retry_after)
+                self.on_event("rate_limited")
+                logging.warning(f"Too many requests. Next query in {self.pacer.delay:.0f} seconds...")
+                continue
+            except Exception as e:
+                if paced:
+                    self.pacer.on_error()
+                    logging.error(f"Error encountered: {e}. Retrying in {self.pacer.delay:.0f} seconds...")
+                else:
+                    logging.error(f"Error encountered: {e}. Retrying...")
+                continue
+
+            if paced:
+                self.pacer.on_success()
+            self.cache.put(self.backend.name, query, num_results, results)
+            return results
+
+        logging.error(f"Giving up on '{query}' after {self.max_retries} attempts")
+        return []
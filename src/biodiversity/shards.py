@@ -0,0 +1,167 @@
+"""
+Run the pipeline for several taxon groups as parallel shards.
+
+EELIS is resolved once for the species of all groups, in its own worker
+process and directory (``<run dir>/eelis``): the species list from stage 1
+has no taxon group, which only the EELIS pages tell. Its st3 is then split by
+``Rühm`` among the shards, together with the strategy documents EELIS linked.
+
+Every shard runs the remaining per-species stages in its own worker process
+and its own directory (``<run dir>/shards/<taxon>``), so the stages' relative
+artifact paths - CSVs, strategy_materials, caches, deferred rows - form a
+separate namespace per taxon group. The final outputs of all shards are
+merged into combined files with a ``Taxon`` column.
+"""
+
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from . import budget, instrumentation, profiling
+from .get_extinct_species import diff_versions_path, species_diff_path
+from .taxa import ALL_TAXA, TAXON_GROUPS
+
+SHARD_SPECIES_LIST = "st1_kaitsekategooria_selgroogsed_loomad.csv"
+SHARD_SPECIES_DATA = "st3_EELIS_additional_data.csv"
+STRATEGY_FOLDER = "strategy_materials"
+MERGED_OUTPUTS = ("st8_birds_data_extracted.csv", "updated_birds_descriptions.csv")
+
+
+def shard_dir(run_dir, taxon):
+    return Path(run_dir).resolve() / "shards" / taxon
+
+
+def eelis_dir(run_dir):
+    return Path(run_dir).resolve() / "eelis"
+
+
+def species_list_inputs(species_list):
+    """The st1 species list and its species diff, if any, as run_shard inputs."""
+    species_list = Path(species_list).resolve()
+    inputs = {SHARD_SPECIES_LIST: species_list}
+    diff = species_diff_path(species_list)
+    for path in (diff, diff_versions_path(diff)):
+        if path.is_file():
+            inputs[path.name] = path
+    return inputs
+
+
+def run_shard(taxon, directory, stages, inputs=None, profile=None):
+    """
+    Run ``stages`` for one taxon group (or ``ALL_TAXA``) inside ``directory``;
+    meant to run in a worker process.
+
+    :param stages: List of (stage name, callable) pairs; the callables must be picklable.
+    :param inputs: Optional {path in the directory: source path} of files copied in first.
+    :param profile: Optional profile mode (see profiling); profiles go to ``<directory>/profiles``.
+    :return: The shard directory.
+    """
+    os.environ["BIODIVERSITY_TAXON"] = taxon
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, source in (inputs or {}).items():
+        (directory / name).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(source, directory / name)
+    os.chdir(directory)
+
+    instrumentation.reset()
+    budget.reset()
+    try:
+        for stage_name, stage in stages:
+            with instrumentation.stage_timer(stage_name), \
+                    profiling.profiled(stage_name, directory / "profiles", mode=profile):
+                stage()
+    finally:
+        instrumentation.write_run_report(
+            directory / "run_report.json",
+            extra={"taxon": taxon, "llm_tokens_spent": budget.spent()},
+        )
+        instrumentation.write_openmetrics(directory / "metrics.txt")
+    return str(directory)
+
+
+def split_species_data(run_dir, taxa):
+    """
+    Split the st3 of the EELIS pass by ``Rühm`` into the shards' st3 files.
+
+    :return: {taxon: run_shard inputs} with the strategy documents of the taxon's species.
+    """
+    source_dir = eelis_dir(run_dir)
+    species_data = pd.read_csv(source_dir / SHARD_SPECIES_DATA)
+    shard_inputs = {}
+    for taxon in taxa:
+        rows = species_data[species_data["Rühm"] == TAXON_GROUPS[taxon]["ruhm"]]
+        directory = shard_dir(run_dir, taxon)
+        directory.mkdir(parents=True, exist_ok=True)
+        rows.to_csv(directory / SHARD_SPECIES_DATA, index=False)
+        print(f"Shard {taxon}: {len(rows)} species")
+
+        inputs = {}
+        for files in rows["strategy_file"].dropna():
+            for name in str(files).split(";"):
+                path = source_dir / STRATEGY_FOLDER / name.strip()
+                if name.strip() and path.is_file():
+                    inputs[f"{STRATEGY_FOLDER}/{path.name}"] = path
+        shard_inputs[taxon] = inputs
+    return shard_inputs
+
+
+def merge_shards(run_dir, taxa, outputs=MERGED_OUTPUTS):
+    """Concatenate each output file of the given shards into ``<run dir>/combined_<file>``."""
+    merged_paths = []
+    for output in outputs:
+        frames = []
+        for taxon in taxa:
+            path = shard_dir(run_dir, taxon) / output
+            if path.is_file():
+                frame = pd.read_csv(path)
+                frame.insert(0, "Taxon", taxon)
+                frames.append(frame)
+        if frames:
+            merged_path = Path(run_dir) / f"combined_{output}"
+            pd.concat(frames, ignore_index=True).to_csv(merged_path, index=False)
+            merged_paths.append(str(merged_path))
+            print(f"Merged {len(frames)} shards into {merged_path}")
+    return merged_paths
+
+
+def run_shards(taxa, run_dir, eelis_stages, stages, species_list, max_workers=None, profile=None):
+    """
+    Resolve EELIS for all species with ``eelis_stages`` (which write st3), then
+    run ``stages`` in one shard per taxon group in parallel processes and merge
+    their outputs.
+
+    :return: {taxon: "ok" or the error of a failed shard}.
+    """
+    unknown = [taxon for taxon in taxa if taxon not in TAXON_GROUPS]
+    if unknown:
+        raise ValueError(f"Unknown taxon groups {unknown}, expected some of {sorted(TAXON_GROUPS)}")
+
+    # A worker process of its own, as run_shard changes the working directory
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        executor.submit(
+            run_shard, ALL_TAXA, eelis_dir(run_dir), eelis_stages, species_list_inputs(species_list), profile
+        ).result()
+    shard_inputs = split_species_data(run_dir, taxa)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers or len(taxa)) as executor:
+        futures = {
+            taxon: executor.submit(
+                run_shard, taxon, shard_dir(run_dir, taxon), stages, shard_inputs[taxon], profile
+            )
+            for taxon in taxa
+        }
+        for taxon, future in futures.items():
+            try:
+                future.result()
+                results[taxon] = "ok"
+            except Exception as e:
+                print(f"Shard {taxon} failed: {e}")
+                results[taxon] = repr(e)
+
+    merge_shards(run_dir, [taxon for taxon, result in results.items() if result == "ok"])
+    return results
@@ -0,0 +1,208 @@
+"""
+Persistent inverted index of species mentions in the strategy corpus.
+
+The index maps every search term of every species to the documents it occurs
+in and the (line, character) positions of each occurrence. It is stored as
+JSON and updated incrementally: every document records the terms it was
+scanned for and the fingerprint of the text they were found in, so documents
+that are new or changed since the last update are scanned with all terms and
+unchanged documents only for the terms they have not been scanned for yet.
+Documents whose PDF no longer exists are dropped.
+
+Terms per species (all lower-cased):
+
+* ``name``  - the Estonian name, used for document choice
+* ``latin`` - the Latin name, used for document choice
+* ``stem``  - the Estonian name without its last two letters, which is what
+  ``extract_relevant_sections`` anchors its text windows on
+"""
+
+import bisect
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from .mention_matrix import build_automaton, iter_matches
+from .pdf_text import read_pdf_text, text_fingerprint
+
+DEFAULT_INDEX_PATH = "species_index.json"
+INDEX_VERSION = 2
+DOCUMENT_CHOICE_TERMS = ("name", "latin")
+
+
+def species_terms(estonian_name, latin_name=None):
+    """Return the search terms of one species as {kind: term}."""
+    terms = {}
+    if isinstance(estonian_name, str) and estonian_name.strip():
+        terms["name"] = estonian_name.strip().lower()
+        if len(estonian_name.strip()) > 2:
+            terms["stem"] = estonian_name.strip()[:-2].lower()
+    if isinstance(latin_name, str) and latin_name.strip():
+        terms["latin"] = latin_name.strip().lower()
+    return terms
+
+
+def empty_index():
+    return {"version": INDEX_VERSION, "species": {}, "documents": {}, "postings": {}}
+
+
+def load_index(path=DEFAULT_INDEX_PATH):
+    """Load the index from disk, or return an empty one."""
+    if not os.path.isfile(path):
+        return empty_index()
+    with open(path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    if index.get("version") != INDEX_VERSION:
+        return empty_index()
+    return index
+
+
+def save_index(index, path=DEFAULT_INDEX_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def document_key(pdf_path):
+    """Documents are identified by their PDF file name, as in the strategy_file column."""
+    return Path(pdf_path).name
+
+
+def document_fingerprint(pdf_path):
+    """Fingerprint of the text a document is indexed from (PDF hash + _cleaned.txt version)."""
+    return text_fingerprint(pdf_path)
+
+
+def scan_text(text, terms):
+    """
+    Find all occurrences of ``terms`` in ``text``.
+
+    :return: {term: [[line, char], ...]} with 0-based line numbers and character offsets.
+    """
+    if not text or not terms:
+        return {}
+    line_starts = [0]
+    for position, char in enumerate(text):
+        if char == "\n":
+            line_starts.append(position + 1)
+
+    automaton = build_automaton(terms)
+    postings = {}
+    for end, term_id in iter_matches(automaton, text.lower()):
+        term = terms[term_id]
+        start = end - len(term) + 1
+        line = bisect.bisect_right(line_starts, start) - 1
+        postings.setdefault(term, []).append([line, start])
+    return postings
+
+
+def _add_postings(index, doc, postings):
+    for term, positions in postings.items():
+        index["postings"].setdefault(term, {})[doc] = positions
+
+
+def _remove_document(index, doc):
+    for documents in index["postings"].values():
+        documents.pop(doc, None)
+    index["documents"].pop(doc, None)
+
+
+def update_index(index, pdf_paths, species_df=None):
+    """
+    Bring the index up to date with the given documents and species.
+
+    :param index: Index as returned by ``load_index``.
+    :param pdf_paths: Paths of the PDFs to (re)index if new or changed.
+    :param species_df: Optional DataFrame with "Estonian Name"/"Latin Name" to register species.
+    :return: The updated index (modified in place).
+    """
+    if species_df is not None:
+        for _, row in species_df.iterrows():
+            terms = species_terms(row.get("Estonian Name"), row.get("Latin Name"))
+            if terms:
+                index["species"][row["Estonian Name"]] = terms
+
+    all_terms = sorted({term for terms in index["species"].values() for term in terms.values()})
+
+    wanted = {document_key(path): path for path in pdf_paths}
+    for doc, info in list(index["documents"].items()):
+        if not os.path.isfile(info["path"]):
+            _remove_document(index, doc)
+
+    for doc, pdf_path in wanted.items():
+        if not os.path.isfile(pdf_path):
+            continue
+        fingerprint = document_fingerprint(pdf_path)
+        info = index["documents"].get(doc, {})
+        if info.get("fingerprint") == fingerprint:
+            scanned = set(info.get("terms", []))
+        else:
+            _remove_document(index, doc)
+            scanned = set()
+        terms_to_scan = [term for term in all_terms if term not in scanned]
+        if terms_to_scan:
+            try:
+                text, read_fingerprint = read_pdf_text(pdf_path)
+            except Exception as e:
+                print(f"Could not index {pdf_path}: {e}")
+                continue
+            if read_fingerprint != fingerprint:
+                # The text changed between the fingerprint and the read: index what was read
+                _remove_document(index, doc)
+                fingerprint, scanned, terms_to_scan = read_fingerprint, set(), all_terms
+            _add_postings(index, doc, scan_text(text, terms_to_scan))
+            scanned.update(terms_to_scan)
+        index["documents"][doc] = {"path": str(pdf_path), "fingerprint": fingerprint, "terms": sorted(scanned)}
+
+    return index
+
+
+def update_folder_index(folder="strategy_materials", species_df=None, path=DEFAULT_INDEX_PATH):
+    """Load, update with every PDF in ``folder`` and save the index."""
+    index = load_index(path)
+    update_index(index, sorted(str(p) for p in Path(folder).glob("*.pdf")), species_df)
+    save_index(index, path)
+    return index
+
+
+### Queries ###
+
+def term_positions(index, species, kind, doc):
+    """Return the [line, char] positions of one term of a species in a document."""
+    term = index["species"].get(species, {}).get(kind)
+    if term is None:
+        return []
+    return index["postings"].get(term, {}).get(document_key(doc), [])
+
+
+def anchor_lines(index, species, doc, kind="stem"):
+    """
+    Return the sorted line numbers where a species term occurs in a document,
+    or None when the index cannot tell: the document or term was not indexed,
+    or nothing at all was found in the document (e.g. an image-only PDF whose
+    text has not been OCR'd yet), so the caller should scan the text itself.
+    """
+    key = document_key(doc)
+    term = index["species"].get(species, {}).get(kind)
+    info = index["documents"].get(key)
+    if term is None or info is None or term not in info.get("terms", []):
+        return None
+    if not any(key in documents for documents in index["postings"].values()):
+        return None
+    return sorted({line for line, _ in index["postings"].get(term, {}).get(key, [])})
+
+
+def mention_matrix(index, species, documents, kinds=DOCUMENT_CHOICE_TERMS):
+    """Species x document mention counts read from the index."""
+    columns = {}
+    for doc in documents:
+        columns[doc] = {
+            key: sum(len(term_positions(index, key, kind, doc)) for kind in kinds)
+            for key in species
+        }
+    matrix = pd.DataFrame(columns, index=list(species), dtype="int64")
+    matrix.index.name = "Estonian Name"
+    return matrix
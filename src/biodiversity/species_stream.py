@@ -0,0 +1,432 @@
+"""
+Pipelined execution: species flow through the stages one by one.
+
+In the staged pipeline every stage finishes the whole table before the next
+one starts, so the browser, the OCR engine and the LLM quota take turns being
+idle. Here each species is a work item that passes through
+
+    scrape -> download -> choose -> convert -> sections -> summarise
+
+with a bounded queue in front of every step and one or more worker threads
+per step. Network, CPU and LLM work of different species overlap, so the
+end-to-end time approaches that of the slowest step instead of the sum of
+all of them; the queue bounds keep memory flat and push back on fast steps.
+
+The steps reuse the per-row functions of the stage modules. Finished species
+are appended to a journal (``<output>.stream.jsonl``, keyed by species ID as
+in the streaming summarisation), together with species the scrape step
+dropped for good (no EELIS page, another taxon group). A restarted run skips
+everything in the journal whose st1 row is unchanged. Species that failed
+with an error or ran out of token budget are not journalled and are retried,
+and so are species a later step dropped (e.g. no strategy document found),
+since a search or download outage looks the same. st8 and the preview are written from the
+journal at the end.
+"""
+
+import logging
+import os
+import queue
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from . import budget, instrumentation, profiling
+from .EELIS_data import add_strategy_columns, scrape_species_page
+from .browser import init_webdriver
+from .extract_analysis_data import convert_pdf_to_txt
+from .extract_and_process_reports import is_scanned_pdf, ocr_and_clean
+from .extract_birds_info_from_text import (
+    PREVIEW_COLUMNS,
+    TEXT_COLUMNS,
+    append_journal,
+    input_sha,
+    is_current,
+    load_journal,
+    open_journal,
+    species_id,
+    summarise_row,
+)
+from .extract_relevant_sections import process_row as locate_sections
+from .extract_sections_texts import process_row as extract_section_texts
+from .get_species_google_strategies import download_pdfs, make_scheduler, search_pdfs
+from .llm_schemas import SECTION_TOPICS, SUMMARY_KEYS
+from .ocr import OCRPageCache, ocr_engine
+from .parse_EELIS_links import search_and_get_link
+from .pdf_text import cached_pdf_text, cleaned_txt_is_current
+from .prepare_strategy_files import candidate_files
+from .species_index import DOCUMENT_CHOICE_TERMS, scan_text, species_terms
+from .taxa import ST3_COLUMNS, taxon_group
+
+STAGE = "species_stream"
+
+# Items waiting in front of each step
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "4"))
+
+_DONE = object()
+
+
+class StreamStep:
+    """
+    One step of a stream: ``process(item, state)`` returns the item for the
+    next step, or None to drop it. ``setup()`` creates per-worker state (e.g.
+    a browser) that ``teardown(state)`` releases when the worker stops.
+    ``final_drops`` marks steps whose drops a later run would repeat.
+    """
+
+    def __init__(self, name, process, workers=1, setup=None, teardown=None, final_drops=False):
+        self.name = name
+        self.process = process
+        self.workers = workers
+        self.setup = setup
+        self.teardown = teardown
+        self.final_drops = final_drops
+
+
+def run_stream(items, steps, on_result, on_drop=None, queue_size=STREAM_QUEUE_SIZE):
+    """
+    Push ``items`` through ``steps`` connected by bounded queues.
+
+    :param on_result: Called with every item that passed all steps.
+    :param on_drop: Optional callback(item, step name) for items a step with
+                    ``final_drops`` dropped.
+    :return: Number of items that failed with an error.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(steps) + 1)]
+    failures = []
+    threads = []
+
+    def worker(step, inbox, outbox, finished):
+        state, broken = None, False
+        try:
+            state = step.setup() if step.setup else None
+        except Exception as e:
+            # Keep draining the queue so the steps before this one are not blocked
+            logging.error(f"Step {step.name} could not start: {e}")
+            broken = True
+        try:
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    inbox.put(_DONE)  # let the step's other workers stop too
+                    break
+                if broken:
+                    failures.append(item.get("Estonian Name"))
+                    continue
+                try:
+                    with instrumentation.timed(STAGE, f"{step.name}_seconds"):
+                        result = step.process(item, state)
+                except budget.BudgetExhausted as e:
+                    print(f"{e}. {item.get('Estonian Name')} is left for the next run.")
+                    failures.append(item.get("Estonian Name"))
+                    continue
+                except Exception as e:
+                    logging.error(f"Step {step.name} failed for {item.get('Estonian Name')}: {e}")
+                    instrumentation.increment(STAGE, "stream_items_failed")
+                    failures.append(item.get("Estonian Name"))
+                    continue
+                if result is None:
+                    instrumentation.increment(STAGE, "stream_items_dropped")
+                    if on_drop and step.final_drops:
+                        on_drop(item, step.name)
+                else:
+                    outbox.put(result)
+        finally:
+            if step.teardown and state is not None:
+                step.teardown(state)
+            # The last worker of a step to stop closes the next queue
+            with finished["lock"]:
+                finished["count"] += 1
+                if finished["count"] == step.workers:
+                    outbox.put(_DONE)
+
+    for position, step in enumerate(steps):
+        finished = {"count": 0, "lock": threading.Lock()}
+        for number in range(step.workers):
+            thread = threading.Thread(
+                target=worker,
+                args=(step, queues[position], queues[position + 1], finished),
+                name=f"stream-{step.name}-{number}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+
+    def sink():
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            try:
+                on_result(item)
+            except Exception as e:
+                logging.error(f"Could not store the result for {item.get('Estonian Name')}: {e}")
+                failures.append(item.get("Estonian Name"))
+
+    sink_thread = threading.Thread(target=sink, name="stream-sink", daemon=True)
+    sink_thread.start()
+
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(_DONE)
+
+    for thread in threads:
+        thread.join()
+    sink_thread.join()
+    return len(failures)
+
+
+### Species steps ###
+
+def _browser():
+    return init_webdriver(headless=True)
+
+
+def _close_browser(state):
+    driver, _ = state
+    driver.quit()
+
+
+def scrape_step(url, strategy_folder):
+    def scrape(item, state):
+        driver, wait = state
+        link = search_and_get_link(driver, wait, url, item["Estonian Name"], item["Latin Name"], stage=STAGE)
+        if link == "NotFound":
+            return None
+        item["EELIS link"] = link
+        item.update(scrape_species_page(driver, wait, link, strategy_folder=strategy_folder, stage=STAGE))
+        if item.get("Rühm") != taxon_group()["ruhm"]:
+            return None
+        return item
+    return scrape
+
+
+def download_step(strategy_folder, scheduler):
+    def download(item, state):
+        if not item["strategy_present"]:
+            query = f'"kaitse tegevuskava" "{item["Estonian Name"]}" pdf'
+            downloaded_files = download_pdfs(search_pdfs(scheduler, query), strategy_folder)
+            if downloaded_files:
+                item["strategy_present"] = True
+                item["strategy_file"] = ",".join(downloaded_files)
+        return item if item["strategy_present"] else None
+    return download
+
+
+def choose_step(strategy_folder):
+    def choose(item, state):
+        return choose_strategy_file(item, strategy_folder)
+    return choose
+
+
+def choose_strategy_file(item, strategy_folder="strategy_materials"):
+    """Pick the candidate PDF that mentions the species most, as prepare_strategy_files does."""
+    files = [
+        pdf if os.path.isfile(pdf) else os.path.join(strategy_folder, Path(pdf).name)
+        for pdf in candidate_files(item)
+    ]
+    if len(files) > 1:
+        terms = species_terms(item["Estonian Name"], item["Latin Name"])
+        choice_terms = [terms[kind] for kind in DOCUMENT_CHOICE_TERMS if kind in terms]
+        mentions = {}
+        for pdf in files:
+            try:
+                postings = scan_text(cached_pdf_text(pdf), choice_terms)
+            except Exception as e:
+                print(f"Could not read {pdf}: {e}")
+                continue
+            mentions[pdf] = sum(len(positions) for positions in postings.values())
+        best = max(mentions, key=mentions.get, default=None)
+        if best is None or mentions[best] == 0:
+            return None
+        files = [best]
+    item["strategy_file"] = Path(files[0]).name
+    return item
+
+
+def convert_step(strategy_folder):
+    """Convert (or OCR and clean) each strategy PDF once, however many species share it."""
+    document_locks = {}
+    locks_lock = threading.Lock()
+    engine = ocr_engine()
+    cache = OCRPageCache()
+
+    def convert(item, state):
+        pdf_path = Path(strategy_folder) / item["strategy_file"]
+        with locks_lock:
+            lock = document_locks.setdefault(str(pdf_path), threading.Lock())
+        with lock:
+            if not pdf_path.is_file():
+                return None
+            if cleaned_txt_is_current(pdf_path):
+                return item
+            if is_scanned_pdf(pdf_path):
+                ocr_and_clean(str(pdf_path), engine=engine, cache=cache)
+                return item
+            return item if convert_pdf_to_txt(pdf_path) else None
+    return convert
+
+
+def sections_step(strategy_folder):
+    def sections(item, state):
+        item = locate_sections(item, strategy_folder=strategy_folder)
+        if item is None:
+            return None
+        if item["Analyze_by_sisukord"]:
+            text_path = os.path.join(strategy_folder, item["strategy_file"].replace(".pdf", "_cleaned.txt"))
+            texts = extract_section_texts(item, text_path)
+            if texts:
+                item.update(texts)
+        return item
+    return sections
+
+
+def summarise(item, state):
+    for column in TEXT_COLUMNS:
+        if not isinstance(item.get(column), str):
+            item[column] = ""
+    record = summarise_row(item)
+    if record:
+        item.update(record)
+    return item
+
+
+def species_steps(url, strategy_folder, scrape_workers=1, convert_workers=2, llm_workers=4, search_backend=None):
+    return [
+        StreamStep(
+            "scrape",
+            scrape_step(url, strategy_folder),
+            scrape_workers,
+            setup=_browser,
+            teardown=_close_browser,
+            final_drops=True,
+        ),
+        StreamStep("download", download_step(strategy_folder, make_scheduler(search_backend))),
+        StreamStep("choose", choose_step(strategy_folder)),
+        StreamStep("convert", convert_step(strategy_folder), convert_workers),
+        StreamStep("sections", sections_step(strategy_folder), llm_workers),
+        StreamStep("summarise", summarise, llm_workers),
+    ]
+
+
+### Output ###
+
+def output_columns():
+    columns = list(ST3_COLUMNS) + ["Analyze_by_sisukord"] + list(SECTION_TOPICS)
+    return columns + TEXT_COLUMNS + list(SUMMARY_KEYS)
+
+
+def write_outputs(journal_file, output_csv_path, preview_csv_path, input_shas, chunk_size=50):
+    """
+    Write st8 and the preview from the journalled species, ``chunk_size`` rows
+    at a time. Only entries made from the current st1 row of a species
+    (``input_shas``: {species ID: row hash}) are written.
+    """
+    for path in (output_csv_path, preview_csv_path):
+        if os.path.exists(path):
+            os.remove(path)
+    columns = output_columns()
+    rows = []
+
+    def flush():
+        frame = pd.DataFrame(rows).reindex(columns=columns)
+        header = not os.path.exists(output_csv_path)
+        frame.to_csv(output_csv_path, mode="a", header=header, index=False)
+        frame.reindex(columns=PREVIEW_COLUMNS).to_csv(preview_csv_path, mode="a", header=header, index=False)
+        rows.clear()
+
+    for key, entry in load_journal(journal_file).items():
+        if entry.get("dropped_at") or not is_current(entry, input_shas.get(key)):
+            continue
+        rows.append(entry)
+        if len(rows) >= chunk_size:
+            flush()
+    if rows or not os.path.exists(output_csv_path):
+        flush()
+    print(f"Updated CSV saved to {output_csv_path}")
+
+
+def run_species_stream(
+    input_csv_path,
+    output_csv_path,
+    preview_csv_path,
+    url,
+    strategy_folder="strategy_materials",
+    scrape_workers=1,
+    convert_workers=2,
+    llm_workers=4,
+    search_backend=None,
+):
+    os.makedirs(strategy_folder, exist_ok=True)
+    journal_file = f"{output_csv_path}.stream.jsonl"
+    done = load_journal(journal_file)
+    if done:
+        print(f"Resuming: {len(done)} species already in {journal_file}")
+
+    species = pd.read_csv(input_csv_path)
+    add_strategy_columns(species)
+
+    input_shas = {}
+
+    def pending_items():
+        for _, row in species.iterrows():
+            item = {key: (None if pd.isna(value) else value) for key, value in row.items()}
+            key = species_id(item)
+            input_shas[key] = input_sha(item)
+            if is_current(done.get(key), input_shas[key]):
+                instrumentation.increment(STAGE, "rows_skipped")
+                continue
+            profiling.next_row()
+            yield item
+
+    journal_lock = threading.Lock()
+    with open_journal(journal_file) as journal:
+        def on_result(item):
+            instrumentation.increment(STAGE, "rows_processed")
+            with journal_lock:
+                key = species_id(item)
+                append_journal(journal, key, {
+                    "input_sha": input_shas[key],
+                    **{column: item.get(column) for column in output_columns() if column in item},
+                })
+
+        def on_drop(item, step_name):
+            with journal_lock:
+                key = species_id(item)
+                append_journal(journal, key, {"input_sha": input_shas[key], "dropped_at": step_name})
+
+        steps = species_steps(url, strategy_folder, scrape_workers, convert_workers, llm_workers, search_backend)
+        failed = run_stream(pending_items(), steps, on_result, on_drop)
+
+    if failed:
+        print(f"{failed} species failed or ran out of budget and will be retried by the next run.")
+    write_outputs(journal_file, output_csv_path, preview_csv_path, input_shas)
+
+
+@profiling.profile_option(STAGE)
+def main(
+    input_csv_path: str = "st1_kaitsekategooria_selgroogsed_loomad.csv",
+    output_csv_path: str = "st8_birds_data_extracted.csv",
+    preview_csv_path: str = "updated_birds_descriptions.csv",
+    url: str = "https://infoleht.keskkonnainfo.ee/artikkel/1389049207",
+    strategy_folder: str = "strategy_materials",
+    scrape_workers: int = 1,
+    convert_workers: int = 2,
+    llm_workers: int = 4,
+    search_backend: str = None,
+) -> None:
+    run_species_stream(
+        input_csv_path,
+        output_csv_path,
+        preview_csv_path,
+        url,
+        strategy_folder=strategy_folder,
+        scrape_workers=scrape_workers,
+        convert_workers=convert_workers,
+        llm_workers=llm_workers,
+        search_backend=search_backend,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Taxon groups the pipeline can run for.
+
+The group of a run is taken from ``BIODIVERSITY_TAXON`` (default ``birds``),
+so shards started as separate processes each see their own group. A group
+defines the EELIS ``Rühm`` value its species are selected by and the Estonian
+word forms used in the LLM prompts. The st3 columns (``ST3_COLUMNS``) are the
+same for every group: EELIS species pages of all vertebrate groups have the
+same fields.
+
+``BIODIVERSITY_TAXON=all`` selects the species of every group; a sharded run
+resolves EELIS that way once before splitting st3 among its shards.
+"""
+
+import os
+
+DEFAULT_TAXON = "birds"
+ALL_TAXA = "all"
+
+ST3_COLUMNS = (
+    "Estonian Name",
+    "Latin Name",
+    "Category",
+    "EELIS link",
+    "strategy_present",
+    "strategy_file",
+    "Tüüp",
+    "Nimi ladina k",
+    "Nimi eesti k",
+    "Nimi inglise k",
+    "Rühm",
+    "Kaitsekategooria",
+    "Kirjeldus",
+    "Direktiivi lisad",
+    "Liigi ohustatuse hinnang",
+    "Ohutegurite kirjeldus",
+    "Liigi tegevuskava",
+    "Kaitsealused alad, kus on kaitse eesmärgiks",
+)
+
+# Word forms: genitive ("linnu"), partitive ("lindu"), comitative ("linnuga"),
+# comitative of "<taxon> species" ("linnuliigiga") and plural genitive ("lindude")
+TAXON_GROUPS = {
+    "birds": {
+        "ruhm": "Linnud",
+        "genitive": "linnu",
+        "partitive": "lindu",
+        "comitative": "linnuga",
+        "species_comitative": "linnuliigiga",
+        "plural_genitive": "lindude",
+    },
+    "mammals": {
+        "ruhm": "Imetajad",
+        "genitive": "imetaja",
+        "partitive": "imetajat",
+        "comitative": "imetajaga",
+        "species_comitative": "imetajaliigiga",
+        "plural_genitive": "imetajate",
+    },
+    "amphibians": {
+        "ruhm": "Kahepaiksed",
+        "genitive": "kahepaikse",
+        "partitive": "kahepaikset",
+        "comitative": "kahepaiksega",
+        "species_comitative": "kahepaikseliigiga",
+        "plural_genitive": "kahepaiksete",
+    },
+    "reptiles": {
+        "ruhm": "Roomajad",
+        "genitive": "roomaja",
+        "partitive": "roomajat",
+        "comitative": "roomajaga",
+        "species_comitative": "roomajaliigiga",
+        "plural_genitive": "roomajate",
+    },
+    "fish": {
+        "ruhm": "Kalad",
+        "genitive": "kala",
+        "partitive": "kala",
+        "comitative": "kalaga",
+        "species_comitative": "kalaliigiga",
+        "plural_genitive": "kalade",
+    },
+}
+
+
+def current_taxon():
+    """Name of the taxon group of this run."""
+    taxon = os.getenv("BIODIVERSITY_TAXON", DEFAULT_TAXON)
+    if taxon != ALL_TAXA and taxon not in TAXON_GROUPS:
+        raise ValueError(f"Unknown taxon group '{taxon}', expected one of {sorted(TAXON_GROUPS)}")
+    return taxon
+
+
+def taxon_group(taxon=None):
+    """Settings of a taxon group (default: the group of this run)."""
+    taxon = taxon or current_taxon()
+    if taxon == ALL_TAXA:
+        raise ValueError("This run covers all taxon groups; a single group's settings are not defined")
+    return TAXON_GROUPS[taxon]
+
+
+def taxon_ruhm_values(taxon=None):
+    """EELIS ``Rühm`` values of the species of a taxon group, or of all groups."""
+    taxon = taxon or current_taxon()
+    groups = TAXON_GROUPS.values() if taxon == ALL_TAXA else [taxon_group(taxon)]
+    return [group["ruhm"] for group in groups]
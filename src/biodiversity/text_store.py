@@ -0,0 +1,123 @@
+"""
+Span references into the ``_cleaned.txt`` corpus for CSV artifacts.
+
+In span-reference mode the text columns of ``st6``/``st7`` hold references
+instead of the texts themselves::
+
+    @span/<sha256 of the text file>/<start>-<end>[+<start>-<end>...]/<transform>
+
+Several references in one cell are separated by ``|`` and materialise to
+their texts joined by newlines. ``transform`` is ``raw`` (text as stored) or
+``section`` (normalised like the extracted section texts); ``raw`` gives the
+text as ``open(..., "r")`` would read it, i.e. with universal newlines. The text files
+are registered by content hash in ``text_store.json`` so a reference can be
+resolved, and verified, long after the artifact was written.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from .corpus_store import CorpusDocument, normalise_section_text
+from .pdf_text import file_sha256
+
+DEFAULT_STORE_PATH = "text_store.json"
+SPAN_PREFIX = "@span/"
+REFERENCE_SEPARATOR = "|"
+TRANSFORMS = {
+    "raw": lambda text: text.replace("\r\n", "\n").replace("\r", "\n"),
+    "section": normalise_section_text,
+}
+
+_registries = {}
+_open_documents = {}
+
+
+def _registry(store_path):
+    if store_path not in _registries:
+        if os.path.isfile(store_path):
+            with open(store_path, "r", encoding="utf-8") as f:
+                _registries[store_path] = json.load(f)
+        else:
+            _registries[store_path] = {}
+    return _registries[store_path]
+
+
+def register_document(path, store_path=DEFAULT_STORE_PATH):
+    """Register a text file by content hash and return the hash."""
+    sha = file_sha256(path)
+    _registry(store_path)[sha] = str(path)
+    return sha
+
+
+def save_store(store_path=DEFAULT_STORE_PATH):
+    """Write the registry of referenced text files."""
+    registry = _registry(store_path)
+    tmp_path = f"{store_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(registry, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, store_path)
+
+
+def make_reference(sha, ranges, transform="section"):
+    """Build a reference string for byte ``ranges`` [(start, end), ...] of a registered document."""
+    if transform not in TRANSFORMS:
+        raise ValueError(f"Unknown span transform '{transform}'")
+    joined_ranges = "+".join(f"{start}-{end}" for start, end in ranges)
+    return f"{SPAN_PREFIX}{sha}/{joined_ranges}/{transform}"
+
+
+def spans_reference(spans, store_path=DEFAULT_STORE_PATH, transform="section"):
+    """Reference for a list of ``TextSpan`` objects of one ``CorpusDocument``."""
+    sha = register_document(spans[0].document.path, store_path)
+    return make_reference(sha, [(span.start, span.end) for span in spans], transform)
+
+
+def is_reference(value):
+    return isinstance(value, str) and value.startswith(SPAN_PREFIX)
+
+
+def _document(sha, store_path):
+    document = _open_documents.get(sha)
+    if document is not None:
+        return document
+    path = _registry(store_path).get(sha)
+    if path is None or not Path(path).is_file():
+        raise FileNotFoundError(f"Text {sha} is not in the text store {store_path}")
+    if file_sha256(path) != sha:
+        raise ValueError(f"{path} changed since the artifact referencing it was written")
+    document = CorpusDocument(path)
+    _open_documents[sha] = document
+    return document
+
+
+def _materialise_one(reference, store_path):
+    sha, joined_ranges, transform = reference[len(SPAN_PREFIX):].split("/")
+    document = _document(sha, store_path)
+    text = ""
+    for item in joined_ranges.split("+"):
+        start, end = (int(offset) for offset in item.split("-"))
+        text += document.span(start, end).text()
+    return TRANSFORMS[transform](text)
+
+
+def materialise(value, store_path=DEFAULT_STORE_PATH):
+    """Return the text a cell stands for; values that are not references are returned unchanged."""
+    if not is_reference(value):
+        return value
+    texts = (_materialise_one(reference, store_path) for reference in value.split(REFERENCE_SEPARATOR))
+    return "\n".join(text for text in texts if text)
+
+
+def materialise_row(row, columns, store_path=DEFAULT_STORE_PATH):
+    """Materialise the given columns of a row (Series or dict) in place and return it."""
+    for column in columns:
+        if column in row:
+            row[column] = materialise(row[column], store_path)
+    return row
+
+
+def close_documents():
+    for document in _open_documents.values():
+        document.close()
+    _open_documents.clear()
@@ -0,0 +1,289 @@
+"""
+Durable work queue for spreading OCR and LLM work over processes and hosts.
+
+Tasks live in one SQLite file (``work_queue.sqlite`` by default), which may
+sit on a volume shared by several machines; no broker is needed. A task is
+identified by its kind (``ocr``, ``summarise``) and key (a document path or a
+species ID) and goes through
+
+    pending -> leased -> done
+                      -> pending again (failure, released or lease expired)
+                      -> failed (after ``WORK_QUEUE_MAX_ATTEMPTS`` attempts)
+
+A worker claims a task with a lease of ``WORK_QUEUE_LEASE_SECONDS`` (default
+600) and keeps renewing it while it works (``kept_alive``). A worker that dies
+stops renewing, and the task is handed to the next worker that asks once the
+lease has expired. Enqueueing and completion are idempotent. A task already
+in the queue with the same payload is not added again, unless it failed:
+every run gives failed tasks a fresh set of attempts. A task whose payload
+changed (e.g. its document's content hash or its input row) starts over
+with the new payload. Only the first result of a task is kept, so a slow
+worker finishing a reclaimed task changes nothing, and a result is only
+stored for the payload the task was claimed with.
+
+The file uses SQLite's default rollback journal rather than WAL, since WAL
+needs shared memory and only works from a single host.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+
+from . import budget, instrumentation
+
+DEFAULT_QUEUE_PATH = "work_queue.sqlite"
+LEASE_SECONDS = float(os.getenv("WORK_QUEUE_LEASE_SECONDS", "600"))
+MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+POLL_INTERVAL = float(os.getenv("WORK_QUEUE_POLL_INTERVAL", "5"))
+# Seconds to wait for another process's write lock before giving up
+LOCK_TIMEOUT = 60
+
+# ``reclaimed``: the task was taken over from a worker whose lease expired
+Task = namedtuple("Task", ["kind", "key", "payload", "lease_id", "attempts", "reclaimed"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_id TEXT,
+    worker TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (kind, status);
+"""
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+class WorkQueue:
+    def __init__(self, path=DEFAULT_QUEUE_PATH, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = str(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        if getattr(self._local, "db", None) is None:
+            self._local.db = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        return self._local.db
+
+    @contextmanager
+    def _transaction(self):
+        """A write transaction; the lock is taken up front so claims cannot interleave."""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def close(self):
+        if getattr(self._local, "db", None) is not None:
+            self._local.db.close()
+            self._local.db = None
+
+    ### Producers ###
+
+    def enqueue(self, kind, items):
+        """
+        Add tasks from (key, payload) pairs. A key already in the queue is
+        reset to pending if its payload differs or it failed; otherwise it is
+        left as it is.
+
+        :return: Number of tasks added or reset.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany(
+                "INSERT INTO tasks (kind, key, payload, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (kind, key) DO UPDATE SET payload = excluded.payload, status = 'pending', "
+                "attempts = 0, lease_id = NULL, worker = NULL, lease_expires = NULL, result = NULL, "
+                "error = NULL, updated_at = excluded.updated_at "
+                "WHERE tasks.payload != excluded.payload OR tasks.status = 'failed'",
+                [
+                    # default=str: payloads may hold numpy scalars from CSV rows
+                    (kind, key, json.dumps(payload, ensure_ascii=False, default=str), now)
+                    for key, payload in items
+                ],
+            )
+            return db.total_changes - before
+
+    ### Workers ###
+
+    def claim(self, kind, worker=None):
+        """Lease the oldest pending or expired task of ``kind``; None if there is none."""
+        now = time.time()
+        with self._transaction() as db:
+            # Tasks whose workers died on every attempt are given up on
+            db.execute(
+                "UPDATE tasks SET status = 'failed', lease_id = NULL, error = 'lease expired', updated_at = ? "
+                "WHERE kind = ? AND status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, kind, now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT key, payload, attempts, status FROM tasks "
+                "WHERE kind = ? AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+                "ORDER BY rowid LIMIT 1",
+                (kind, now),
+            ).fetchone()
+            if row is None:
+                return None
+            key, payload, attempts, status = row
+            lease_id = uuid.uuid4().hex
+            db.execute(
+                "UPDATE tasks SET status = 'leased', lease_id = ?, worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE kind = ? AND key = ?",
+                (lease_id, worker or worker_name(), now + self.lease_seconds, now, kind, key),
+            )
+        return Task(kind, key, json.loads(payload), lease_id, attempts + 1, status == "leased")
+
+    def _update_lease(self, task, assignments, values):
+        """Apply an update to a task only while ``task`` still holds its lease."""
+        with self._transaction() as db:
+            cursor = db.execute(
+                f"UPDATE tasks SET {assignments}, updated_at = ? "
+                "WHERE kind = ? AND key = ? AND lease_id = ? AND status = 'leased'",
+                (*values, time.time(), task.kind, task.key, task.lease_id),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, task):
+        """Extend the lease; False if it expired and was taken over meanwhile."""
+        return self._update_lease(task, "lease_expires = ?", (time.time() + self.lease_seconds,))
+
+    def release(self, task):
+        """Hand the task back without counting the attempt, e.g. when the token budget ran out."""
+        return self._update_lease(task, "status = 'pending', lease_id = NULL, attempts = attempts - 1", ())
+
+    def fail(self, task, error):
+        """Give the task back for a retry, or mark it failed after the last attempt."""
+        return self._update_lease(
+            task,
+            "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, lease_id = NULL, error = ?",
+            (self.max_attempts, error),
+        )
+
+    def complete(self, task, result):
+        """
+        Store the task's result. The first result wins: completing a task that
+        is already done - by a worker whose lease had expired - is ignored, and
+        so is a result for a payload that was replaced meanwhile.
+
+        :return: Whether this result was stored.
+        """
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET status = 'done', result = ?, lease_id = NULL, error = NULL, updated_at = ? "
+                "WHERE kind = ? AND key = ? AND status != 'done' AND payload = ?",
+                (
+                    json.dumps(result, ensure_ascii=False),
+                    time.time(),
+                    task.kind,
+                    task.key,
+                    json.dumps(task.payload, ensure_ascii=False, default=str),
+                ),
+            )
+            return cursor.rowcount == 1
+
+    @contextmanager
+    def kept_alive(self, task):
+        """Renew the lease of ``task`` in the background while the block runs."""
+        stop = threading.Event()
+
+        def heartbeat():
+            try:
+                while not stop.wait(self.lease_seconds / 3):
+                    if not self.renew(task):
+                        logging.warning(f"Lost the lease on {task.kind} task {task.key}")
+                        return
+            finally:
+                self.close()
+
+        thread = threading.Thread(target=heartbeat, name=f"lease-{task.key}", daemon=True)
+        thread.start()
+        try:
+            yield task
+        finally:
+            stop.set()
+            thread.join()
+
+    ### Progress ###
+
+    def counts(self, kind):
+        """Return {status: number of tasks} for ``kind``."""
+        rows = self._connection().execute(
+            "SELECT status, COUNT(*) FROM tasks WHERE kind = ? GROUP BY status", (kind,)
+        )
+        return dict(rows.fetchall())
+
+    def unfinished(self, kind):
+        counts = self.counts(kind)
+        return counts.get("pending", 0) + counts.get("leased", 0)
+
+    def results(self, kind):
+        """Return {key: result} of the finished tasks of ``kind``."""
+        rows = self._connection().execute(
+            "SELECT key, result FROM tasks WHERE kind = ? AND status = 'done'", (kind,)
+        )
+        return {key: json.loads(result) for key, result in rows.fetchall()}
+
+
+def run_worker(queue, kind, handle, stage, poll_interval=POLL_INTERVAL):
+    """
+    Claim and handle tasks of ``kind`` until none are pending or leased.
+    ``handle(payload)`` returns the task's result. While other workers hold
+    leases this waits, so their tasks are taken over if they die.
+    When the token budget runs out, the task is handed back and the worker stops.
+    Counters are recorded under ``stage``.
+
+    :return: Number of tasks this worker completed.
+    """
+    completed = 0
+    while True:
+        task = queue.claim(kind)
+        if task is None:
+            if not queue.unfinished(kind):
+                return completed
+            time.sleep(poll_interval)
+            continue
+        if task.reclaimed:
+            logging.warning(f"Took over {kind} task {task.key} from an expired lease")
+            instrumentation.increment(stage, "work_queue_leases_reclaimed")
+
+        with queue.kept_alive(task):
+            try:
+                result = handle(task.payload)
+            except budget.BudgetExhausted as e:
+                print(f"{e}. Handing back {kind} task {task.key}; the other tasks stay queued.")
+                queue.release(task)
+                return completed
+            except Exception as e:
+                logging.error(f"{kind} task {task.key} failed (attempt {task.attempts}): {e}")
+                instrumentation.increment(stage, "work_queue_tasks_failed")
+                queue.fail(task, repr(e))
+                continue
+
+        if queue.complete(task, result):
+            completed += 1
+            instrumentation.increment(stage, "work_queue_tasks_completed")
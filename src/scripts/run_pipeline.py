@@ -1,4 +1,7 @@
+import argparse
 import sys
+from functools import partial
+from datetime import datetime
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -8,6 +11,8 @@ from biodiversity import (
     get_extinct_species,
     parse_EELIS_links,
     EELIS_data,
+    EELIS_fused,
+    EELIS_export,
     get_species_google_strategies,
     prepare_strategy_files,
     extract_and_process_reports,
@@ -15,21 +20,211 @@ from biodiversity import (
     extract_relevant_sections,
     extract_sections_texts,
     extract_analysis_data,
+    species_stream,
 )
+from biodiversity import budget, instrumentation, profiling
+from biodiversity.get_extinct_species import SPECIES_LIST_FILENAME
+from biodiversity.shards import run_shards
+from biodiversity.work_queue import DEFAULT_QUEUE_PATH
 
+STAGES = [
+    ("get_extinct_species", get_extinct_species),
+    ("parse_EELIS_links", parse_EELIS_links),
+    ("EELIS_data", EELIS_data),
+    ("get_species_google_strategies", get_species_google_strategies),
+    ("prepare_strategy_files", prepare_strategy_files),
+    ("extract_and_process_reports", extract_and_process_reports),
+    ("extract_analysis_data", extract_analysis_data),
+    ("extract_relevant_sections", extract_relevant_sections),
+    ("extract_sections_texts", extract_sections_texts),
+    ("extract_birds_info_from_text", extract_birds_info_from_text),
+]
 
-def run_full_pipeline() -> None:
-    get_extinct_species()
-    parse_EELIS_links()
-    EELIS_data()
-    get_species_google_strategies()
-    prepare_strategy_files()
-    extract_and_process_reports()
-    extract_birds_info_from_text()
-    extract_relevant_sections()
-    extract_sections_texts()
-    extract_analysis_data()
+# Stages that resolve st1 species to EELIS pages and write st3; run once for all shards
+EELIS_STAGE_NAMES = ("parse_EELIS_links", "EELIS_data", "EELIS_fused", "EELIS_export")
+
+
+# Replaces parse_EELIS_links + EELIS_data with one browser session
+FUSED_EELIS_STAGES = [("EELIS_fused", EELIS_fused)]
+
+
+# Stages that can share their tasks with run_worker.py workers through a work queue
+WORK_QUEUE_STAGES = ("extract_and_process_reports", "extract_birds_info_from_text")
+
+# Species flow through all per-species stages at once (see species_stream)
+PIPELINED_STAGES = [STAGES[0], ("species_stream", species_stream)]
+
+
+# Options the pipelined species stream has no use for
+PIPELINED_CONFLICTS = ("--fused-eelis", "--eelis-export", "--taxa", "--streaming", "--work-queue")
+
+
+def pipeline_stages(fused_eelis=False, eelis_export=None, streaming=False, pipelined=False, work_queue=None):
+    if pipelined and (fused_eelis or eelis_export or streaming or work_queue):
+        raise ValueError(f"Pipelined runs cannot be combined with {', '.join(PIPELINED_CONFLICTS)}")
+
+    if work_queue:
+        # Relative to the working directory, so every shard gets its own queue
+        return [
+            (name, partial(stage, work_queue_path=work_queue) if name in WORK_QUEUE_STAGES else stage)
+            for name, stage in pipeline_stages(fused_eelis, eelis_export, streaming, pipelined)
+        ]
+
+    if pipelined:
+        return PIPELINED_STAGES
+
+    if streaming:
+        # Summarise species crash-safely, resuming from the results journal
+        return [
+            (name, partial(stage, streaming=True) if name == "extract_birds_info_from_text" else stage)
+            for name, stage in pipeline_stages(fused_eelis, eelis_export)
+        ]
+
+    if eelis_export:
+        export_path = str(Path(eelis_export).resolve())
+        eelis_stages = [("EELIS_export", partial(EELIS_export, export_path=export_path))]
+    elif fused_eelis:
+        eelis_stages = FUSED_EELIS_STAGES
+    else:
+        return STAGES
+
+    stages = []
+    for stage_name, stage in STAGES:
+        if stage_name == "parse_EELIS_links":
+            stages.extend(eelis_stages)
+        elif stage_name != "EELIS_data":
+            stages.append((stage_name, stage))
+    return stages
+
+
+def default_run_dir() -> Path:
+    return Path("runs") / datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def run_full_pipeline(
+    run_dir=None,
+    fused_eelis=False,
+    eelis_export=None,
+    taxa=None,
+    shard_workers=None,
+    profile=None,
+    streaming=False,
+    pipelined=False,
+    work_queue=None,
+) -> None:
+    """
+    Run all stages. With ``taxa``, stage 1 and the EELIS stages run once and
+    the remaining stages run per taxon group in parallel shards under ``run_dir/shards``.
+    With ``profile`` (a profiling mode) every stage is profiled into ``run_dir/profiles``.
+    With ``work_queue`` (a queue file) OCR and summarisation tasks are shared with run_worker.py workers.
+    """
+    if taxa and pipelined:
+        raise ValueError("Pipelined runs scrape EELIS per species and cannot be sharded by taxon group")
+    run_dir = Path(run_dir) if run_dir else default_run_dir()
+    instrumentation.reset()
+    budget.reset()
+    started_at = datetime.now().isoformat()
+    stages = pipeline_stages(fused_eelis, eelis_export, streaming, pipelined, work_queue)
+    extra = {"started_at": started_at}
+    profile_dir = run_dir / "profiles"
+
+    try:
+        if taxa:
+            stage_name, stage = stages[0]
+            with instrumentation.stage_timer(stage_name), \
+                    profiling.profiled(stage_name, profile_dir, mode=profile):
+                stage()
+            eelis_stages = [(name, stage) for name, stage in stages[1:] if name in EELIS_STAGE_NAMES]
+            shard_stages = [(name, stage) for name, stage in stages[1:] if name not in EELIS_STAGE_NAMES]
+            extra["shards"] = run_shards(
+                taxa,
+                run_dir,
+                eelis_stages,
+                shard_stages,
+                SPECIES_LIST_FILENAME,
+                max_workers=shard_workers,
+                profile=profile,
+            )
+        else:
+            for stage_name, stage in stages:
+                with instrumentation.stage_timer(stage_name), \
+                        profiling.profiled(stage_name, profile_dir, mode=profile):
+                    stage()
+    finally:
+        extra["llm_tokens_spent"] = budget.spent()
+        instrumentation.write_run_report(run_dir / "run_report.json", extra=extra)
+        instrumentation.write_openmetrics(run_dir / "metrics.txt")
 
 
 if __name__ == "__main__":
-    run_full_pipeline()
+    parser = argparse.ArgumentParser(description="Run the full biodiversity pipeline.")
+    parser.add_argument(
+        "--run-dir",
+        default=None,
+        help="Directory for the run report and metrics (default: runs/<timestamp>).",
+    )
+    parser.add_argument(
+        "--fused-eelis",
+        action="store_true",
+        help="Resolve EELIS links and scrape species pages in one browser session.",
+    )
+    parser.add_argument(
+        "--eelis-export",
+        default=None,
+        help="Build st2/st3 from this downloaded EELIS registry export (CSV or XML) instead of scraping.",
+    )
+    parser.add_argument(
+        "--taxa",
+        default=None,
+        help="Comma-separated taxon groups (e.g. birds,mammals,amphibians,fish) to run as parallel shards.",
+    )
+    parser.add_argument(
+        "--shard-workers",
+        type=int,
+        default=None,
+        help="Number of shard worker processes (default: one per taxon group).",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="cprofile",
+        default=None,
+        choices=profiling.PROFILE_MODES,
+        help="Profile every stage (default mode: cprofile) into <run dir>/profiles.",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Summarise species in streaming mode: results are journalled per species and a restart resumes.",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="After stage 1, stream each species through scrape, download, convert/OCR, sections and "
+        "summarisation through bounded queues instead of running the stages one after another.",
+    )
+    parser.add_argument(
+        "--work-queue",
+        nargs="?",
+        const=DEFAULT_QUEUE_PATH,
+        default=None,
+        help=f"Share OCR and summarisation tasks with run_worker.py workers through this queue file "
+        f"(default: {DEFAULT_QUEUE_PATH}), e.g. on a shared volume.",
+    )
+    args = parser.parse_args()
+    if args.pipelined:
+        values = (args.fused_eelis, args.eelis_export, args.taxa, args.streaming, args.work_queue)
+        conflicting = [flag for flag, value in zip(PIPELINED_CONFLICTS, values) if value]
+        if conflicting:
+            parser.error(f"--pipelined cannot be combined with {', '.join(conflicting)}")
+    run_full_pipeline(
+        run_dir=args.run_dir,
+        fused_eelis=args.fused_eelis,
+        eelis_export=args.eelis_export,
+        taxa=[taxon.strip() for taxon in args.taxa.split(",")] if args.taxa else None,
+        shard_workers=args.shard_workers,
+        profile=args.profile,
+        streaming=args.streaming,
+        pipelined=args.pipelined,
+        work_queue=args.work_queue,
+    )
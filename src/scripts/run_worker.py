@@ -0,0 +1,53 @@
+import argparse
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from biodiversity import instrumentation
+from biodiversity.extract_and_process_reports import OCR_TASK, ocr_worker
+from biodiversity.extract_birds_info_from_text import SUMMARISE_TASK, summarise_worker
+from biodiversity.ocr import DEFAULT_CACHE_DIR, OCR_DPI
+
+
+def run_worker(kind, queue_path, directory="strategy_materials", dpi=OCR_DPI, ocr_engine_name=None,
+               ocr_cache_dir=DEFAULT_CACHE_DIR, metrics_path=None) -> None:
+    """
+    Join a run as an extra worker: work off the ``kind`` tasks of the queue at
+    ``queue_path`` until none are left, then write this worker's metrics.
+    """
+    instrumentation.reset()
+    try:
+        if kind == OCR_TASK:
+            ocr_worker(queue_path, directory, dpi=dpi, engine_name=ocr_engine_name, cache_dir=ocr_cache_dir)
+        else:
+            summarise_worker(queue_path)
+    finally:
+        if metrics_path:
+            instrumentation.write_openmetrics(metrics_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Work off OCR or summarisation tasks of a pipeline run's queue.")
+    parser.add_argument("kind", choices=(OCR_TASK, SUMMARISE_TASK))
+    parser.add_argument("--queue", required=True, help="Work queue file of the run, e.g. on a shared volume.")
+    parser.add_argument(
+        "--directory",
+        default="strategy_materials",
+        help="Strategy documents directory as seen from this host (ocr only).",
+    )
+    parser.add_argument("--dpi", type=int, default=OCR_DPI, help="OCR rendering resolution (ocr only).")
+    parser.add_argument("--ocr-engine", default=None, help="tesserocr or pytesseract (ocr only).")
+    parser.add_argument("--ocr-cache-dir", default=DEFAULT_CACHE_DIR, help="OCR page cache directory (ocr only).")
+    parser.add_argument("--metrics", default=None, help="Write this worker's OpenMetrics counters to this file.")
+    args = parser.parse_args()
+    run_worker(
+        args.kind,
+        args.queue,
+        directory=args.directory,
+        dpi=args.dpi,
+        ocr_engine_name=args.ocr_engine,
+        ocr_cache_dir=args.ocr_cache_dir,
+        metrics_path=args.metrics,
+    )
@@ -0,0 +1,23 @@
+"""
+Shared test setup. The stages create their OpenAI clients when the package is
+imported, so the LLM stand-in's address is fixed here, before any test module
+imports ``biodiversity``.
+"""
+
+import os
+import socket
+import sys
+from pathlib import Path
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+LLM_PORT = free_port()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{LLM_PORT}/v1"
+os.environ.setdefault("OPENAIKEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
@@ -0,0 +1,51 @@
+"""Tests of the shared PDF text cache."""
+
+import fitz
+import pytest
+
+from biodiversity import pdf_text
+from biodiversity.pdf_text import cached_pdf_text, cleaned_txt_path, stamp_cleaned_txt
+from biodiversity.species_index import anchor_lines, empty_index, species_terms, update_index
+
+
+@pytest.fixture(autouse=True)
+def empty_memory_cache():
+    pdf_text._memory_cache.clear()
+    yield
+    pdf_text._memory_cache.clear()
+
+
+def write_image_only_pdf(path):
+    """A PDF without a text layer, like a scanned report before OCR."""
+    document = fitz.open()
+    document.new_page()
+    document.save(path)
+    document.close()
+
+
+def test_cleaned_txt_written_after_text_layer_was_read_is_used(tmp_path):
+    pdf_path = tmp_path / "scan.pdf"
+    write_image_only_pdf(pdf_path)
+    cache_dir = tmp_path / "cache"
+
+    assert cached_pdf_text(pdf_path, cache_dir).strip() == ""
+
+    cleaned_txt_path(pdf_path).write_text("Liigi kirjeldus\nmerikotkas pesitseb rannikul.\n", encoding="utf-8")
+    stamp_cleaned_txt(pdf_path)
+
+    assert "merikotkas" in cached_pdf_text(pdf_path, cache_dir)
+
+
+def test_index_picks_up_ocr_text_of_image_only_pdf(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pdf_path = tmp_path / "scan.pdf"
+    write_image_only_pdf(pdf_path)
+    index = empty_index()
+    index["species"]["merikotkas"] = species_terms("merikotkas")
+
+    update_index(index, [str(pdf_path)])
+    cleaned_txt_path(pdf_path).write_text("Liigi kirjeldus\nmerikotkas pesitseb rannikul.\n", encoding="utf-8")
+    stamp_cleaned_txt(pdf_path)
+    update_index(index, [str(pdf_path)])
+
+    assert anchor_lines(index, "merikotkas", str(pdf_path)) == [1]
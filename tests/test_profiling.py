@@ -0,0 +1,29 @@
+"""Tests of the built-in stage profiling."""
+
+import threading
+
+from biodiversity import profiling
+
+
+def test_cprofile_batches_advanced_by_worker_threads(tmp_path):
+    with profiling.profiled("stage", directory=tmp_path, mode="cprofile", batch_size=2):
+        profiling.next_row()
+        profiling.next_row()
+        worker = threading.Thread(target=profiling.next_row)
+        worker.start()
+        worker.join()
+        sum(range(1000))
+
+    assert (tmp_path / "stage.prof").is_file()
+    assert "rows_00000-00001" in (tmp_path / "stage.top.txt").read_text(encoding="utf-8")
+
+
+def test_stage_thread_follows_batch_started_by_worker(tmp_path):
+    with profiling.profiled("stage", directory=tmp_path, mode="cprofile", batch_size=1):
+        worker = threading.Thread(target=profiling.next_row)
+        worker.start()
+        worker.join()
+        profiling.next_row()
+        sum(range(1000))
+
+    assert (tmp_path / "stage.rows_00001-00001.prof").is_file()
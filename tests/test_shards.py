@@ -0,0 +1,137 @@
+"""
+Smoke test of a sharded run with the real stage functions.
+
+EELIS comes from a registry export, the strategy documents from a local HTTP
+server and LLM answers from the synthesising stand-in server, so no browser,
+search engine or API key is needed.
+"""
+
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import fitz
+import pandas as pd
+import pytest
+
+from biodiversity.EELIS_export import main as eelis_export
+from biodiversity.extract_analysis_data import main as extract_analysis_data
+from biodiversity.extract_and_process_reports import main as extract_and_process_reports
+from biodiversity.extract_birds_info_from_text import main as extract_birds_info_from_text
+from biodiversity.extract_relevant_sections import main as extract_relevant_sections
+from biodiversity.extract_sections_texts import main as extract_sections_texts
+from biodiversity.get_species_google_strategies import main as get_species_google_strategies
+from biodiversity.llm_stub_server import StubConfig, StubHandler
+from biodiversity.prepare_strategy_files import main as prepare_strategy_files
+from biodiversity.shards import eelis_dir, run_shards, shard_dir
+
+# Fixed by conftest.py before the package was imported
+LLM_PORT = urlsplit(os.environ["OPENAI_BASE_URL"]).port
+
+SPECIES = [
+    # Estonian name, Latin name, Rühm
+    ("merikotkas", "Haliaeetus albicilla", "Linnud"),
+    ("kalakotkas", "Pandion haliaetus", "Linnud"),
+    ("saarmas", "Lutra lutra", "Imetajad"),
+]
+
+
+def serve_in_thread(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def write_pdf(path, text):
+    document = fitz.open()
+    document.new_page().insert_text((72, 72), text)
+    document.save(path)
+    document.close()
+
+
+@pytest.fixture
+def document_server(tmp_path):
+    """Serve ``tmp_path/web`` over HTTP; yields the directory and its base URL."""
+    web = tmp_path / "web"
+    web.mkdir()
+    handler = partial(SimpleHTTPRequestHandler, directory=str(web))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = serve_in_thread(server)
+    yield web, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    thread.join()
+
+
+@pytest.fixture
+def llm_stand_in(tmp_path):
+    config = StubConfig(mode="synth", cassette_dir=str(tmp_path / "llm_cassettes"))
+    handler = type("TestStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", LLM_PORT), handler)
+    thread = serve_in_thread(server)
+    yield config
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_run_shards_splits_eelis_once_and_runs_stages_in_order(
+    tmp_path, document_server, llm_stand_in, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    web, base_url = document_server
+
+    export_rows = []
+    for estonian, latin, ruhm in SPECIES:
+        write_pdf(
+            web / f"{estonian}.pdf",
+            f"{estonian} kaitse tegevuskava\n1. Liigi kirjeldus\n{estonian} elupaik.\n2. Ohutegurid\nHäirimine.",
+        )
+        export_rows.append({
+            "Nimi ladina k": latin,
+            "Nimi eesti k": estonian,
+            "Rühm": ruhm,
+            "Kaitsekategooria": "II",
+            "Liigi tegevuskava": f"{base_url}/{estonian}.pdf",
+        })
+    pd.DataFrame(export_rows).to_csv(tmp_path / "export.csv", index=False)
+    species_list = tmp_path / "st1.csv"
+    pd.DataFrame(
+        [(estonian, latin, "II") for estonian, latin, _ in SPECIES],
+        columns=["Estonian Name", "Latin Name", "Category"],
+    ).to_csv(species_list, index=False)
+
+    run_dir = tmp_path / "run"
+    results = run_shards(
+        ["birds", "mammals"],
+        run_dir,
+        [("EELIS_export", partial(eelis_export, export_path=str(tmp_path / "export.csv")))],
+        [
+            ("get_species_google_strategies", partial(get_species_google_strategies, backend="local")),
+            ("prepare_strategy_files", prepare_strategy_files),
+            ("extract_and_process_reports", extract_and_process_reports),
+            ("extract_analysis_data", extract_analysis_data),
+            ("extract_relevant_sections", extract_relevant_sections),
+            ("extract_sections_texts", extract_sections_texts),
+            ("extract_birds_info_from_text", extract_birds_info_from_text),
+        ],
+        species_list,
+    )
+
+    assert results == {"birds": "ok", "mammals": "ok"}
+    # Strategy documents were downloaded once, by the EELIS pass
+    assert sorted(path.name for path in (eelis_dir(run_dir) / "strategy_materials").glob("*.pdf")) == [
+        "kalakotkas.pdf", "merikotkas.pdf", "saarmas.pdf",
+    ]
+    for taxon, expected in (("birds", {"merikotkas", "kalakotkas"}), ("mammals", {"saarmas"})):
+        directory = shard_dir(run_dir, taxon)
+        assert set(pd.read_csv(directory / "st3_EELIS_additional_data.csv")["Estonian Name"]) == expected
+        assert set(pd.read_csv(directory / "st4_pdf_gathered.csv")["Estonian Name"]) == expected
+        assert set(pd.read_csv(directory / "st8_birds_data_extracted.csv")["Estonian Name"]) == expected
+        for name in expected:
+            cleaned = directory / "strategy_materials" / f"{name}_cleaned.txt"
+            assert "kaitse tegevuskava" in cleaned.read_text(encoding="utf-8")
+    combined = pd.read_csv(run_dir / "combined_st8_birds_data_extracted.csv")
+    assert sorted(combined["Taxon"]) == ["birds", "birds", "mammals"]
+    assert llm_stand_in.stats["synthesised"] > 0
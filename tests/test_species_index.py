@@ -0,0 +1,97 @@
+"""Tests of the incremental species mention index."""
+
+import fitz
+import pandas as pd
+import pytest
+
+from biodiversity import pdf_text
+from biodiversity.species_index import anchor_lines, empty_index, term_positions, update_index
+
+
+@pytest.fixture(autouse=True)
+def isolated_text_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pdf_text._memory_cache.clear()
+    yield
+    pdf_text._memory_cache.clear()
+
+
+def write_pdf(path, lines):
+    document = fitz.open()
+    page = document.new_page()
+    for number, line in enumerate(lines):
+        page.insert_text((72, 72 + 20 * number), line)
+    document.save(path)
+    document.close()
+    return str(path)
+
+
+def species(*names):
+    return pd.DataFrame({"Estonian Name": list(names), "Latin Name": [None] * len(names)})
+
+
+def test_documents_are_scanned_for_species_added_after_they_were_indexed(tmp_path):
+    a = write_pdf(tmp_path / "a.pdf", ["merikotkas pesitseb", "kalakotkas toitub"])
+    b = write_pdf(tmp_path / "b.pdf", ["kalakotkas rannikul"])
+    index = empty_index()
+
+    update_index(index, [a], species("merikotkas"))
+    update_index(index, [b], species("kalakotkas"))
+    update_index(index, [a, b])
+
+    assert len(term_positions(index, "kalakotkas", "name", a)) == 1
+    assert len(term_positions(index, "kalakotkas", "name", b)) == 1
+    assert len(term_positions(index, "merikotkas", "name", a)) == 1
+    assert index["documents"]["a.pdf"]["terms"] == index["documents"]["b.pdf"]["terms"]
+
+
+def test_unchanged_documents_are_not_read_again(tmp_path, monkeypatch):
+    a = write_pdf(tmp_path / "a.pdf", ["merikotkas pesitseb"])
+    index = update_index(empty_index(), [a], species("merikotkas"))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("unchanged document was read again")
+
+    monkeypatch.setattr("biodiversity.species_index.read_pdf_text", fail)
+    update_index(index, [a], species("merikotkas"))
+
+    assert anchor_lines(index, "merikotkas", a) == [0]
+
+
+def test_changed_document_is_reindexed(tmp_path):
+    a = write_pdf(tmp_path / "a.pdf", ["merikotkas pesitseb"])
+    index = update_index(empty_index(), [a], species("merikotkas"))
+    write_pdf(tmp_path / "a.pdf", ["sissejuhatus", "merikotkas pesitseb"])
+
+    update_index(index, [a])
+
+    assert anchor_lines(index, "merikotkas", a) == [1]
+
+
+def test_index_records_the_fingerprint_of_the_text_it_read(tmp_path, monkeypatch):
+    a = write_pdf(tmp_path / "a.pdf", ["merikotkas pesitseb"])
+    index = empty_index()
+    read_pdf_text = pdf_text.read_pdf_text
+
+    def ocr_finishes_before_read(pdf_path, *args, **kwargs):
+        pdf_text.cleaned_txt_path(pdf_path).write_text("kalakotkas\nmerikotkas\n", encoding="utf-8")
+        pdf_text.stamp_cleaned_txt(pdf_path)
+        return read_pdf_text(pdf_path, *args, **kwargs)
+
+    monkeypatch.setattr("biodiversity.species_index.read_pdf_text", ocr_finishes_before_read)
+    update_index(index, [a], species("merikotkas"))
+
+    assert index["documents"]["a.pdf"]["fingerprint"] == pdf_text.text_fingerprint(a)
+    assert anchor_lines(index, "merikotkas", a) == [1]
+
+
+def test_anchor_lines_is_none_when_the_index_cannot_answer(tmp_path):
+    a = write_pdf(tmp_path / "a.pdf", ["merikotkas pesitseb"])
+    blank = write_pdf(tmp_path / "blank.pdf", [])
+    index = update_index(empty_index(), [a, blank], species("merikotkas"))
+    index["species"]["kalakotkas"] = {"name": "kalakotkas", "stem": "kalakotk"}
+
+    assert anchor_lines(index, "merikotkas", a) == [0]
+    assert anchor_lines(index, "merikotkas", str(tmp_path / "unknown.pdf")) is None
+    assert anchor_lines(index, "merikotkas", blank) is None
+    assert anchor_lines(index, "kalakotkas", a) is None